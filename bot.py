@@ -3,22 +3,52 @@
 
 import os
 import sqlite3
+import subprocess
 import sys
+from collections import OrderedDict, defaultdict, deque
 from contextlib import closing
 from datetime import datetime, timedelta, date
-from typing import Dict, Optional, Tuple, List, Callable, Any
+from typing import Dict, Optional, Set, Tuple, List, Callable, Any
 from pathlib import Path
+from types import SimpleNamespace
 from dataclasses import dataclass
-import calendar
 import logging
+import time
 import difflib
+import hmac
+import random
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from io import StringIO
+from itertools import groupby
+from operator import itemgetter
+
+# RapidFuzz (C++) для нечеткого поиска; без него — difflib
+try:
+    from rapidfuzz import fuzz, process as fuzz_process
+    RAPIDFUZZ_AVAILABLE = True
+except ImportError:
+    RAPIDFUZZ_AVAILABLE = False
+
+@lru_cache(maxsize=32)
+def _match_index(items: Tuple[Tuple[int, str], ...]) -> Tuple[List[str], Dict[str, int]]:
+    """Названия в нижнем регистре и индекс name -> позиция; один раз на каждый список вариантов."""
+    names = [name.lower() for _, name in items]
+    exact: Dict[str, int] = {}
+    for i, name in enumerate(names):
+        exact.setdefault(name, i)
+    return names, exact
 
 def find_best_match(user_input: str, items: List[Tuple[int, str]]) -> Optional[Tuple[int, str]]:
     """
     Ищет лучший вариант в списке (id, name).
     Поддерживает:
     1. Точное совпадение номера (1, 2, 3...)
-    2. Нечеткий поиск по названию (difflib)
+    2. Точное совпадение названия (без учета регистра)
+    3. Название из списка, целиком входящее в ввод (самое длинное)
+    4. Нечеткий поиск по названию (RapidFuzz, иначе difflib)
     """
     text = user_input.strip()
     if not text:
@@ -30,12 +60,28 @@ def find_best_match(user_input: str, items: List[Tuple[int, str]]) -> Optional[T
         if 0 <= idx < len(items):
             return items[idx]
     
-    # 2. Пробуем нечеткий поиск по названию
-    name_map = {item[1].lower(): item for item in items}
-    matches = difflib.get_close_matches(text.lower(), name_map.keys(), n=1, cutoff=0.4)
+    names, exact = _match_index(tuple(items))
+    low = text.lower()
+    
+    # 2. Точное название без учета регистра — один поиск по словарю
+    hit = exact.get(low)
+    if hit is not None:
+        return items[hit]
+    
+    # 3. Подстрочный поиск (в C) — при попадании нечеткий поиск не нужен
+    hits = [i for i, name in enumerate(names) if name and name in low]
+    if hits:
+        return items[max(hits, key=lambda i: len(names[i]))]
+    
+    # 4. Пробуем нечеткий поиск по названию (порог как у difflib cutoff=0.4)
+    if RAPIDFUZZ_AVAILABLE:
+        match = fuzz_process.extractOne(low, names, scorer=fuzz.ratio, score_cutoff=40)
+        return items[match[2]] if match else None
+    
+    matches = difflib.get_close_matches(low, names, n=1, cutoff=0.4)
     
     if matches:
-        return name_map[matches[0]]
+        return items[names.index(matches[0])]
     
     return None
 
@@ -44,16 +90,10 @@ from whatsapp_360_client import WhatsApp360Client, Button, MessageObject, Callba
 from dotenv import load_dotenv
 from flask import Flask, request, jsonify
 
-# Google Sheets API
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-
 # Scheduler для автоматического экспорта
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+import pytz
 
 # -----------------------------
 # Конфиг
@@ -91,11 +131,15 @@ if not VERIFY_TOKEN:
 
 TZ = os.getenv("TZ", "Europe/Moscow").strip()
 
+# Все нецифровые символы номера (+, пробелы, скобки, дефисы)
+_NON_DIGIT_RE = re.compile(r"\D")
+
+@lru_cache(maxsize=4096)
 def _normalize_phone(phone: str) -> str:
     """Нормализует номер телефона: убирает все нецифровые символы"""
     if not phone:
         return ""
-    return "".join(filter(str.isdigit, phone))
+    return _NON_DIGIT_RE.sub("", phone)
 
 def _parse_admin_ids(s: str) -> List[str]:
     out = []
@@ -107,49 +151,59 @@ def _parse_admin_ids(s: str) -> List[str]:
             out.append(normalized)
     return out
 
-ADMIN_IDS = set(_parse_admin_ids(os.getenv("ADMIN_IDS", "")))
+ADMIN_IDS = frozenset(_parse_admin_ids(os.getenv("ADMIN_IDS", "")))
 logging.info(f"🔧 ADMIN_IDS loaded: {ADMIN_IDS}")
 
-IT_IDS = set(_parse_admin_ids(os.getenv("IT_IDS", "")))
+IT_IDS = frozenset(_parse_admin_ids(os.getenv("IT_IDS", "")))
 logging.info(f"🔧 IT_IDS loaded: {IT_IDS}")
 
-TIM_IDS = set(_parse_admin_ids(os.getenv("TIM_IDS", "")))
+TIM_IDS = frozenset(_parse_admin_ids(os.getenv("TIM_IDS", "")))
 logging.info(f"🔧 TIM_IDS loaded: {TIM_IDS}")
 
 # -----------------------------
 # Роли и права доступа (перемещено вверх)
 # -----------------------------
 
+# *_IDS уже нормализованы в _parse_admin_ids, поэтому достаточно одной проверки
 def is_admin(user_id: str) -> bool:
-    norm = _normalize_phone(user_id)
-    return (user_id in ADMIN_IDS) or (norm and norm in ADMIN_IDS)
+    return _normalize_phone(user_id) in ADMIN_IDS
 
 def is_it(user_id: str) -> bool:
-    norm = _normalize_phone(user_id)
-    return (user_id in IT_IDS) or (norm and norm in IT_IDS)
+    return _normalize_phone(user_id) in IT_IDS
 
 def is_tim(user_id: str) -> bool:
     """Проверка на роль TIM (Первый зам директора по ИТ)"""
-    norm = _normalize_phone(user_id)
-    return (user_id in TIM_IDS) or (norm and norm in TIM_IDS)
+    return _normalize_phone(user_id) in TIM_IDS
+
+# Роль бригадира хранится в БД: кэшируем ответ на ROLE_CACHE_TTL секунд.
+# add_brigadier/remove_brigadier сбрасывают кэш сразу, TTL ограничивает
+# устаревание, если таблицу поменяли в обход бота
+ROLE_CACHE_TTL = 60
 
 def is_brigadier(user_id: str) -> bool:
+    return _is_brigadier_cached(user_id, int(time.monotonic() // ROLE_CACHE_TTL))
+
+@lru_cache(maxsize=1024)
+def _is_brigadier_cached(user_id: str, _epoch: int) -> bool:
     # Check in DB
     with connect() as con, closing(con.cursor()) as c:
         # Проверяем наличие в таблице бригадиров
-        exists = c.execute("SELECT 1 FROM brigadiers WHERE user_id=?", (user_id,)).fetchone()
+        exists = c.execute(SQL_IS_BRIGADIER, (user_id,)).fetchone()
         if exists:
             return True
         # Проверяем нормализованный номер
         norm = _normalize_phone(user_id)
         if norm and norm != user_id:
-            exists = c.execute("SELECT 1 FROM brigadiers WHERE user_id=?", (norm,)).fetchone()
+            exists = c.execute(SQL_IS_BRIGADIER, (norm,)).fetchone()
             if exists:
                 return True
     return False
 
 # GitHub Webhook секрет для автоматического обновления
 GITHUB_WEBHOOK_SECRET = os.getenv("GITHUB_WEBHOOK_SECRET", "")
+GITHUB_WEBHOOK_SECRET_BYTES = GITHUB_WEBHOOK_SECRET.encode()
+UPDATE_SCRIPT_PATH = "/root/bot/update_bot.sh"
+UPDATE_LOG_PATH = "/root/bot/update.log"  # тот же лог, что ведет сам update_bot.sh
 if GITHUB_WEBHOOK_SECRET:
     logging.info("✅ GitHub Webhook секрет загружен")
 else:
@@ -253,6 +307,69 @@ GROUP_KAMAZ = "камаз" # Новый тип
 GROUP_FIELDS = "поля"
 GROUP_WARE = "склад"
 
+# Названия месяцев по-русски (индекс = номер месяца, [0] — пустая строка);
+# calendar.month_name зависит от локали процесса (по умолчанию — английские названия)
+MONTH_NAMES = (
+    "", "Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
+    "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь",
+)
+# Сколько записей показывать в детализации статистики (итоги считаются по всем)
+STATS_DETAIL_LIMIT = 50
+
+# Общие кнопки: создаются один раз, клиент их не изменяет
+BTN_BACK = Button(title="🔙 Назад", callback_data="back:prev")
+BACK_BUTTONS = (BTN_BACK,)
+CONFIRM_BRIG_BUTTONS = (
+    Button(title="✅ Подтвердить", callback_data="confirm:brig"),
+    Button(title="✏️ Изменить", callback_data="edit:brig"),
+)
+_BRIG_ADMIN_MENU = (
+    Button(title="➕ Добавить бригадира", callback_data="adm:add:brigadier"),
+    Button(title="➖ Удалить бригадира", callback_data="adm:del:brigadier"),
+    Button(title="📋 Список бригадиров", callback_data="adm:list:brigadiers"),
+)
+_LOC_ADMIN_MENU = (
+    Button(title="➕ Добавить локацию", callback_data="adm:add:loc"),
+    Button(title="➖ Удалить локацию", callback_data="adm:del:loc"),
+    BTN_BACK,
+)
+_ACT_ADMIN_MENU = (
+    Button(title="🚜 Техника", callback_data="adm:del:act:tech"),
+    Button(title="✋ Ручная", callback_data="adm:del:act:hand"),
+    BTN_BACK,
+)
+
+# Главное меню по ролям
+_MENU_TIM_BUTTONS = (
+    Button(title="🇨🇳 Партия следить 🇨🇳", callback_data="tim:party"),
+    Button(title="📊 Статистика", callback_data="menu:stats"),
+    Button(title="✏️ Сменить имя", callback_data="menu:name"),
+)
+_MENU_IT_BUTTONS = (
+    Button(title="⭐", callback_data="it:star"),
+    Button(title="📊 Статистика", callback_data="menu:stats"),
+)
+# Бригадир: ОБ, ОТД, Настройки (статистика внутри настроек)
+_MENU_BRIG_BUTTONS = (
+    Button(title="👷 ОБ (Отчет)", callback_data="brig:report"),
+    Button(title="🚜 ОТД", callback_data="brig:work"),
+    Button(title="⚙️ Настройки", callback_data="brig:settings"),
+)
+_MENU_WORKER_BUTTONS = (
+    Button(title="🚜 ОТД", callback_data="menu:work"),
+    Button(title="📊 Статистика", callback_data="menu:stats"),
+    Button(title="⚙️ Настройки", callback_data="menu:settings"), # Вместо Ещё
+)
+_MENU_IT_COMMANDS = (
+    "*Команды:*\n"
+    "• `admin` - админское меню\n"
+    "• `briq` - бригадирское меню\n"
+    "• `tim` - меню TIM\n"
+    "• `rb1` - меню работяги\n"
+    "• `sts` - статистика"
+)
+_ADMIN_HINT = "\n\n🛠 *Команды админа:*\n`/бриг` - Управление бригадирами\n`00` - В главное меню\n`sts` - Статистика\n`admin` - Админ панель"
+
 def build_manual_location_lines(locations: List[Tuple[int, str]]) -> List[str]:
     """
     Формирует список строк для выбора локации в ручной работе:
@@ -270,22 +387,60 @@ WELCOME_MESSAGE = "Добро пожаловать! Этот бот поможе
 # -----------------------------
 
 user_states: Dict[str, dict] = {}
-user_history: Dict[str, list] = {}  # История состояний для возврата назад
-processed_messages: set = set()
+USER_HISTORY_MAX = 10  # Сколько шагов назад помним
+user_history: Dict[str, deque] = {}  # История состояний для возврата назад (старые вытесняются сами)
+# msg_id -> time.time() первого получения; порядок вставки = порядок по времени
+processed_messages: "OrderedDict[str, float]" = OrderedDict()
+PROCESSED_MSG_TTL = 86400  # повторы от 360dialog приходят в пределах суток
+PROCESSED_MSG_MAX = 10000
+_processed_lock = threading.Lock()
+HOURS_CACHE: Dict[Tuple[str, str], int] = {}  # (user_id, work_date) -> сумма часов без IT
+HOURS_CACHE_DAYS = 7  # как в выборе даты: сегодня и 6 дней назад; более старые ключи удаляются
+_hours_lock = threading.Lock()
+# Состояние диалога живет в памяти процесса; неактивные дольше STATE_TTL_SECONDS сбрасываются
+STATE_TTL_SECONDS = int(os.getenv("STATE_TTL_SECONDS", "86400"))
+_state_touched: Dict[str, float] = {}  # user_id -> time.time() последнего обращения
 
 def is_message_processed(msg_id: str) -> bool:
-    if msg_id in processed_messages:
-        return True
-    processed_messages.add(msg_id)
-    # Simple cleanup: keep set size manageable (optional, for now just let it grow or clear periodically)
-    if len(processed_messages) > 10000:
-        processed_messages.clear()
+    """Атомарная проверка-и-отметка (как SET NX EX): True, если msg_id уже видели в пределах TTL."""
+    now = time.time()
+    with _processed_lock:
+        seen_at = processed_messages.get(msg_id)
+        if seen_at is not None and now - seen_at < PROCESSED_MSG_TTL:
+            return True
+        processed_messages[msg_id] = now
+        processed_messages.move_to_end(msg_id)
+        # Вытесняем с начала (самые старые): просроченные и сверх лимита, без полной очистки
+        deadline = now - PROCESSED_MSG_TTL
+        while processed_messages and (
+            len(processed_messages) > PROCESSED_MSG_MAX
+            or next(iter(processed_messages.values())) < deadline
+        ):
+            processed_messages.popitem(last=False)
     return False
 
 def get_state(user_id: str) -> dict:
-    if user_id not in user_states:
-        user_states[user_id] = {"state": None, "data": {}}
-    return user_states[user_id]
+    now = time.time()
+    s = user_states.get(user_id)
+    if s is not None and now - _state_touched.get(user_id, now) > STATE_TTL_SECONDS:
+        # Просроченный диалог начинаем заново
+        user_history.pop(user_id, None)
+        s = None
+    if s is None:
+        s = user_states[user_id] = {"state": None, "data": {}}
+    _state_touched[user_id] = now
+    return s
+
+def purge_expired_states():
+    """Удалить из памяти состояния и историю пользователей, неактивных дольше STATE_TTL_SECONDS."""
+    deadline = time.time() - STATE_TTL_SECONDS
+    expired = [uid for uid, ts in list(_state_touched.items()) if ts < deadline]
+    for uid in expired:
+        user_states.pop(uid, None)
+        user_history.pop(uid, None)
+        _state_touched.pop(uid, None)
+    if expired:
+        logging.info(f"🧹 Очищено неактивных состояний: {len(expired)}")
 
 def save_to_history(user_id: str, back_callback: str):
     """
@@ -303,19 +458,19 @@ def save_to_history(user_id: str, back_callback: str):
     
     s = get_state(user_id)
     if s["state"] is not None:
-        if user_id not in user_history:
-            user_history[user_id] = []
-        # Сохраняем копию текущего состояния и callback для возврата
-        user_history[user_id].append({
+        # Сохраняем копию текущего состояния и callback для возврата;
+        # deque(maxlen) сам отбрасывает самые старые шаги
+        history = user_history.get(user_id)
+        if history is None:
+            history = user_history[user_id] = deque(maxlen=USER_HISTORY_MAX)
+        data = s["data"]
+        history.append({
             "state": s["state"],
-            "data": s["data"].copy() if s["data"] else {},
+            "data": data.copy() if data else {},
             "back_callback": back_callback
         })
-        # Ограничиваем размер истории (последние 10 состояний)
-        if len(user_history[user_id]) > 10:
-            user_history[user_id] = user_history[user_id][-10:]
 
-def set_state(user_id: str, state: Optional[str], data: dict = None, save_to_history: bool = True, back_callback: Optional[str] = None):
+def set_state(user_id: str, state: Optional[str], data: dict = None, push_history: bool = True, back_callback: Optional[str] = None):
     """
     Установить состояние пользователя.
     
@@ -323,15 +478,14 @@ def set_state(user_id: str, state: Optional[str], data: dict = None, save_to_his
         user_id: ID пользователя
         state: Название состояния
         data: Данные состояния
-        save_to_history: Сохранять ли текущее состояние в историю перед переходом
-        back_callback: callback_data для возврата назад (если save_to_history=True)
+        push_history: Сохранять ли текущее состояние в историю перед переходом
+        back_callback: callback_data для возврата назад (если push_history=True)
     """
     s = get_state(user_id)
     
     # Сохраняем текущее состояние в историю перед переходом (если это не очистка)
-    save_to_history_func = globals().get("save_to_history")
-    if save_to_history and s["state"] is not None and state is not None and back_callback and callable(save_to_history_func):
-        save_to_history_func(user_id, back_callback)
+    if push_history and s["state"] is not None and state is not None and back_callback:
+        save_to_history(user_id, back_callback)
     
     s["state"] = state
     if data is not None:
@@ -340,12 +494,24 @@ def set_state(user_id: str, state: Optional[str], data: dict = None, save_to_his
 def clear_state(user_id: str):
     user_states[user_id] = {"state": None, "data": {}}
     # Очищаем историю при полной очистке состояния
-    if user_id in user_history:
-        user_history[user_id] = []
+    history = user_history.get(user_id)
+    if history:
+        history.clear()
 
 # Флаг для предотвращения сохранения истории при восстановлении состояния
 _restoring_state = False
 
+@dataclass(slots=True)
+class _TempUser:
+    """Минимальный from_user для синтетического callback."""
+    wa_id: str
+
+@dataclass(slots=True)
+class _TempCallback:
+    """Синтетический callback (from_user + data) для повторного показа экрана в go_back."""
+    from_user: _TempUser
+    data: str
+
 def go_back(client, user_id: str) -> bool:
     """
     Вернуться на один шаг назад в истории состояний.
@@ -372,32 +538,131 @@ def go_back(client, user_id: str) -> bool:
         # Устанавливаем флаг, чтобы не сохранять историю при восстановлении
         _restoring_state = True
         try:
-            # Создаем временный объект callback для вызова обработчика
-            class TempCallback:
-                def __init__(self, user_id, data):
-                    class TempUser:
-                        def __init__(self, uid):
-                            self.wa_id = uid
-                    self.from_user = TempUser(user_id)
-                    self.data = data
-            
-            temp_btn = TempCallback(user_id, back_callback)
-            handle_callback(client, temp_btn)
+            # Временный объект callback для вызова обработчика
+            handle_callback(client, _TempCallback(_TempUser(user_id), back_callback))
         finally:
             _restoring_state = False
         return True
     
     return False
 
+# Google Sheets функции
+try:
+    from google_sheets_manager import (
+        initialize_google_sheets,
+        export_reports_to_sheets,
+        check_and_create_next_month_sheet,
+        scheduled_export,
+        export_report_to_sheet,
+        sync_report_update,
+        sync_report_delete,
+        export_brigadier_reports,
+        export_brigadier_report_to_sheet
+    )
+    GOOGLE_SHEETS_AVAILABLE = True
+    logging.info("✅ Google Sheets модуль загружен")
+except ImportError as e:
+    logging.warning(f"⚠️ Google Sheets модуль недоступен: {e}")
+    GOOGLE_SHEETS_AVAILABLE = False
+    
+    # Stub функции если модуль недоступен
+    def initialize_google_sheets():
+        return False
+    
+    def export_reports_to_sheets():
+        return 0, "Google Sheets не настроен"
+    
+    def check_and_create_next_month_sheet():
+        return False, ""
+    
+    def scheduled_export():
+        pass
+    
+    def export_report_to_sheet(report_id):
+        return False
+    
+    def sync_report_update(report_id):
+        return False
+    
+    def sync_report_delete(report_id):
+        return False
+    
+    def export_brigadier_reports():
+        return 0, "Google Sheets не настроен"
+    
+    def export_brigadier_report_to_sheet(report_id):
+        return False
+
 # -----------------------------
 # БД (те же функции, что в Telegram версии)
 # -----------------------------
 
+# Одно соединение на поток: прагмы и кэш подготовленных выражений sqlite3
+# живут между запросами, а не создаются заново на каждый connect().
+# Число соединений ограничено числом рабочих потоков (WEBHOOK_WORKERS + планировщик).
+# Вложенные helper'ы (get_user внутри другого with connect()) берут то же соединение
+# потока, поэтому общий пул через очередь здесь не нужен и мог бы заблокироваться.
+_db_local = threading.local()
+
 def connect():
-    return sqlite3.connect(DB_PATH)
+    con = getattr(_db_local, "con", None)
+    if con is None:
+        # isolation_level=None — autocommit: одиночный INSERT/UPDATE/DELETE фиксируется сам,
+        # без пары BEGIN/COMMIT; многошаговые участки открывают транзакцию явно (BEGIN)
+        con = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute("PRAGMA temp_store=MEMORY")
+        con.execute("PRAGMA cache_size=-20000")
+        # Чтение через mmap (до 256 МБ) вместо копирования страниц в буфер соединения
+        con.execute("PRAGMA mmap_size=268435456")
+        _db_local.con = con
+    return con
+
+# Запросы горячих путей — одна строка на запрос: кэш подготовленных выражений
+# sqlite3 (cached_statements) ищет по тексту SQL, и все места вызова попадают в одну запись
+SQL_GET_USER = "SELECT user_id, full_name, tz, created_at FROM users WHERE user_id=?"
+SQL_IS_BRIGADIER = "SELECT 1 FROM brigadiers WHERE user_id=?"
+SQL_SUM_HOURS = (
+    "SELECT COALESCE(SUM(hours),0) FROM reports "
+    "WHERE user_id=? AND work_date=? AND id<>? AND (?=1 OR is_it_report=0)"
+)
+SQL_IT_RECENT_REPORTS = """
+    SELECT id, work_date, activity, location, hours, created_at
+    FROM reports
+    WHERE user_id=? AND created_at >= datetime('now', '-1 day')
+    ORDER BY created_at DESC
+"""
+SQL_SET_REMINDER_STATUS = (
+    "INSERT INTO reminder_status(user_id, date, status, last_reminded_at, last_reminded_ts) VALUES(?,?,?,?,?) "
+    "ON CONFLICT(user_id, date) DO UPDATE SET status=excluded.status, "
+    "last_reminded_at=excluded.last_reminded_at, last_reminded_ts=excluded.last_reminded_ts"
+)
+# Пакетная отметка разосланных напоминаний: не перетирает «disabled», если пользователь
+# успел отказаться от напоминаний, пока шла рассылка
+SQL_MARK_REMINDED = SQL_SET_REMINDER_STATUS + " WHERE reminder_status.status IS NOT 'disabled'"
+# В brigadier_reports нет created_at — новые записи определяем по id
+SQL_BRIG_RECENT_REPORTS = """
+    SELECT id, work_date, work_type, rows, field
+    FROM brigadier_reports
+    WHERE user_id=?
+    ORDER BY id DESC LIMIT 5
+"""
+
+def exec_dml(sql: str, params: Tuple = ()) -> int:
+    """INSERT/UPDATE/DELETE одним выражением (autocommit); возвращает число затронутых строк."""
+    with connect() as con:
+        return con.execute(sql, params).rowcount
+
+def exec_dml_many(sql: str, seq_of_params: List[Tuple]) -> int:
+    """Один и тот же DML для набора параметров: одно подготовленное выражение, одна транзакция."""
+    with connect() as con:
+        con.execute("BEGIN")  # with-блок сделает COMMIT (или ROLLBACK при ошибке)
+        return con.executemany(sql, seq_of_params).rowcount
 
 def init_db():
     with connect() as con, closing(con.cursor()) as c:
+        c.execute("BEGIN")  # схема, миграции и значения по умолчанию — одной транзакцией
         c.execute("""
         CREATE TABLE IF NOT EXISTS users(
           user_id    TEXT PRIMARY KEY,
@@ -498,15 +763,20 @@ def init_db():
           date          TEXT,
           status        TEXT,
           last_reminded_at TEXT,
+          last_reminded_ts INTEGER,
           PRIMARY KEY (user_id, date)
         )
         """)
 
-        def table_cols(table: str):
-            return {r[1] for r in c.execute(f"PRAGMA table_info({table})").fetchall()}
+        # Колонки всех таблиц одним запросом (вместо PRAGMA table_info на каждую таблицу)
+        schema: Dict[str, set] = defaultdict(set)
+        for tbl, col in c.execute(
+            "SELECT m.name, p.name FROM sqlite_master m JOIN pragma_table_info(m.name) p WHERE m.type='table'"
+        ):
+            schema[tbl].add(col)
 
         # Миграция для brigadier_reports (shift)
-        br_cols = table_cols("brigadier_reports")
+        br_cols = schema["brigadier_reports"]
         if "shift" not in br_cols:
             c.execute("ALTER TABLE brigadier_reports ADD COLUMN shift TEXT")
 
@@ -515,21 +785,55 @@ def init_db():
             c.execute("UPDATE brigadier_reports SET work_date=substr(timestamp, 1, 10) WHERE work_date IS NULL")
 
         # Миграция для reports (machinery, crop, trips)
-        r_cols = table_cols("reports")
+        r_cols = schema["reports"]
         if "machinery" not in r_cols:
             c.execute("ALTER TABLE reports ADD COLUMN machinery TEXT")
         if "crop" not in r_cols:
             c.execute("ALTER TABLE reports ADD COLUMN crop TEXT")
         if "trips" not in r_cols:
             c.execute("ALTER TABLE reports ADD COLUMN trips INTEGER")
+        if "is_it_report" not in r_cols:
+            # Флаг IT отчета вместо OR по двум колонкам групп — индексируемое равенство
+            c.execute("ALTER TABLE reports ADD COLUMN is_it_report INTEGER NOT NULL DEFAULT 0")
+            c.execute("UPDATE reports SET is_it_report=1 WHERE location_grp='it' OR activity_grp='it'")
+
+        # Время последнего напоминания в секундах Unix — сравнение без разбора ISO-строки
+        if "last_reminded_ts" not in schema["reminder_status"]:
+            c.execute("ALTER TABLE reminder_status ADD COLUMN last_reminded_ts INTEGER")
+            # last_reminded_at хранится в локальном времени — модификатор 'utc' переводит в UTC
+            c.execute("""
+                UPDATE reminder_status SET last_reminded_ts=CAST(strftime('%s', last_reminded_at, 'utc') AS INTEGER)
+                WHERE last_reminded_at IS NOT NULL
+            """)
+
+        # Индексы для выборок по пользователю и дате (лимит часов, статистика)
+        # (idx_reports_user_date_grp заменен индексом по is_it_report).
+        # Префикс (user_id, work_date) у idx_reports_user_date_isit обслуживает и запросы
+        # без is_it_report (is_report_filled_today, IT-статистика), отдельный индекс не нужен;
+        # reminder_status уже проиндексирован первичным ключом (user_id, date)
+        c.execute("DROP INDEX IF EXISTS idx_reports_user_date_grp")
+        c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reports_user_date_isit
+        ON reports(user_id, work_date, is_it_report, created_at)
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_reports_wd ON reports(work_date)")
+        # Последние 24 часа пользователя (редактирование/удаление) и отчеты бригадира за день
+        c.execute("CREATE INDEX IF NOT EXISTS idx_reports_user_created ON reports(user_id, created_at)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_brigadier_reports_user_date ON brigadier_reports(user_id, work_date)")
+        # Частичный индекс только по обычным (не IT) отчетам: статистика пользователя
+        # читает диапазон дат уже в порядке (work_date, created_at), без сортировки
+        c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reports_user_date_nonit
+        ON reports(user_id, work_date, created_at) WHERE is_it_report=0
+        """)
 
-        lcols = table_cols("locations")
+        lcols = schema["locations"]
         if "grp" not in lcols:
             c.execute("ALTER TABLE locations ADD COLUMN grp TEXT")
             c.execute("UPDATE locations SET grp=? WHERE (grp IS NULL OR grp='') AND name='Склад'", (GROUP_WARE,))
             c.execute("UPDATE locations SET grp=? WHERE (grp IS NULL OR grp='') AND name<>'Склад'", (GROUP_FIELDS,))
 
-        acols = table_cols("activities")
+        acols = schema["activities"]
         if "grp" not in acols:
             c.execute("ALTER TABLE activities ADD COLUMN grp TEXT")
             placeholders = ",".join("?" * len(DEFAULT_TECH))
@@ -559,57 +863,83 @@ def init_db():
         if placeholders:
             c.execute(f"DELETE FROM locations WHERE name IN ({placeholders})", (*obsolete_locations,))
 
-        for name in DEFAULT_FIELDS:
-            c.execute("INSERT OR IGNORE INTO locations(name, grp) VALUES (?, ?)", (name, GROUP_FIELDS))
-        c.execute("INSERT OR IGNORE INTO locations(name, grp) VALUES (?, ?)", ("Склад", GROUP_WARE))
-
-        for name in DEFAULT_TECH:
-            c.execute("INSERT OR IGNORE INTO activities(name, grp) VALUES (?, ?)", (name, GROUP_TECH))
-        for name in DEFAULT_HAND:
-            c.execute("INSERT OR IGNORE INTO activities(name, grp) VALUES (?, ?)", (name, GROUP_HAND))
+        # Значения по умолчанию: по одному executemany на таблицу, все в одной транзакции init_db
+        c.executemany(
+            "INSERT OR IGNORE INTO locations(name, grp) VALUES (?, ?)",
+            [(name, GROUP_FIELDS) for name in DEFAULT_FIELDS] + [("Склад", GROUP_WARE)]
+        )
+        c.executemany(
+            "INSERT OR IGNORE INTO activities(name, grp) VALUES (?, ?)",
+            [(name, GROUP_TECH) for name in DEFAULT_TECH] + [(name, GROUP_HAND) for name in DEFAULT_HAND]
+        )
 
         con.commit()
 
+    # Справочники могли поменяться (очистка устаревших локаций, значения по умолчанию)
+    _clear_activity_cache()
+    _clear_location_cache()
+
 def upsert_user(user_id: str, full_name: Optional[str], tz: str):
     now = datetime.now().isoformat()
     with connect() as con, closing(con.cursor()) as c:
-        row = c.execute("SELECT user_id FROM users WHERE user_id=?", (user_id,)).fetchone()
-        if row:
-            c.execute("UPDATE users SET full_name=?, tz=?, created_at=? WHERE user_id=?",
-                      (full_name, tz, now, user_id))
-        else:
-            c.execute("INSERT INTO users(user_id, full_name, tz, created_at) VALUES(?,?,?,?)",
-                      (user_id, full_name, tz, now))
-        con.commit()
+        c.execute(
+            "INSERT INTO users(user_id, full_name, tz, created_at) VALUES(?,?,?,?) "
+            "ON CONFLICT(user_id) DO UPDATE SET full_name=excluded.full_name, tz=excluded.tz, created_at=excluded.created_at",
+            (user_id, full_name, tz, now)
+        )
 
 def get_user(user_id: str):
     with connect() as con, closing(con.cursor()) as c:
-        r = c.execute("SELECT user_id, full_name, tz, created_at FROM users WHERE user_id=?", (user_id,)).fetchone()
+        c.row_factory = sqlite3.Row  # строки по именам колонок — dict без ручной распаковки
+        r = c.execute(SQL_GET_USER, (user_id,)).fetchone()
         if not r:
             return None
-        return {
-            "user_id": r[0],
-            "full_name": r[1],
-            "tz": r[2] or TZ,
-            "created_at": r[3],
-        }
+        u = dict(r)
+        u["tz"] = u["tz"] or TZ
+        return u
+
+# Кэш справочников видов работ и локаций: меняются только через админ-меню,
+# поэтому читаем из БД один раз и сбрасываем кэш при добавлении/удалении
+_dict_cache_lock = threading.Lock()
+_act_cache: Dict[str, List[Tuple[int, str]]] = {}
+_act_name_cache: Dict[int, Tuple[str, str]] = {}
+_loc_cache: Dict[str, List[Tuple[int, str]]] = {}
+_loc_names_cache: Dict[str, List[str]] = {}
+_loc_name_cache: Dict[int, Tuple[str, str]] = {}
+
+def _clear_activity_cache():
+    with _dict_cache_lock:
+        _act_cache.clear()
+        _act_name_cache.clear()
+
+def _clear_location_cache():
+    with _dict_cache_lock:
+        _loc_cache.clear()
+        _loc_names_cache.clear()
+        _loc_name_cache.clear()
 
 def list_activities(grp: str) -> List[str]:
-    with connect() as con, closing(con.cursor()) as c:
-        rows = c.execute("SELECT name FROM activities WHERE grp=? ORDER BY name", (grp,)).fetchall()
-        return [r[0] for r in rows]
+    return [name for _, name in list_activities_with_id(grp)]
 
 def list_activities_with_id(grp: str) -> List[Tuple[int, str]]:
-    with connect() as con, closing(con.cursor()) as c:
-        rows = c.execute("SELECT id, name FROM activities WHERE grp=? ORDER BY name", (grp,)).fetchall()
-        return [(r[0], r[1]) for r in rows]
+    with _dict_cache_lock:
+        acts = _act_cache.get(grp)
+        if acts is None:
+            with connect() as con, closing(con.cursor()) as c:
+                rows = c.execute("SELECT id, name FROM activities WHERE grp=? ORDER BY name", (grp,)).fetchall()
+            acts = _act_cache[grp] = [(r[0], r[1]) for r in rows]
+        return list(acts)
 
 def get_activity_name(act_id: int) -> Optional[Tuple[str, str]]:
-    with connect() as con, closing(con.cursor()) as c:
-        r = c.execute("SELECT name, grp FROM activities WHERE id=?", (act_id,)).fetchone()
-        if not r:
-            return None
-        return (r[0], r[1])
+    with _dict_cache_lock:
+        res = _act_name_cache.get(act_id)
+        if res is None:
+            with connect() as con, closing(con.cursor()) as c:
+                r = c.execute("SELECT name, grp FROM activities WHERE id=?", (act_id,)).fetchone()
+            if not r:
+                return None
+            res = _act_name_cache[act_id] = (r[0], r[1])
+        return res
 
 def add_activity(grp: str, name: str) -> bool:
     name = name.strip()
@@ -618,29 +948,44 @@ def add_activity(grp: str, name: str) -> bool:
     with connect() as con, closing(con.cursor()) as c:
         try:
             c.execute("INSERT INTO activities(name, grp) VALUES(?,?)", (name, grp))
-            con.commit()
-            return True
         except sqlite3.IntegrityError:
             return False
+    _clear_activity_cache()
+    return True
 
 def remove_activity(name: str) -> bool:
     with connect() as con, closing(con.cursor()) as c:
         cur = c.execute("DELETE FROM activities WHERE name=?", (name,))
-        con.commit()
-        return cur.rowcount > 0
+        removed = cur.rowcount > 0
+    if removed:
+        _clear_activity_cache()
+    return removed
 
 def remove_activity_by_id(aid: int) -> bool:
     with connect() as con, closing(con.cursor()) as c:
         cur = c.execute("DELETE FROM activities WHERE id=?", (aid,))
-        con.commit()
-        return cur.rowcount > 0
+        removed = cur.rowcount > 0
+    if removed:
+        _clear_activity_cache()
+    return removed
 
 def list_locations(grp: str) -> List[str]:
-    with connect() as con, closing(con.cursor()) as c:
-        rows = c.execute("SELECT name FROM locations WHERE grp=? ORDER BY name", (grp,)).fetchall()
-        return [r[0] for r in rows]
+    with _dict_cache_lock:
+        names = _loc_names_cache.get(grp)
+        if names is None:
+            with connect() as con, closing(con.cursor()) as c:
+                rows = c.execute("SELECT name FROM locations WHERE grp=? ORDER BY name", (grp,)).fetchall()
+            names = _loc_names_cache[grp] = [r[0] for r in rows]
+        return list(names)
 
 def list_locations_with_id(grp: str) -> List[Tuple[int, str]]:
+    with _dict_cache_lock:
+        locs = _loc_cache.get(grp)
+        if locs is None:
+            locs = _loc_cache[grp] = _load_locations_with_id(grp)
+        return list(locs)
+
+def _load_locations_with_id(grp: str) -> List[Tuple[int, str]]:
     with connect() as con, closing(con.cursor()) as c:
         rows = c.execute(
             """
@@ -672,11 +1017,15 @@ def list_locations_with_id(grp: str) -> List[Tuple[int, str]]:
         )
 
 def get_location_name(loc_id: int) -> Optional[Tuple[str, str]]:
-    with connect() as con, closing(con.cursor()) as c:
-        r = c.execute("SELECT name, grp FROM locations WHERE id=?", (loc_id,)).fetchone()
-        if not r:
-            return None
-        return (r[0], r[1])
+    with _dict_cache_lock:
+        res = _loc_name_cache.get(loc_id)
+        if res is None:
+            with connect() as con, closing(con.cursor()) as c:
+                r = c.execute("SELECT name, grp FROM locations WHERE id=?", (loc_id,)).fetchone()
+            if not r:
+                return None
+            res = _loc_name_cache[loc_id] = (r[0], r[1])
+        return res
 
 def add_location(grp: str, name: str) -> bool:
     name = name.strip()
@@ -685,57 +1034,62 @@ def add_location(grp: str, name: str) -> bool:
     with connect() as con, closing(con.cursor()) as c:
         try:
             c.execute("INSERT INTO locations(name, grp) VALUES(?,?)", (name, grp))
-            con.commit()
-            return True
         except sqlite3.IntegrityError:
             return False
+    _clear_location_cache()
+    return True
 
 def remove_location(name: str) -> bool:
     with connect() as con, closing(con.cursor()) as c:
         cur = c.execute("DELETE FROM locations WHERE name=?", (name,))
-        con.commit()
-        return cur.rowcount > 0
+        removed = cur.rowcount > 0
+    if removed:
+        _clear_location_cache()
+    return removed
 
 def remove_location_by_id(lid: int) -> bool:
     with connect() as con, closing(con.cursor()) as c:
         cur = c.execute("DELETE FROM locations WHERE id=?", (lid,))
-        con.commit()
-        return cur.rowcount > 0
+        removed = cur.rowcount > 0
+    if removed:
+        _clear_location_cache()
+    return removed
 
 def insert_report(user_id:str, reg_name:str, location:str, loc_grp:str,
-                  activity:str, act_grp:str, work_date:str, hours:int) -> int:
+                  activity:str, act_grp:str, work_date:str, hours:int,
+                  _sheets_enabled: bool = GOOGLE_SHEETS_AVAILABLE) -> int:
     now = datetime.now().isoformat()
+    is_it_report = 1 if (loc_grp == "it" or act_grp == "it") else 0
     with connect() as con, closing(con.cursor()) as c:
         c.execute("""
         INSERT INTO reports(created_at, user_id, reg_name, location, location_grp,
-                            activity, activity_grp, work_date, hours)
-        VALUES(?,?,?,?,?,?,?,?,?)
-        """, (now, user_id, reg_name, location, loc_grp, activity, act_grp, work_date, hours))
-        con.commit()
+                            activity, activity_grp, work_date, hours, is_it_report)
+        VALUES(?,?,?,?,?,?,?,?,?,?)
+        """, (now, user_id, reg_name, location, loc_grp, activity, act_grp, work_date, hours, is_it_report))
         report_id = c.lastrowid
     
-    # Синхронизация с Google Sheets
-    if GOOGLE_SHEETS_AVAILABLE:
-        try:
-            export_report_to_sheet(report_id)
-        except Exception as e:
-            logging.warning(f"⚠️ Не удалось экспортировать отчет {report_id} в Google Sheets: {e}")
+    # Обновляем кэш суммы часов, если он уже прогрет для этой даты
+    key = (user_id, work_date)
+    if not is_it_report:
+        with _hours_lock:
+            if key in HOURS_CACHE:
+                HOURS_CACHE[key] += int(hours or 0)
+    mark_filled(user_id, work_date)
+    
+    # Синхронизация с Google Sheets (в фоне, ответ пользователю не ждет)
+    if _sheets_enabled:
+        run_sheets_sync(export_report_to_sheet, report_id)
     
     return report_id
 
 def get_report(report_id:int):
     with connect() as con, closing(con.cursor()) as c:
+        c.row_factory = sqlite3.Row
         r = c.execute(
             "SELECT id, created_at, user_id, reg_name, location, location_grp, activity, activity_grp, work_date, hours FROM reports WHERE id=?",
             (report_id,)
         ).fetchone()
-        if not r:
-            return None
-        return {
-            "id": r[0], "created_at": r[1], "user_id": r[2], "reg_name": r[3],
-            "location": r[4], "location_grp": r[5], "activity": r[6], "activity_grp": r[7],
-            "work_date": r[8], "hours": r[9]
-        }
+        return dict(r) if r else None
 
 def sum_hours_for_user_date(user_id:str, work_date:str, exclude_report_id: Optional[int] = None, include_it: bool = False) -> int:
     """
@@ -747,23 +1101,49 @@ def sum_hours_for_user_date(user_id:str, work_date:str, exclude_report_id: Optio
         exclude_report_id: ID отчета для исключения (при редактировании)
         include_it: Включать ли IT отчеты (по умолчанию False - исключаем)
     """
+    # Один запрос на все варианты: id<>-1 ничего не исключает, ?=1 снимает фильтр IT
     with connect() as con, closing(con.cursor()) as c:
-        if exclude_report_id:
-            if include_it:
-                r = c.execute("SELECT COALESCE(SUM(hours),0) FROM reports WHERE user_id=? AND work_date=? AND id<>?",
-                              (user_id, work_date, exclude_report_id)).fetchone()
-            else:
-                r = c.execute("SELECT COALESCE(SUM(hours),0) FROM reports WHERE user_id=? AND work_date=? AND id<>? AND location_grp != 'it' AND activity_grp != 'it'",
-                              (user_id, work_date, exclude_report_id)).fetchone()
-        else:
-            if include_it:
-                r = c.execute("SELECT COALESCE(SUM(hours),0) FROM reports WHERE user_id=? AND work_date=?",
-                              (user_id, work_date)).fetchone()
-            else:
-                r = c.execute("SELECT COALESCE(SUM(hours),0) FROM reports WHERE user_id=? AND work_date=? AND location_grp != 'it' AND activity_grp != 'it'",
-                              (user_id, work_date)).fetchone()
+        r = c.execute(SQL_SUM_HOURS, (user_id, work_date, exclude_report_id or -1, int(include_it))).fetchone()
         return int(r[0] or 0)
 
+def cached_day_hours(user_id:str, work_date:str) -> int:
+    """Сумма часов (без IT) за дату из кэша; при промахе — из БД."""
+    key = (user_id, work_date)
+    # Кэш общий для потоков вебхука: под блокировкой только операции со словарем,
+    # запрос к БД и чистка старых дат идут без нее
+    with _hours_lock:
+        total = HOURS_CACHE.get(key)
+    if total is not None:
+        return total
+    total = sum_hours_for_user_date(user_id, work_date)
+    # Промах — заодно выбрасываем даты, которых уже нет в выборе даты
+    # (list() — снимок ключей одним вызовом, без гонки с другими потоками)
+    cutoff = (date.today() - timedelta(days=HOURS_CACHE_DAYS - 1)).isoformat()
+    for old_key in [k for k in list(HOURS_CACHE) if k[1] < cutoff]:
+        HOURS_CACHE.pop(old_key, None)
+    with _hours_lock:
+        return HOURS_CACHE.setdefault(key, total)
+
+def invalidate_day_hours(user_id:str):
+    """Сбросить кэш сумм часов пользователя (после удаления/изменения отчетов)."""
+    with _hours_lock:
+        for key in [k for k in HOURS_CACHE if k[0] == user_id]:
+            del HOURS_CACHE[key]
+
+def day_reports_with_total(user_id:str, work_date:str, it_only: bool = False) -> Tuple[List[tuple], int]:
+    """
+    Записи пользователя за дату (activity, location, hours) и их сумма — одним запросом.
+    it_only=False — обычные отчеты (без IT), it_only=True — только IT отчеты.
+    """
+    with connect() as con, closing(con.cursor()) as c:
+        rows = c.execute("""
+        SELECT activity, location, hours
+        FROM reports
+        WHERE user_id=? AND work_date=? AND is_it_report=?
+        ORDER BY created_at
+        """, (user_id, work_date, 1 if it_only else 0)).fetchall()
+    return rows, sum(int(r[2] or 0) for r in rows)
+
 def user_recent_24h_reports(user_id:str) -> List[tuple]:
     cutoff = (datetime.now() - timedelta(hours=24)).isoformat()
     with connect() as con, closing(con.cursor()) as c:
@@ -775,63 +1155,56 @@ def user_recent_24h_reports(user_id:str) -> List[tuple]:
         """, (user_id, cutoff)).fetchall()
         return rows
 
-def delete_report(report_id:int, user_id:str) -> bool:
-    # Сначала синхронизируем удаление с Google Sheets
-    if GOOGLE_SHEETS_AVAILABLE:
-        try:
-            sync_report_delete(report_id)
-        except Exception as e:
-            logging.warning(f"⚠️ Не удалось удалить отчет {report_id} из Google Sheets: {e}")
-    
+def delete_report(report_id:int, user_id:str, _sheets_enabled: bool = GOOGLE_SHEETS_AVAILABLE) -> bool:
     with connect() as con, closing(con.cursor()) as c:
         cur = c.execute("DELETE FROM reports WHERE id=? AND user_id=?", (report_id, user_id))
-        con.commit()
-        return cur.rowcount > 0
+        deleted = cur.rowcount > 0
+    invalidate_day_hours(user_id)
+    if deleted:
+        _clear_filled_cache()
+    
+    # Синхронизация удаления с Google Sheets (строка ищется по google_exports, не по reports)
+    if deleted and _sheets_enabled:
+        run_sheets_sync(sync_report_delete, report_id)
+    return deleted
 
-def update_report_hours(report_id:int, user_id:str, new_hours:int) -> bool:
+def update_report_hours(report_id:int, user_id:str, new_hours:int, _sheets_enabled: bool = GOOGLE_SHEETS_AVAILABLE) -> bool:
     with connect() as con, closing(con.cursor()) as c:
         cur = c.execute("UPDATE reports SET hours=? WHERE id=? AND user_id=?", (new_hours, report_id, user_id))
-        con.commit()
         success = cur.rowcount > 0
+    invalidate_day_hours(user_id)
     
-    # Синхронизация с Google Sheets
-    if success and GOOGLE_SHEETS_AVAILABLE:
-        try:
-            sync_report_update(report_id)
-        except Exception as e:
-            logging.warning(f"⚠️ Не удалось обновить отчет {report_id} в Google Sheets: {e}")
+    # Синхронизация с Google Sheets (в фоне)
+    if success and _sheets_enabled:
+        run_sheets_sync(sync_report_update, report_id)
     
     return success
 
-def fetch_stats_range_for_user(user_id:str, start_date:str, end_date:str) -> List[tuple]:
+def fetch_stats_range_for_user(user_id:str, start_date:str, end_date:str, limit: int = -1) -> List[tuple]:
+    """Отчеты (без IT) за период, новые сначала; limit=-1 — без ограничения."""
     with connect() as con, closing(con.cursor()) as c:
         rows = c.execute("""
         SELECT work_date, location, activity, hours
         FROM reports
         WHERE user_id=? AND work_date>=? AND work_date<=?
-        AND location_grp != 'it' AND activity_grp != 'it'
+        AND is_it_report=0
         ORDER BY work_date DESC, created_at DESC
-        """, (user_id, start_date, end_date)).fetchall()
+        LIMIT ?
+        """, (user_id, start_date, end_date, limit)).fetchall()
         return rows
 
-def is_admin(user_id: str) -> bool:
-    return user_id in ADMIN_IDS
-
-def is_it(user_id: str) -> bool:
-    """Проверка, является ли пользователь IT"""
-    normalized_user_id = _normalize_phone(user_id)
-    result = normalized_user_id in IT_IDS
-    if result:
-        logging.info(f"✅ IT пользователь обнаружен: {user_id} (нормализован: {normalized_user_id})")
-    return result
-
-# Brigadier функции
-def is_brigadier(user_id: str) -> bool:
-    """Проверка, является ли пользователь бригадиром"""
+def sum_stats_range_for_user(user_id:str, start_date:str, end_date:str) -> Tuple[int, int]:
+    """Сумма часов и число отчетов (без IT) за период — для итогов при ограниченной детализации."""
     with connect() as con, closing(con.cursor()) as c:
-        r = c.execute("SELECT user_id FROM brigadiers WHERE user_id=?", (user_id,)).fetchone()
-        return r is not None
+        total, count = c.execute("""
+        SELECT COALESCE(SUM(hours),0), COUNT(*)
+        FROM reports
+        WHERE user_id=? AND work_date>=? AND work_date<=?
+        AND is_it_report=0
+        """, (user_id, start_date, end_date)).fetchone()
+        return int(total), count
 
+# Brigadier функции (is_brigadier — в разделе ролей выше)
 def add_brigadier(user_id: str, username: str, full_name: str, added_by: str) -> bool:
     """Добавление бригадира"""
     now = datetime.now().isoformat()
@@ -841,17 +1214,19 @@ def add_brigadier(user_id: str, username: str, full_name: str, added_by: str) ->
                 "INSERT INTO brigadiers(user_id, username, full_name, added_by, added_date) VALUES(?,?,?,?,?)",
                 (user_id, username, full_name, added_by, now)
             )
-            con.commit()
-            return True
         except sqlite3.IntegrityError:
             return False
+    _is_brigadier_cached.cache_clear()
+    return True
 
 def remove_brigadier(user_id: str) -> bool:
     """Удаление бригадира"""
     with connect() as con, closing(con.cursor()) as c:
         cur = c.execute("DELETE FROM brigadiers WHERE user_id=?", (user_id,))
-        con.commit()
-        return cur.rowcount > 0
+        removed = cur.rowcount > 0
+    if removed:
+        _is_brigadier_cached.cache_clear()
+    return removed
 
 def get_all_brigadiers() -> List[tuple]:
     """Получение списка всех бригадиров"""
@@ -870,8 +1245,9 @@ def save_brigadier_report(user_id: str, username: str, work_type: str,
         INSERT INTO brigadier_reports(user_id, username, work_type, rows, field, bags, workers, timestamp, work_date)
         VALUES(?,?,?,?,?,?,?,?,?)
         """, (user_id, username, work_type, rows, field, bags, workers, now, work_date))
-        con.commit()
-        return c.lastrowid
+        report_id = c.lastrowid
+    mark_filled(user_id, work_date)
+    return report_id
 
 # -----------------------------
 # Reminder System Functions
@@ -888,38 +1264,77 @@ def get_reminder_status(user_id: str, date_str: str) -> Optional[dict]:
         return {"status": r[0], "last_reminded_at": r[1]}
 
 def set_reminder_status(user_id: str, date_str: str, status: str, last_reminded_at: str = None):
+    # Строка за день обычно уже есть — сначала простой UPDATE, upsert только если строки нет
     with connect() as con, closing(con.cursor()) as c:
         if last_reminded_at:
-            c.execute(
-                "INSERT INTO reminder_status(user_id, date, status, last_reminded_at) VALUES(?,?,?,?) "
-                "ON CONFLICT(user_id, date) DO UPDATE SET status=excluded.status, last_reminded_at=excluded.last_reminded_at",
-                (user_id, date_str, status, last_reminded_at)
-            )
+            last_ts = int(datetime.fromisoformat(last_reminded_at).timestamp())
+            updated = c.execute(
+                "UPDATE reminder_status SET status=?, last_reminded_at=?, last_reminded_ts=? WHERE user_id=? AND date=?",
+                (status, last_reminded_at, last_ts, user_id, date_str)
+            ).rowcount
+            if not updated:
+                c.execute(SQL_SET_REMINDER_STATUS, (user_id, date_str, status, last_reminded_at, last_ts))
         else:
-             c.execute(
-                "INSERT INTO reminder_status(user_id, date, status) VALUES(?,?,?) "
-                "ON CONFLICT(user_id, date) DO UPDATE SET status=excluded.status",
-                (user_id, date_str, status)
-            )
-        con.commit()
+            updated = c.execute(
+                "UPDATE reminder_status SET status=? WHERE user_id=? AND date=?",
+                (status, user_id, date_str)
+            ).rowcount
+            if not updated:
+                c.execute(
+                    "INSERT INTO reminder_status(user_id, date, status) VALUES(?,?,?) "
+                    "ON CONFLICT(user_id, date) DO UPDATE SET status=excluded.status",
+                    (user_id, date_str, status)
+                )
+
+# Кэш "кто заполнил отчет за день": date -> set(user_id).
+# Заполняется одним запросом при первом обращении за день, дальше пополняется
+# при сохранении отчетов (mark_filled); удаление отчетов сбрасывает кэш целиком.
+_filled_cache: Dict[str, Set[str]] = {}
+_filled_lock = threading.Lock()
+
+def filled_users_for(day: str) -> Set[str]:
+    with _filled_lock:
+        filled = _filled_cache.get(day)
+        if filled is None:
+            with connect() as con, closing(con.cursor()) as c:
+                filled = {r[0] for r in c.execute("""
+                    SELECT user_id FROM reports WHERE work_date=?
+                    UNION
+                    SELECT user_id FROM brigadier_reports WHERE work_date=?
+                """, (day, day))}
+            # Храним только текущий день
+            _filled_cache.clear()
+            _filled_cache[day] = filled
+        return filled
+
+def mark_filled(user_id: str, day: str):
+    with _filled_lock:
+        filled = _filled_cache.get(day)
+        if filled is not None:
+            filled.add(user_id)
+
+def _clear_filled_cache():
+    with _filled_lock:
+        _filled_cache.clear()
 
 def is_report_filled_today(user_id: str) -> bool:
-    today = date.today().isoformat()
-    with connect() as con, closing(con.cursor()) as c:
-        # Check regular reports
-        r1 = c.execute("SELECT id FROM reports WHERE user_id=? AND work_date=?", (user_id, today)).fetchone()
-        if r1: return True
-        # Check brigadier reports
-        r2 = c.execute("SELECT id FROM brigadier_reports WHERE user_id=? AND work_date=?", (user_id, today)).fetchone()
-        if r2: return True
-    return False
+    return user_id in filled_users_for(date.today().isoformat())
+
+# Кнопки напоминаний — одни и те же для всех пользователей, создаются один раз
+_REMINDER_BUTTONS = (
+    Button(title="🚜 Заполнить ОТД", callback_data="menu:work"),
+    Button(title="😴 Сегодня выходной", callback_data="reminder:cancel"),
+    Button(title="✅ Я уже заполнил ОТД сегодня", callback_data="reminder:done"),
+)
+_REMINDER_FILLED_BUTTONS = (Button(title="🚜 Добавить еще", callback_data="menu:work"),)
 
 def check_reminders():
     """
     Checks if users need to be reminded to fill reports.
     Runs every minute.
     """
-    now = datetime.now()
+    # Время — в TZ планировщика, чтобы окно 14:00–19:59 совпадало с CronTrigger
+    now = datetime.now(pytz.timezone(TZ))
     today_str = now.date().isoformat()
     
     # Logic:
@@ -932,98 +1347,110 @@ def check_reminders():
     if not (14 <= hour < 20):
         return
 
+    # Один проход по БД: пользователи + статус напоминания; отключившие напоминания
+    # и уже получившие вечернее подтверждение отсекаются в SQL.
+    # Признак заполненного отчета берется из кэша filled_users_for
     with connect() as con, closing(con.cursor()) as c:
-        # Get all users
-        users = c.execute("SELECT user_id FROM users").fetchall()
-        
-    for (uid,) in users:
-        status_data = get_reminder_status(uid, today_str)
-        status = status_data["status"] if status_data else None
-        
+        rows = c.execute("""
+            SELECT u.user_id, rs.status, rs.last_reminded_ts
+            FROM users u
+            LEFT JOIN reminder_status rs ON rs.user_id=u.user_id AND rs.date=?
+            WHERE rs.status IS NULL OR rs.status NOT IN ('disabled', 'reminded_19:00')
+        """, (today_str,)).fetchall()
+    if not rows:
+        return
+    filled = filled_users_for(today_str)
+    if hour >= 19:
+        # Вечером подтверждение получают только заполнившие отчет
+        rows = [r for r in rows if r[0] in filled]
+    users = [(uid, status, last_reminded, uid in filled) for uid, status, last_reminded in rows]
+    
+    # Статусы отправленных напоминаний пишем одним executemany после цикла
+    pending_updates: List[Tuple[str, str, str, str, int]] = []
+    try:
+        _send_reminders(users, now, today_str, pending_updates)
+    finally:
+        if pending_updates:
+            exec_dml_many(SQL_MARK_REMINDED, pending_updates)
+
+# Параллельная рассылка напоминаний: несколько HTTP-запросов к 360dialog одновременно,
+# со случайной задержкой до REMINDER_SEND_JITTER сек., чтобы не бить API пачкой.
+# Пакетной отправки в 360dialog нет (/messages — один получатель на запрос), поэтому
+# очередь тика (targets) разбирается пулом поверх keep-alive соединений клиента
+REMINDER_SEND_WORKERS = max(1, int(os.getenv("REMINDER_SEND_WORKERS", "8")))
+REMINDER_SEND_JITTER = 0.25
+# Повтор напоминания не чаще чем раз в 49 минут
+REMINDER_INTERVAL_SEC = 49 * 60
+_REMINDER_EXECUTOR = ThreadPoolExecutor(max_workers=REMINDER_SEND_WORKERS, thread_name_prefix="reminder")
+
+_REMINDER_TEXT = "🔔 *Не забудьте заполнить ОТД!*"
+_REMINDER_FILLED_TEXT = "✅ Вы уже заполнили отчет сегодня. Все верно? Если нужно добавить еще работы, нажмите кнопку ниже."
+
+def _send_reminders(users: List[tuple], now: datetime, today_str: str,
+                    pending_updates: List[Tuple[str, str, str, str, int]]):
+    """Рассылка напоминаний по выборке check_reminders; статусы добавляются в pending_updates."""
+    hour = now.hour
+    now_ts = int(now.timestamp())
+    # (uid, текст, кнопки, новый статус)
+    targets: List[Tuple[str, str, tuple, str]] = []
+    for uid, status, last_reminded, filled in users:
         if status == "disabled":
             continue
-            
-        filled = is_report_filled_today(uid)
         
         # Condition 1: Not filled, afternoon reminder
         if 14 <= hour < 19:
             if not filled:
-                last_reminded = status_data.get("last_reminded_at") if status_data else None
-                should_remind = False
-                
-                if not last_reminded:
-                    should_remind = True
-                else:
-                    last_dt = datetime.fromisoformat(last_reminded)
-                    if (now - last_dt) >= timedelta(minutes=49):
-                        should_remind = True
-                
-                if should_remind:
-                    # Send reminder
-                    buttons = [
-                        Button(title="🚜 Заполнить ОТД", callback_data="menu:work"),
-                        Button(title="😴 Сегодня выходной", callback_data="reminder:cancel"),
-                        Button(title="✅ Я уже заполнил ОТД сегодня", callback_data="reminder:done"),
-                    ]
-                    try:
-                        wa.send_message(to=uid, text="🔔 *Не забудьте заполнить ОТД!*", buttons=buttons)
-                        set_reminder_status(uid, today_str, "reminded", now.isoformat())
-                    except Exception as e:
-                        logging.error(f"Failed to send reminder to {uid}: {e}")
+                if not last_reminded or now_ts - last_reminded >= REMINDER_INTERVAL_SEC:
+                    targets.append((uid, _REMINDER_TEXT, _REMINDER_BUTTONS, "reminded"))
 
         # Condition 2: Filled, evening confirmation (once)
         elif 19 <= hour < 20:
             if filled and status != "reminded_19:00":
-                try:
-                    wa.send_message(
-                        to=uid, 
-                        text="✅ Вы уже заполнили отчет сегодня. Все верно? Если нужно добавить еще работы, нажмите кнопку ниже.",
-                        buttons=[Button(title="🚜 Добавить еще", callback_data="menu:work")]
-                    )
-                    set_reminder_status(uid, today_str, "reminded_19:00", now.isoformat())
-                except Exception as e:
-                    logging.error(f"Failed to send 19:00 reminder to {uid}: {e}")
-
-# Google Sheets функции
-try:
-    from google_sheets_manager import (
-        initialize_google_sheets,
-        export_reports_to_sheets,
-        check_and_create_next_month_sheet,
-        scheduled_export,
-        export_report_to_sheet,
-        sync_report_update,
-        sync_report_delete,
-        export_brigadier_reports,
-        export_brigadier_report_to_sheet
-    )
-    GOOGLE_SHEETS_AVAILABLE = True
-    logging.info("✅ Google Sheets модуль загружен")
-except ImportError as e:
-    logging.warning(f"⚠️ Google Sheets модуль недоступен: {e}")
-    GOOGLE_SHEETS_AVAILABLE = False
-    
-    # Stub функции если модуль недоступен
-    def initialize_google_sheets():
-        return False
-    
-    def export_reports_to_sheets():
-        return 0, "Google Sheets не настроен"
-    
-    def check_and_create_next_month_sheet():
-        return False, ""
+                targets.append((uid, _REMINDER_FILLED_TEXT, _REMINDER_FILLED_BUTTONS, "reminded_19:00"))
     
-    def scheduled_export():
-        pass
+    if not targets:
+        return
     
-    def export_report_to_sheet(report_id):
-        return False
+    now_iso = now.isoformat()
     
-    def sync_report_update(report_id):
-        return False
+    def _send_one(target: Tuple[str, str, tuple, str]) -> Optional[Tuple[str, str, str, str, int]]:
+        uid, text, buttons, new_status = target
+        time.sleep(random.uniform(0, REMINDER_SEND_JITTER))
+        try:
+            wa.send_message(to=uid, text=text, buttons=buttons)
+        except Exception as e:
+            logging.error(f"Failed to send {new_status} reminder to {uid}: {e}")
+            return None
+        return (uid, today_str, new_status, now_iso, now_ts)
     
-    def sync_report_delete(report_id):
-        return False
+    for update in _REMINDER_EXECUTOR.map(_send_one, targets):
+        if update is not None:
+            pending_updates.append(update)
+
+# Фоновые задачи (Google Sheets и т.п.) — чтобы не блокировать ответ пользователю
+BACKGROUND_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="bg")
+
+def run_in_background(func: Callable, *args, **kwargs):
+    """Запустить функцию в фоновом пуле; исключения только логируются."""
+    def _job():
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            logging.error(f"❌ Фоновая задача {getattr(func, '__name__', func)} завершилась с ошибкой: {e}")
+    return BACKGROUND_EXECUTOR.submit(_job)
+
+# Синхронизация отчетов с Google Sheets: один поток, чтобы вставки/правки/удаления
+# строк применялись к листу в том же порядке, что и к БД (номера строк сдвигаются)
+SHEETS_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sheets")
+
+def run_sheets_sync(func: Callable, report_id: int):
+    """Поставить синхронизацию отчета с Google Sheets в очередь; ошибки только логируются."""
+    def _job():
+        try:
+            return func(report_id)
+        except Exception as e:
+            logging.warning(f"⚠️ Google Sheets: {func.__name__}({report_id}) не выполнен: {e}")
+    return SHEETS_EXECUTOR.submit(_job)
 
 # Инициализация Flask приложения
 app = Flask(__name__)
@@ -1035,9 +1462,21 @@ wa = WhatsApp360Client(
 )
 logging.info("✅ Initialized 360dialog WhatsApp client")
 
+# Копии отчетов уходят на релейный номер из отдельного потока: вебхук не ждет
+# исходящий HTTP-запрос, а один поток сохраняет порядок "новый отчет" -> "изменен"
+RELAY_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="relay")
+
+def _relay_send(relay_text: str, is_edit: bool):
+    try:
+        wa.send_message(to=REPORT_RELAY_PHONE, text=relay_text)
+        action = "edited" if is_edit else "relayed"
+        logging.info(f"✅ Report {action} to {REPORT_RELAY_PHONE}")
+    except Exception as e:
+        logging.error(f"❌ Failed to relay report: {e}")
+
 def send_report_to_relay(original_from: str, original_text: str, user_name: str = None, is_edit: bool = False):
     """
-    Отправляет копию отчета на релейный номер.
+    Ставит копию отчета в очередь на отправку на релейный номер (время — момент вызова).
     
     Args:
         original_from: Номер телефона отправителя
@@ -1048,35 +1487,30 @@ def send_report_to_relay(original_from: str, original_text: str, user_name: str
     if not REPORT_RELAY_PHONE:
         return
 
-    try:
-        now_str = datetime.now().strftime("%d.%m.%Y %H:%M")
-        
-        # Используем имя пользователя, если доступно, иначе номер
-        sender_info = user_name if user_name else original_from
-        
-        # Формируем сообщение для релея
-        if is_edit:
-            relay_text = (
-                f"✏️ Отчёт изменен\n"
-                f"Дата/время: {now_str}\n"
-                f"Пользователь: {sender_info}\n"
-                f"──────────────\n"
-                f"{original_text}"
-            )
-        else:
-            relay_text = (
-                f"📋 Новый отчёт\n"
-                f"Дата/время: {now_str}\n"
-                f"Пользователь: {sender_info}\n"
-                f"──────────────\n"
-                f"{original_text}"
-            )
-        
-        wa.send_message(to=REPORT_RELAY_PHONE, text=relay_text)
-        action = "edited" if is_edit else "relayed"
-        logging.info(f"✅ Report {action} to {REPORT_RELAY_PHONE}")
-    except Exception as e:
-        logging.error(f"❌ Failed to relay report: {e}")
+    now_str = datetime.now().strftime("%d.%m.%Y %H:%M")
+    
+    # Используем имя пользователя, если доступно, иначе номер
+    sender_info = user_name if user_name else original_from
+    
+    # Формируем сообщение для релея
+    if is_edit:
+        relay_text = (
+            f"✏️ Отчёт изменен\n"
+            f"Дата/время: {now_str}\n"
+            f"Пользователь: {sender_info}\n"
+            f"──────────────\n"
+            f"{original_text}"
+        )
+    else:
+        relay_text = (
+            f"📋 Новый отчёт\n"
+            f"Дата/время: {now_str}\n"
+            f"Пользователь: {sender_info}\n"
+            f"──────────────\n"
+            f"{original_text}"
+        )
+    
+    RELAY_EXECUTOR.submit(_relay_send, relay_text, is_edit)
 
 @app.before_request
 def log_request():
@@ -1101,54 +1535,33 @@ def show_main_menu(wa: WhatsApp360Client, user_id: str, u: dict):
     
     if tim_user:
         # Для TIM роли
-        text = (
-            f"Первый зам директора по Информационным Технологиям\n"
-            f"*{name}*\n\n"
-            f"Выберите действие:"
-        )
-        buttons = [
-            Button(title="🇨🇳 Партия следить 🇨🇳", callback_data="tim:party"),
-            Button(title="📊 Статистика", callback_data="menu:stats"),
-            Button(title="✏️ Сменить имя", callback_data="menu:name"),
-        ]
+        text = f"Первый зам директора по Информационным Технологиям\n*{name}*\n\nВыберите действие:"
+        buttons = _MENU_TIM_BUTTONS
     elif it_user:
         # Для IT роли
-        text = (
-            f"mc.Lover (*{name}*)\n\n"
-            f"*Команды:*\n"
-            f"• `admin` - админское меню\n"
-            f"• `briq` - бригадирское меню\n"
-            f"• `tim` - меню TIM\n"
-            f"• `rb1` - меню работяги\n"
-            f"• `sts` - статистика"
-        )
-        buttons = [
-            Button(title="⭐", callback_data="it:star"),
-            Button(title="📊 Статистика", callback_data="menu:stats"),
-        ]
+        text = f"mc.Lover (*{name}*)\n\n{_MENU_IT_COMMANDS}"
+        buttons = _MENU_IT_BUTTONS
     elif brigadier:
-        # Бригадир: ОБ, ОТД, Настройки (статистика внутри настроек)
-        buttons = [
-            Button(title="👷 ОБ (Отчет)", callback_data="brig:report"),
-            Button(title="🚜 ОТД", callback_data="brig:work"),
-            Button(title="⚙️ Настройки", callback_data="brig:settings"),
-        ]
         text = f"👤 *{name}*\n\nВыберите действие: 🌻"
+        buttons = _MENU_BRIG_BUTTONS
     else:
         # Обычный работяга
-        buttons = [
-            Button(title="🚜 ОТД", callback_data="menu:work"),
-            Button(title="📊 Статистика", callback_data="menu:stats"),
-            Button(title="⚙️ Настройки", callback_data="menu:settings"), # Вместо Ещё
-        ]
         text = f"👤 *{name}*\n\nВыберите действие: 🌻"
+        buttons = _MENU_WORKER_BUTTONS
     
     # Для админов добавляем подсказку
     if is_admin(user_id):
-        text += "\n\n🛠 *Команды админа:*\n`/бриг` - Управление бригадирами\n`00` - В главное меню\n`sts` - Статистика\n`admin` - Админ панель"
+        text += _ADMIN_HINT
         
     wa.send_message(to=user_id, text=text, buttons=buttons)
 
+def back_to_main_menu(wa: WhatsApp360Client, user_id: str, u: Optional[dict] = None):
+    """Сброс состояния и главное меню; u передается, если пользователь уже загружен."""
+    clear_state(user_id)
+    if u is None:
+        u = get_user(user_id)
+    show_main_menu(wa, user_id, u)
+
 def show_settings_menu(wa: WhatsApp360Client, user_id: str, is_brig: Optional[bool] = None):
     """Меню настроек (бывшее Ещё). Для бригадира добавляем пункт статистики."""
     if is_brig is None:
@@ -1156,7 +1569,7 @@ def show_settings_menu(wa: WhatsApp360Client, user_id: str, is_brig: Optional[bo
     buttons = [Button(title="✏️ Сменить имя", callback_data="menu:name")]
     if is_brig:
         buttons.append(Button(title="📊 Статистика", callback_data="brig:stats"))
-    buttons.append(Button(title="🔙 Назад", callback_data="back:prev"))
+    buttons.append(BTN_BACK)
     wa.send_message(
         to=user_id,
         text="⚙️ *Настройки*\n\nВы можете изменить свое имя." + ("\nТакже доступна статистика." if is_brig else ""),
@@ -1174,7 +1587,7 @@ def show_brigadier_stats_menu(wa: WhatsApp360Client, user_id: str):
     buttons = [
         Button(title="Сегодня", callback_data="brig:stats:today"),
         Button(title="Неделя", callback_data="brig:stats:week"),
-        Button(title="🔙 Назад", callback_data="back:prev"),
+        BTN_BACK,
     ]
     wa.send_message(to=user_id, text="📊 Выберите период статистики:", buttons=buttons)
 
@@ -1192,38 +1605,40 @@ def get_brigadier_stats(user_id: str, period: str) -> str:
     start_iso = start_date.isoformat()
     
     with connect() as con, closing(con.cursor()) as c:
-        # Получаем отчеты за период
-        rows = c.execute("""
-            SELECT work_type, rows, bags, workers, work_date 
-            FROM brigadier_reports 
+        # Итоги по типу работ считает SQLite: work_type -> (рядов, сеток, людей, записей)
+        totals = {}
+        for w_type, w_rows, w_bags, w_workers, cnt in c.execute("""
+            SELECT work_type, COALESCE(SUM(rows),0), COALESCE(SUM(bags),0), COALESCE(SUM(workers),0), COUNT(*)
+            FROM brigadier_reports
             WHERE user_id = ? AND work_date >= ?
-            ORDER BY work_date DESC
-        """, (user_id, start_iso)).fetchall()
+            GROUP BY work_type
+        """, (user_id, start_iso)):
+            totals[w_type] = (w_rows, w_bags, w_workers, cnt)
+        
+        # Детализация (только за неделю) — последние 10 записей
+        details_rows = []
+        if period == 'week':
+            details_rows = c.execute("""
+                SELECT work_type, rows, bags, workers, work_date
+                FROM brigadier_reports
+                WHERE user_id = ? AND work_date >= ? AND work_type IN ('Кабачок', 'Картошка')
+                ORDER BY work_date DESC
+                LIMIT 10
+            """, (user_id, start_iso)).fetchall()
         
-    if not rows:
+    if not totals:
         return "Нет данных за выбранный период."
     
-    # Агрегация
-    total_zucchini_rows = 0
-    total_zucchini_workers = 0
-    total_potato_rows = 0
-    total_potato_bags = 0
-    total_potato_workers = 0
+    total_zucchini_rows, _, total_zucchini_workers, zucchini_count = totals.get("Кабачок", (0, 0, 0, 0))
+    total_potato_rows, total_potato_bags, total_potato_workers, potato_count = totals.get("Картошка", (0, 0, 0, 0))
+    details_total = zucchini_count + potato_count
     
     details = []
-    
-    for r in rows:
-        w_type, w_rows, w_bags, w_workers, w_date = r
+    for w_type, w_rows, w_bags, w_workers, w_date in details_rows:
         d_str = date.fromisoformat(w_date).strftime("%d.%m")
-        
         if w_type == "Кабачок":
-            total_zucchini_rows += w_rows
-            total_zucchini_workers += w_workers
             details.append(f"{d_str} 🥒: {w_rows}р, {w_workers}чел")
-        elif w_type == "Картошка":
-            total_potato_rows += w_rows
-            total_potato_bags += w_bags
-            total_potato_workers += w_workers
+        else:
             details.append(f"{d_str} 🥔: {w_rows}р, {w_bags}с, {w_workers}чел")
             
     # Формируем текст
@@ -1244,9 +1659,9 @@ def get_brigadier_stats(user_id: str, period: str) -> str:
     if period == 'week' and len(details) > 0:
         text.append("\n📝 *Детализация*:")
         # Показываем последние 10 записей
-        text.extend(details[:10])
-        if len(details) > 10:
-            text.append(f"... и еще {len(details)-10}")
+        text.extend(details)
+        if details_total > 10:
+            text.append(f"... и еще {details_total-10}")
             
     return "\n".join(text)
 
@@ -1348,13 +1763,11 @@ def cmd_my(client: WhatsApp360Client, msg: MessageObject):
         text = "📊 За 7 дней у вас записей нет."
     else:
         parts = [f"📊 *Неделя* ({start.strftime('%d.%m')}–{end.strftime('%d.%m')}):"]
-        per_day = {}
         total = 0
-        for d, loc, act, h in rows:
-            per_day.setdefault(d, []).append((loc, act, h))
-        for d in sorted(per_day.keys(), reverse=True):
+        # Строки уже отсортированы по дате (новые сначала) — группируем за один проход
+        for d, day_rows in groupby(rows, key=itemgetter(0)):
             parts.append(f"\n*{d}*")
-            for loc, act, h in per_day[d]:
+            for _, loc, act, h in day_rows:
                 parts.append(f"• {loc} — {act}: *{h}* ч")
                 total += h
         parts.append(f"\nИтого: *{total}* ч")
@@ -1362,23 +1775,62 @@ def cmd_my(client: WhatsApp360Client, msg: MessageObject):
     
     client.send_message(to=user_id, text=text)
 
+def _render_stats(title: str, rows: List[tuple], count: int, total: int) -> str:
+    """
+    Текст месячной статистики по строкам (work_date, location, activity, hours),
+    отсортированным по дате (новые сначала); count и total — по всему месяцу.
+    """
+    buf = StringIO()
+    w = buf.write
+    w(title)
+    for d, day_rows in groupby(rows, key=itemgetter(0)):
+        w(f"\n\n📅 *{d[8:10]}.{d[5:7]}*")
+        for _, loc, act, h in day_rows:
+            w(f"\n• {loc} — {act}: *{h}* ч")
+    if count > len(rows):
+        w(f"\n\n... и еще {count - len(rows)} записей")
+    w(f"\n\nИтого за месяц: *{total}* ч")
+    return buf.getvalue()
+
 # -----------------------------
 # Обработка callback кнопок
 # -----------------------------
 
-def show_date_selection(client: WhatsApp360Client, user_id: str, prefix: str):
+_today_cache: List[Any] = ["", 0.0]  # [ISO-дата, timestamp следующей полуночи]
+
+def today_iso() -> str:
+    """Сегодняшняя дата (локальное время сервера) в ISO; пересчитывается раз в сутки."""
+    now = time.time()
+    if now >= _today_cache[1]:
+        today = date.today()
+        _today_cache[0] = today.isoformat()
+        _today_cache[1] = datetime.combine(today + timedelta(days=1), datetime.min.time()).timestamp()
+    return _today_cache[0]
+
+@lru_cache(maxsize=2)
+def _month_start(today_ord: int) -> Tuple[str, str, int]:
+    """По ordinal-дню: (первое число месяца в ISO, название месяца, номер месяца)."""
+    d = date.fromordinal(today_ord)
+    return date(d.year, d.month, 1).isoformat(), MONTH_NAMES[d.month], d.month
+
+def _iso_to_ddmmyyyy(s: str) -> str:
+    """'2024-05-31' -> '31.05.2024' (вход — заведомо ISO-дата)."""
+    return f"{s[8:10]}.{s[5:7]}.{s[0:4]}"
+
+@lru_cache(maxsize=16)
+def _date_rows(today: str, prefix: str) -> Tuple[tuple, Tuple[str, ...]]:
     """
-    Универсальная функция выбора даты (последние 7 дней).
-    prefix: префикс для callback_data (например, 'work:date' или 'brig:date')
+    Секции списка выбора даты и ISO-даты последних 7 дней для prefix.
+    Ключ — сегодняшняя дата, поэтому после полуночи список строится заново.
     """
-    today = date.today()
+    today_d = date.fromisoformat(today)
     
     # Создаем список дат для интерактивного списка
     rows = []
     dates = []
     
     for i in range(7):
-        d = today - timedelta(days=i)
+        d = today_d - timedelta(days=i)
         label = "Сегодня" if i == 0 else ("Вчера" if i == 1 else d.strftime("%d.%m"))
         full_date = d.strftime("%d.%m.%Y")
         
@@ -1400,12 +1852,21 @@ def show_date_selection(client: WhatsApp360Client, user_id: str, prefix: str):
         })
     
     # Создаем секцию со списком дат
-    sections = [
+    sections = (
         {
             "title": "Выбор даты",
             "rows": rows
-        }
-    ]
+        },
+    )
+    return sections, tuple(dates)
+
+def show_date_selection(client: WhatsApp360Client, user_id: str, prefix: str):
+    """
+    Универсальная функция выбора даты (последние 7 дней).
+    prefix: префикс для callback_data (например, 'work:date' или 'brig:date')
+    """
+    # Секции общие для всех пользователей (клиент их не изменяет)
+    sections, dates = _date_rows(today_iso(), prefix)
     
     # Отправляем интерактивное сообщение со списком
     client.send_list_message(
@@ -1413,525 +1874,1097 @@ def show_date_selection(client: WhatsApp360Client, user_id: str, prefix: str):
         header_text="📅 Выбор даты",
         body_text="Выберите дату для заполнения отчета:",
         button_text="Выбрать дату",
-        sections=sections
+        sections=list(sections)
     )
     
     # Сохраняем состояние (на случай если понадобится fallback)
-    set_state(user_id, "waiting_date_selection_universal", {"dates_list": dates, "next_prefix": prefix})
-
-@wa.on_callback_button
-def handle_callback(client, btn: CallbackObject):
-    user_id = btn.from_user.wa_id
-    data = btn.data
-    
-    # Обработка кнопки "Назад" - возврат на один шаг назад
-    if data == "back:prev":
-        if go_back(client, user_id):
-            return
-        else:
-            # Если истории нет, возвращаемся в главное меню
-            u = get_user(user_id)
-            clear_state(user_id)
-            show_main_menu(client, user_id, u)
-            return
-
-    # Специальные callback для возвратов по кнопке Назад (ручной поток)
-    if data == "work:tractor:machinery":
-        state = get_state(user_id)
-        set_state(user_id, "work_tractor_machinery", state.get("data", {}), save_to_history=False)
-        lines = ["Выберите *трактор* (отправьте номер):"]
-        for i, m in enumerate(TRACTORS, 1):
-            lines.append(f"{i}. {m}")
-        client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-        return
+    set_state(user_id, "waiting_date_selection_universal", {"dates_list": list(dates), "next_prefix": prefix})
 
-    if data == "work:tractor:activity":
-        state = get_state(user_id)
-        set_state(user_id, "work_tractor_activity", state.get("data", {}), save_to_history=False)
-        lines = ["Выберите *вид деятельности* (отправьте номер):"]
-        for i, a in enumerate(ACTIVITIES_TRACTOR, 1):
-            lines.append(f"{i}. {a}")
-        client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-        return
+# adm:del:{loc|act}:CONFIRM:<id> | adm:del:loc[:PAGE:<n>] | adm:del:act:<kind>[:PAGE:<n>]
+ADM_DEL_CALLBACK_RE = re.compile(
+    r"adm:del:(?:(loc|act):CONFIRM:(\d+)|loc(?::PAGE:(\d+))?|act:(\w+)(?::PAGE:(\d+))?)"
+)
 
-    if data == "work:tractor:field":
-        state = get_state(user_id)
-        locations = list_locations_with_id(GROUP_FIELDS)
-        state["data"]["locs"] = locations
-        set_state(user_id, "work_tractor_field", state["data"], save_to_history=False)
-        lines = ["Выберите *поле* (отправьте номер):"]
-        for i, (_, name) in enumerate(locations, 1):
-            lines.append(f"{i}. {name}")
-        client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-        return
+def build_paginated_rows(items: List[Tuple[int, str]], page: int, page_size: int,
+                         confirm_prefix: str, page_prefix: str) -> Tuple[List[dict], int, int]:
+    """
+    Строки интерактивного списка для одной страницы (id, name)-элементов.
+    Возвращает (rows, page, total_pages) — page уже приведена к допустимому диапазону.
+    """
+    total_items = len(items)
+    if total_items <= page_size:
+        # Одна страница: без срезов и кнопок навигации
+        rows = [{"id": f"{confirm_prefix}{iid}", "title": name, "description": ""} for iid, name in items]
+        return rows, 0, 1
+    
+    total_pages = -(-total_items // page_size)
+    page = min(max(page, 0), total_pages - 1)
+    start_idx = page * page_size
+    rows = [
+        {"id": f"{confirm_prefix}{iid}", "title": name, "description": ""}
+        for iid, name in items[start_idx:start_idx + page_size]
+    ]
+    
+    # Кнопки навигации
+    if page > 0:
+        rows.append({"id": f"{page_prefix}{page-1}", "title": "⬅️ Назад", "description": ""})
+    if page < total_pages - 1:
+        rows.append({"id": f"{page_prefix}{page+1}", "title": "Вперед ➡️", "description": ""})
+    return rows, page, total_pages
 
-    if data == "work:tractor:crop":
-        state = get_state(user_id)
-        set_state(user_id, "work_tractor_crop", state.get("data", {}), save_to_history=False)
-        lines = ["Выберите *культуру* (отправьте номер):"]
-        for i, c in enumerate(CROPS, 1):
-            lines.append(f"{i}. {c}")
-        client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
+def _cb_back_prev(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Назад: шаг назад по истории, без истории — главное меню."""
+    if go_back(client, user_id):
         return
-
-    if data == "work:choose:type":
-        state = get_state(user_id)
-        selected_date = state.get("data", {}).get("date", date.today().isoformat())
-        set_state(user_id, "pick_work_group", {"date": selected_date}, save_to_history=False)
-        buttons = [
-            Button(title="🚜 Техника", callback_data="work:grp:tech"),
-            Button(title="✋ Ручная", callback_data="work:type:manual"),
-            Button(title="🔙 Назад", callback_data="back:prev"),
-        ]
-        d_str = date.fromisoformat(selected_date).strftime("%d.%m.%Y")
-        client.send_message(to=user_id, text=f"📅 Дата: *{d_str}*\n\nВыберите *тип работы*:", buttons=buttons)
+    else:
+        # Если истории нет, возвращаемся в главное меню
+        u = get_user(user_id)
+        clear_state(user_id)
+        show_main_menu(client, user_id, u)
         return
 
-    if data == "work:manual:activity":
-        state = get_state(user_id)
-        set_state(user_id, "work_manual_activity", state.get("data", {}), save_to_history=False)
-        lines = ["Выберите *вид работы* (отправьте номер):"]
-        for i, a in enumerate(ACTIVITIES_MANUAL, 1):
-            lines.append(f"{i}. {a}")
-        client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
+# Специальные callback для возвратов по кнопке Назад (ручной поток)
+def _cb_work_tractor_machinery(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Возврат к выбору трактора."""
+    state = S()
+    set_state(user_id, "work_tractor_machinery", state.get("data", {}), push_history=False)
+    lines = ["Выберите *трактор* (отправьте номер):"]
+    for i, m in enumerate(TRACTORS, 1):
+        lines.append(f"{i}. {m}")
+    client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+    return
+
+def _cb_work_tractor_activity(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Возврат к выбору вида деятельности трактора."""
+    state = S()
+    set_state(user_id, "work_tractor_activity", state.get("data", {}), push_history=False)
+    lines = ["Выберите *вид деятельности* (отправьте номер):"]
+    for i, a in enumerate(ACTIVITIES_TRACTOR, 1):
+        lines.append(f"{i}. {a}")
+    client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+    return
+
+def _cb_work_tractor_field(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Возврат к выбору поля (трактор)."""
+    state = S()
+    locations = list_locations_with_id(GROUP_FIELDS)
+    state["data"]["locs"] = locations
+    set_state(user_id, "work_tractor_field", state["data"], push_history=False)
+    lines = ["Выберите *поле* (отправьте номер):"]
+    for i, (_, name) in enumerate(locations, 1):
+        lines.append(f"{i}. {name}")
+    client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+    return
+
+def _cb_work_tractor_crop(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Возврат к выбору культуры (трактор)."""
+    state = S()
+    set_state(user_id, "work_tractor_crop", state.get("data", {}), push_history=False)
+    lines = ["Выберите *культуру* (отправьте номер):"]
+    for i, c in enumerate(CROPS, 1):
+        lines.append(f"{i}. {c}")
+    client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+    return
+
+def _cb_work_choose_type(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Возврат к выбору типа работ."""
+    state = S()
+    selected_date = state.get("data", {}).get("date", today_iso())
+    set_state(user_id, "pick_work_group", {"date": selected_date}, push_history=False)
+    buttons = [
+        Button(title="🚜 Техника", callback_data="work:grp:tech"),
+        Button(title="✋ Ручная", callback_data="work:type:manual"),
+        BTN_BACK,
+    ]
+    d_str = _iso_to_ddmmyyyy(selected_date)
+    client.send_message(to=user_id, text=f"📅 Дата: *{d_str}*\n\nВыберите *тип работы*:", buttons=buttons)
+    return
+
+def _cb_work_manual_activity(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Возврат к выбору вида ручной работы."""
+    state = S()
+    set_state(user_id, "work_manual_activity", state.get("data", {}), push_history=False)
+    lines = ["Выберите *вид работы* (отправьте номер):"]
+    for i, a in enumerate(ACTIVITIES_MANUAL, 1):
+        lines.append(f"{i}. {a}")
+    client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+    return
+
+def _cb_work_manual_field(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Возврат к выбору поля (ручная работа)."""
+    state = S()
+    # Перестраиваем список полей
+    locations = list_locations_with_id(GROUP_FIELDS)
+    state["data"]["locs"] = locations
+    set_state(user_id, "work_manual_field", state["data"], push_history=False)
+    lines = build_manual_location_lines(locations)
+    client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+    return
+
+def _cb_work_manual_crop(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Возврат к выбору культуры (ручная работа)."""
+    state = S()
+    set_state(user_id, "work_manual_crop", state.get("data", {}), push_history=False)
+    lines = ["Выберите *культуру* (отправьте номер):"]
+    for i, c in enumerate(CROPS, 1):
+        lines.append(f"{i}. {c}")
+    client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+    return
+
+# Обработка команды star для IT роли
+def _cb_it_star(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """IT: звездочка — выбор даты IT-отчета."""
+    if not is_it(user_id):
+        client.send_message(to=user_id, text="❌ Нет прав")
         return
+    # New flow: Start with date selection for IT
+    show_date_selection(client, user_id, prefix="it:date")
+    return
 
-    if data == "work:manual:field":
-        state = get_state(user_id)
-        # Перестраиваем список полей
-        locations = list_locations_with_id(GROUP_FIELDS)
-        state["data"]["locs"] = locations
-        set_state(user_id, "work_manual_field", state["data"], save_to_history=False)
-        lines = build_manual_location_lines(locations)
-        client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-        return
+def _cb_menu_root(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Главное меню."""
+    u = get_user(user_id)
+    clear_state(user_id)
+    show_main_menu(client, user_id, u)
 
-    if data == "work:manual:crop":
-        state = get_state(user_id)
-        set_state(user_id, "work_manual_crop", state.get("data", {}), save_to_history=False)
-        lines = ["Выберите *культуру* (отправьте номер):"]
-        for i, c in enumerate(CROPS, 1):
-            lines.append(f"{i}. {c}")
-        client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-        return
-    
-    # Обработка команды star для IT роли
-    if data == "it:star":
-        if not is_it(user_id):
-            client.send_message(to=user_id, text="❌ Нет прав")
-            return
-    # New flow: Start with date selection for IT
-        show_date_selection(client, user_id, prefix="it:date")
-        return
-    
-    elif data.startswith("it:date:"):
-        # IT flow: Date selected via list
-        selected_date = data.split(":")[2]
-        
-        # Calculate current IT hours for today
-        current_sum = sum_hours_for_user_date(user_id, selected_date, include_it=True)
-        
-        d_str = date.fromisoformat(selected_date).strftime("%d.%m.%Y")
-        text = (
-            f"📅 Дата: *{d_str}*\n"
-            f"📊 Уже внесено: *{current_sum}* ч\n\n"
-            f"Введите *количество часов*:"
-        )
-        
-        set_state(user_id, "it_waiting_hours", {"date": selected_date}, save_to_history=False)
-        quick_replies = [{"id": "back_to_date", "title": "🔙 Назад"}]
-        client.send_text_with_quick_replies(to=user_id, text=text, quick_replies=quick_replies)
+def _cb_menu_settings(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Меню настроек."""
+    # Сохраняем текущее состояние в историю перед переходом
+    save_to_history(user_id, "menu:root")
+    show_settings_menu(client, user_id, is_brigadier(user_id))
+
+def _cb_brig_settings(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Настройки бригадира."""
+    # Настройки для бригадира (возврат в меню бригадира)
+    save_to_history(user_id, "menu:brigadier")
+    show_settings_menu(client, user_id, True)
+
+def _cb_menu_work(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """ОТД: начало заполнения отчета."""
+    # Сохраняем текущее состояние в историю перед переходом
+    save_to_history(user_id, "menu:root")
+    u = get_user(user_id)
+    if not u or not (u.get("full_name") or "").strip():
+        set_state(user_id, "waiting_name", push_history=False)
+        client.send_message(to=user_id, text="Введите *Фамилию Имя* для регистрации.")
         return
     
-    if data == "menu:root":
-        u = get_user(user_id)
-        clear_state(user_id)
-        show_main_menu(client, user_id, u)
-    
-    elif data == "menu:settings":
-        # Сохраняем текущее состояние в историю перед переходом
-        save_to_history(user_id, "menu:root")
-        show_settings_menu(client, user_id, is_brigadier(user_id))
+    # ОТД - Сразу выбор даты
+    show_date_selection(client, user_id, prefix="work:date")
 
-    elif data == "brig:settings":
-        # Настройки для бригадира (возврат в меню бригадира)
-        save_to_history(user_id, "menu:brigadier")
-        show_settings_menu(client, user_id, True)
-    
-    elif data == "menu:work":
-        # Сохраняем текущее состояние в историю перед переходом
-        save_to_history(user_id, "menu:root")
-        u = get_user(user_id)
-        if not u or not (u.get("full_name") or "").strip():
-            set_state(user_id, "waiting_name", save_to_history=False)
-            client.send_message(to=user_id, text="Введите *Фамилию Имя* для регистрации.")
-            return
-        
-        # ОТД - Сразу выбор даты
-        show_date_selection(client, user_id, prefix="work:date")
+def _cb_brig_work(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """ОТД из меню бригадира."""
+    # ОТД из меню бригадира (возврат в меню бригадира)
+    save_to_history(user_id, "menu:brigadier")
+    u = get_user(user_id)
+    if not u or not (u.get("full_name") or "").strip():
+        set_state(user_id, "waiting_name", push_history=False)
+        client.send_message(to=user_id, text="Введите *Фамилию Имя* для регистрации.")
+        return
+    show_date_selection(client, user_id, prefix="work:date")
 
-    elif data == "brig:work":
-        # ОТД из меню бригадира (возврат в меню бригадира)
-        save_to_history(user_id, "menu:brigadier")
-        u = get_user(user_id)
-        if not u or not (u.get("full_name") or "").strip():
-            set_state(user_id, "waiting_name", save_to_history=False)
-            client.send_message(to=user_id, text="Введите *Фамилию Имя* для регистрации.")
-            return
-        show_date_selection(client, user_id, prefix="work:date")
+def _cb_menu_stats(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Личная статистика за месяц (для админа — выбор категории)."""
+    # Сохраняем текущее состояние в историю перед переходом
+    save_to_history(user_id, "menu:root")
     
-    elif data == "menu:stats":
-        # Сохраняем текущее состояние в историю перед переходом
-        save_to_history(user_id, "menu:root")
-        
-        # Приоритет: если пользователь IT, показываем ЛИЧНУЮ статистику (все типы)
-        # Даже если он админ. Админскую он может посмотреть через sts или меню админа.
-        if is_it(user_id):
-            today = date.today()
-            start_date = date(today.year, today.month, 1).isoformat()
-            end_date = today.isoformat()
-            
-            # Fetch all reports for user (including IT)
-            with connect() as con, closing(con.cursor()) as c:
-                rows = c.execute("""
-                    SELECT work_date, location, activity, hours
-                    FROM reports 
-                    WHERE user_id=? AND work_date BETWEEN ? AND ?
-                    ORDER BY work_date DESC, created_at DESC
-                """, (user_id, start_date, end_date)).fetchall()
-            
-            month_name = calendar.month_name[today.month]
-            if not rows:
-                text = f"📊 *Моя статистика за {month_name}*\n\nЗаписей нет."
-            else:
-                parts = [f"📊 *Моя статистика за {month_name}*:"]
-                per_day = {}
-                total = 0
-                for d, loc, act, h in rows:
-                    per_day.setdefault(d, []).append((loc, act, h))
-                
-                for d in sorted(per_day.keys(), reverse=True):
-                    d_obj = date.fromisoformat(d)
-                    d_str = d_obj.strftime("%d.%m")
-                    parts.append(f"\n📅 *{d_str}*")
-                    for loc, act, h in per_day[d]:
-                        parts.append(f"• {loc} — {act}: *{h}* ч")
-                        total += h
-                parts.append(f"\nИтого за месяц: *{total}* ч")
-                text = "\n".join(parts)
-            
-            buttons = [
-                Button(title="✏️ Изменить", callback_data="menu:edit_list"),
-                Button(title="🗑 Удалить", callback_data="menu:delete_list"),
-                Button(title="🔙 Назад", callback_data="back:prev"),
-            ]
-            
-            client.send_message(to=user_id, text=text, buttons=buttons)
-            return
-
-        # 1. Admin Logic (если не IT)
-        if is_admin(user_id):
-            buttons = [
-                Button(title="🚜 Terra (Все)", callback_data="stats:admin:terra"),
-                Button(title="👷 Бригадиры (Все)", callback_data="stats:admin:brig"),
-                Button(title="🔙 Назад", callback_data="back:prev"),
-            ]
-            client.send_message(to=user_id, text="📊 *Статистика администратора*\n\nВыберите категорию:", buttons=buttons)
-            return
-
-        # 3. Brigadier Logic
-        if is_brigadier(user_id):
-            # Show brigadier stats for current month
-            today = date.today()
-            start_date = date(today.year, today.month, 1).isoformat()
-            
-            # Fetch brigadier reports
-            with connect() as con, closing(con.cursor()) as c:
-                rows = c.execute("""
-                    SELECT work_date, work_type, rows, bags, workers, field 
-                    FROM brigadier_reports 
-                    WHERE user_id = ? AND work_date >= ?
-                    ORDER BY work_date DESC
-                """, (user_id, start_date)).fetchall()
-            
-            month_name = calendar.month_name[today.month]
-            if not rows:
-                text = f"📊 *Статистика за {month_name}*\n\nЗаписей нет."
-            else:
-                parts = [f"📊 *Статистика за {month_name}*:"]
-                per_day = {}
-                
-                # Aggregates
-                total_rows = 0
-                total_bags = 0
-                
-                for r in rows:
-                    w_date, w_type, w_rows, w_bags, w_workers, w_field = r
-                    per_day.setdefault(w_date, []).append((w_type, w_rows, w_bags, w_workers, w_field))
-                    total_rows += w_rows
-                    total_bags += w_bags
-                
-                for d in sorted(per_day.keys(), reverse=True):
-                    d_obj = date.fromisoformat(d)
-                    d_str = d_obj.strftime("%d.%m")
-                    parts.append(f"\n📅 *{d_str}*")
-                    for w_type, w_rows, w_bags, w_workers, w_field in per_day[d]:
-                        field_info = f" ({w_field})" if w_field else ""
-                        if w_type == "Кабачок":
-                            parts.append(f"• 🥒 {w_rows}р, {w_workers}ч{field_info}")
-                        else:
-                            parts.append(f"• 🥔 {w_rows}р, {w_bags}с, {w_workers}ч{field_info}")
-                
-                parts.append(f"\nИтого: *{total_rows}* рядов, *{total_bags}* сеток")
-                text = "\n".join(parts)
-            
-            buttons = [
-                Button(title="✏️ Изменить", callback_data="menu:edit_list"),
-                Button(title="🗑 Удалить", callback_data="menu:delete_list"),
-                Button(title="🔙 Назад", callback_data="back:prev"),
-            ]
-            client.send_message(to=user_id, text=text, buttons=buttons)
-            return
-
-        # 3. Regular User Logic
+    # Приоритет: если пользователь IT, показываем ЛИЧНУЮ статистику (все типы)
+    # Даже если он админ. Админскую он может посмотреть через sts или меню админа.
+    if is_it(user_id):
         today = date.today()
         start_date = date(today.year, today.month, 1).isoformat()
         end_date = today.isoformat()
         
-        rows = fetch_stats_range_for_user(user_id, start_date, end_date)
-        
-        month_name = calendar.month_name[today.month]
+        # Reports for user (including IT): последние STATS_DETAIL_LIMIT записей + итог по всему месяцу
+        with connect() as con, closing(con.cursor()) as c:
+            rows = c.execute("""
+                SELECT work_date, location, activity, hours
+                FROM reports 
+                WHERE user_id=? AND work_date BETWEEN ? AND ?
+                ORDER BY work_date DESC, created_at DESC
+                LIMIT ?
+            """, (user_id, start_date, end_date, STATS_DETAIL_LIMIT)).fetchall()
+            total, count = c.execute(
+                "SELECT COALESCE(SUM(hours),0), COUNT(*) FROM reports WHERE user_id=? AND work_date BETWEEN ? AND ?",
+                (user_id, start_date, end_date)
+            ).fetchone()
+        
+        month_name = MONTH_NAMES[today.month]
         if not rows:
-            text = f"📊 *Статистика за {month_name}*\n\nЗаписей нет."
+            text = f"📊 *Моя статистика за {month_name}*\n\nЗаписей нет."
         else:
-            parts = [f"📊 *Статистика за {month_name}*:"]
-            per_day = {}
-            total = 0
-            for d, loc, act, h in rows:
-                per_day.setdefault(d, []).append((loc, act, h))
-            
-            for d in sorted(per_day.keys(), reverse=True):
-                d_obj = date.fromisoformat(d)
-                d_str = d_obj.strftime("%d.%m")
-                parts.append(f"\n📅 *{d_str}*")
-                for loc, act, h in per_day[d]:
-                    parts.append(f"• {loc} — {act}: *{h}* ч")
-                    total += h
-            parts.append(f"\nИтого за месяц: *{total}* ч")
-            text = "\n".join(parts)
+            text = _render_stats(f"📊 *Моя статистика за {month_name}*:", rows, count, total)
         
         buttons = [
             Button(title="✏️ Изменить", callback_data="menu:edit_list"),
             Button(title="🗑 Удалить", callback_data="menu:delete_list"),
-            Button(title="🔙 Назад", callback_data="back:prev"),
+            BTN_BACK,
         ]
         
         client.send_message(to=user_id, text=text, buttons=buttons)
+        return
 
-    elif data == "stats:admin:terra":
-        if not is_admin(user_id): return
-        today = date.today()
-        start_date = date(today.year, today.month, 1).isoformat()
-        
-        with connect() as con, closing(con.cursor()) as c:
-            rows = c.execute("""
-                SELECT work_date, COUNT(DISTINCT user_id), SUM(hours)
-                FROM reports
-                WHERE work_date >= ? AND location_grp != 'it' AND activity_grp != 'it'
-                GROUP BY work_date
-                ORDER BY work_date DESC
-            """, (start_date,)).fetchall()
-            
-        month_name = calendar.month_name[today.month]
-        if not rows:
-            text = f"🚜 *Terra (Все) - {month_name}*\n\nЗаписей нет."
-        else:
-            lines = [f"🚜 *Terra (Все) - {month_name}*\n"]
-            total_h = 0
-            for r in rows:
-                wd, users, hours = r
-                d_str = date.fromisoformat(wd).strftime("%d.%m")
-                lines.append(f"📅 *{d_str}*: {users} чел, *{hours}* ч")
-                total_h += hours
-            lines.append(f"\nВсего часов: *{total_h}*")
-            lines.append("\n💡 /x -open full")
-            text = "\n".join(lines)
-            
-        # Set state to allow 'x' command
-        set_state(user_id, "admin_viewing_stats", {"type": "terra"})
-        client.send_message(to=user_id, text=text)
+    # 1. Admin Logic (если не IT)
+    if is_admin(user_id):
+        buttons = [
+            Button(title="🚜 Terra (Все)", callback_data="stats:admin:terra"),
+            Button(title="👷 Бригадиры (Все)", callback_data="stats:admin:brig"),
+            BTN_BACK,
+        ]
+        client.send_message(to=user_id, text="📊 *Статистика администратора*\n\nВыберите категорию:", buttons=buttons)
+        return
 
-    elif data == "stats:admin:brig":
-        if not is_admin(user_id): return
+    # 3. Brigadier Logic
+    if is_brigadier(user_id):
+        # Show brigadier stats for current month
         today = date.today()
         start_date = date(today.year, today.month, 1).isoformat()
         
+        # Fetch brigadier reports: детализация ограничена, итоги — агрегатом по всему месяцу
         with connect() as con, closing(con.cursor()) as c:
             rows = c.execute("""
-                SELECT work_date, COUNT(DISTINCT user_id), SUM(rows), SUM(bags)
-                FROM brigadier_reports
-                WHERE work_date >= ?
-                GROUP BY work_date
+                SELECT work_date, work_type, rows, bags, workers, field 
+                FROM brigadier_reports 
+                WHERE user_id = ? AND work_date >= ?
                 ORDER BY work_date DESC
-            """, (start_date,)).fetchall()
-            
-        month_name = calendar.month_name[today.month]
+                LIMIT ?
+            """, (user_id, start_date, STATS_DETAIL_LIMIT)).fetchall()
+            total_rows, total_bags, count = c.execute(
+                "SELECT COALESCE(SUM(rows),0), COALESCE(SUM(bags),0), COUNT(*) FROM brigadier_reports WHERE user_id = ? AND work_date >= ?",
+                (user_id, start_date)
+            ).fetchone()
+        
+        month_name = MONTH_NAMES[today.month]
         if not rows:
-            text = f"👷 *Бригадиры (Все) - {month_name}*\n\nЗаписей нет."
+            text = f"📊 *Статистика за {month_name}*\n\nЗаписей нет."
         else:
-            lines = [f"👷 *Бригадиры (Все) - {month_name}*\n"]
-            t_rows, t_bags = 0, 0
-            for r in rows:
-                wd, users, r_rows, r_bags = r
-                d_str = date.fromisoformat(wd).strftime("%d.%m")
-                lines.append(f"📅 *{d_str}*: {users} бриг, {r_rows}р, {r_bags}с")
-                t_rows += r_rows
-                t_bags += r_bags
-            lines.append(f"\nИтого: *{t_rows}* рядов, *{t_bags}* сеток")
-            lines.append("\n💡 /x -open full")
-            text = "\n".join(lines)
+            parts = [f"📊 *Статистика за {month_name}*:"]
+            for d, day_rows in groupby(rows, key=itemgetter(0)):
+                parts.append(f"\n📅 *{d[8:10]}.{d[5:7]}*")
+                for _, w_type, w_rows, w_bags, w_workers, w_field in day_rows:
+                    field_info = f" ({w_field})" if w_field else ""
+                    if w_type == "Кабачок":
+                        parts.append(f"• 🥒 {w_rows}р, {w_workers}ч{field_info}")
+                    else:
+                        parts.append(f"• 🥔 {w_rows}р, {w_bags}с, {w_workers}ч{field_info}")
+            if count > len(rows):
+                parts.append(f"\n... и еще {count - len(rows)} записей")
             
-        # Set state to allow 'x' command
-        set_state(user_id, "admin_viewing_stats", {"type": "brig"})
-        client.send_message(to=user_id, text=text)
-
-    elif data == "menu:edit_list":
-        # Logic to show list for editing (similar to old menu:edit)
-        # We need to handle both regular and brigadier reports if needed, 
-        # but for now let's stick to the user's role.
+            parts.append(f"\nИтого: *{total_rows}* рядов, *{total_bags}* сеток")
+            text = "\n".join(parts)
         
-        if is_brigadier(user_id):
-             # Brigadier edit list (last 24h or recent)
-             # For simplicity, let's show recent 5
-             with connect() as con, closing(con.cursor()) as c:
-                rows = c.execute("""
-                    SELECT id, work_date, work_type, rows, field 
-                    FROM brigadier_reports 
-                    WHERE user_id=? 
-                    ORDER BY created_at DESC LIMIT 5
-                """, (user_id,)).fetchall()
-             
-             if not rows:
-                 client.send_message(to=user_id, text="📝 Нет недавних записей для редактирования.")
-                 return
-                 
-             lines = ["Выберите *запись* для изменения (отправьте номер):"]
-             state = get_state(user_id)
-             state["data"]["edit_list_brig"] = rows
-             set_state(user_id, "wait_edit_brig_select", state["data"])
-             
-             for i, r in enumerate(rows, 1):
-                 rid, wd, wt, wr, wf = r
-                 lines.append(f"{i}. {wd} | {wt} ({wr}р) {wf or ''}")
-             lines.append("\n0. 🔙 Назад")
-             client.send_message(to=user_id, text="\n".join(lines))
-             return
+        buttons = [
+            Button(title="✏️ Изменить", callback_data="menu:edit_list"),
+            Button(title="🗑 Удалить", callback_data="menu:delete_list"),
+            BTN_BACK,
+        ]
+        client.send_message(to=user_id, text=text, buttons=buttons)
+        return
 
-        # Regular user or IT user edit list
-        # For IT users, we should also show IT reports.
-        # user_recent_24h_reports filters out IT/admin reports by default.
-        # We need to use a custom query for IT or update user_recent_24h_reports to accept an option.
-        # Let's write a custom query here to be safe and explicit.
-        
-        if is_it(user_id):
-             # IT user sees everything for last 24h
-             with connect() as con, closing(con.cursor()) as c:
-                rows = c.execute("""
-                    SELECT id, work_date, activity, location, hours, created_at
-                    FROM reports 
-                    WHERE user_id=? AND created_at >= datetime('now', '-1 day')
-                    ORDER BY created_at DESC
-                """, (user_id,)).fetchall()
-        else:
-             rows = user_recent_24h_reports(user_id)
-             
-        if not rows:
-            client.send_message(to=user_id, text="📝 За последние 24 часа записей нет.")
-            return
-        
-        state = get_state(user_id)
-        state["data"]["edit_records"] = rows
-        # Change state to new multi-select state
-        set_state(user_id, "waiting_edit_selection_multi", state["data"])
-        
-        lines = ["Выберите *записи* для изменения (через запятую или пробел):"]
-        for i, r in enumerate(rows, 1):
-            rid, wdate, act, loc, h, _ = r
-            lines.append(f"{i}. {wdate} | {act} ({loc}) — *{h}ч*")
-        lines.append("\n0. 🔙 Назад")
+    # 3. Regular User Logic
+    today = date.today()
+    start_date = date(today.year, today.month, 1).isoformat()
+    end_date = today.isoformat()
+    
+    rows = fetch_stats_range_for_user(user_id, start_date, end_date, limit=STATS_DETAIL_LIMIT)
+    
+    month_name = MONTH_NAMES[today.month]
+    if not rows:
+        text = f"📊 *Статистика за {month_name}*\n\nЗаписей нет."
+    else:
+        total, count = sum_stats_range_for_user(user_id, start_date, end_date)
+        text = _render_stats(f"📊 *Статистика за {month_name}*:", rows, count, total)
+    
+    buttons = [
+        Button(title="✏️ Изменить", callback_data="menu:edit_list"),
+        Button(title="🗑 Удалить", callback_data="menu:delete_list"),
+        BTN_BACK,
+    ]
+    
+    client.send_message(to=user_id, text=text, buttons=buttons)
+
+def _cb_stats_admin_terra(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Админ: сводка Terra за месяц."""
+    if not is_admin(user_id): return
+    today = date.today()
+    start_date = date(today.year, today.month, 1).isoformat()
+    
+    with connect() as con, closing(con.cursor()) as c:
+        rows = c.execute("""
+            SELECT work_date, COUNT(DISTINCT user_id), SUM(hours)
+            FROM reports
+            WHERE work_date >= ? AND is_it_report=0
+            GROUP BY work_date
+            ORDER BY work_date DESC
+        """, (start_date,)).fetchall()
         
+    month_name = MONTH_NAMES[today.month]
+    if not rows:
+        text = f"🚜 *Terra (Все) - {month_name}*\n\nЗаписей нет."
+    else:
+        lines = [f"🚜 *Terra (Все) - {month_name}*\n"]
+        total_h = 0
+        for r in rows:
+            wd, users, hours = r
+            d_str = date.fromisoformat(wd).strftime("%d.%m")
+            lines.append(f"📅 *{d_str}*: {users} чел, *{hours}* ч")
+            total_h += hours
+        lines.append(f"\nВсего часов: *{total_h}*")
+        lines.append("\n💡 /x -open full")
         text = "\n".join(lines)
-        client.send_message(to=user_id, text=text)
+        
+    # Set state to allow 'x' command
+    set_state(user_id, "admin_viewing_stats", {"type": "terra"})
+    client.send_message(to=user_id, text=text)
 
-    elif data == "menu:delete_list":
-        # Logic to show list for deletion
-        if is_brigadier(user_id):
-             with connect() as con, closing(con.cursor()) as c:
-                rows = c.execute("""
-                    SELECT id, work_date, work_type, rows, field 
-                    FROM brigadier_reports 
-                    WHERE user_id=? 
-                    ORDER BY created_at DESC LIMIT 5
-                """, (user_id,)).fetchall()
-             
-             if not rows:
-                 client.send_message(to=user_id, text="🗑 Нет недавних записей для удаления.")
-                 return
-                 
-             lines = ["Выберите *запись* для удаления (отправьте номер):"]
-             state = get_state(user_id)
-             state["data"]["del_list_brig"] = rows
-             set_state(user_id, "wait_del_brig_select", state["data"])
+def _cb_stats_admin_brig(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Админ: сводка бригадиров за месяц."""
+    if not is_admin(user_id): return
+    today = date.today()
+    start_date = date(today.year, today.month, 1).isoformat()
+    
+    with connect() as con, closing(con.cursor()) as c:
+        rows = c.execute("""
+            SELECT work_date, COUNT(DISTINCT user_id), SUM(rows), SUM(bags)
+            FROM brigadier_reports
+            WHERE work_date >= ?
+            GROUP BY work_date
+            ORDER BY work_date DESC
+        """, (start_date,)).fetchall()
+        
+    month_name = MONTH_NAMES[today.month]
+    if not rows:
+        text = f"👷 *Бригадиры (Все) - {month_name}*\n\nЗаписей нет."
+    else:
+        lines = [f"👷 *Бригадиры (Все) - {month_name}*\n"]
+        t_rows, t_bags = 0, 0
+        for r in rows:
+            wd, users, r_rows, r_bags = r
+            d_str = date.fromisoformat(wd).strftime("%d.%m")
+            lines.append(f"📅 *{d_str}*: {users} бриг, {r_rows}р, {r_bags}с")
+            t_rows += r_rows
+            t_bags += r_bags
+        lines.append(f"\nИтого: *{t_rows}* рядов, *{t_bags}* сеток")
+        lines.append("\n💡 /x -open full")
+        text = "\n".join(lines)
+        
+    # Set state to allow 'x' command
+    set_state(user_id, "admin_viewing_stats", {"type": "brig"})
+    client.send_message(to=user_id, text=text)
+
+def _cb_menu_edit_list(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Список последних записей для изменения."""
+    # Logic to show list for editing (similar to old menu:edit)
+    # We need to handle both regular and brigadier reports if needed, 
+    # but for now let's stick to the user's role.
+    
+    if is_brigadier(user_id):
+         # Brigadier edit list (last 24h or recent)
+         # For simplicity, let's show recent 5
+         with connect() as con, closing(con.cursor()) as c:
+            rows = c.execute(SQL_BRIG_RECENT_REPORTS, (user_id,)).fetchall()
+         
+         if not rows:
+             client.send_message(to=user_id, text="📝 Нет недавних записей для редактирования.")
+             return
              
-             for i, r in enumerate(rows, 1):
-                 rid, wd, wt, wr, wf = r
-                 lines.append(f"{i}. {wd} | {wt} ({wr}р) {wf or ''}")
-             lines.append("\n0. 🔙 Назад")
-             client.send_message(to=user_id, text="\n".join(lines))
+         lines = ["Выберите *запись* для изменения (отправьте номер):"]
+         state = S()
+         state["data"]["edit_list_brig"] = rows
+         set_state(user_id, "wait_edit_brig_select", state["data"])
+         
+         for i, r in enumerate(rows, 1):
+             rid, wd, wt, wr, wf = r
+             lines.append(f"{i}. {wd} | {wt} ({wr}р) {wf or ''}")
+         lines.append("\n0. 🔙 Назад")
+         client.send_message(to=user_id, text="\n".join(lines))
+         return
+
+    # Regular user or IT user edit list
+    # For IT users, we should also show IT reports.
+    # user_recent_24h_reports filters out IT/admin reports by default.
+    # We need to use a custom query for IT or update user_recent_24h_reports to accept an option.
+    # Let's write a custom query here to be safe and explicit.
+    
+    if is_it(user_id):
+         # IT user sees everything for last 24h
+         with connect() as con, closing(con.cursor()) as c:
+            rows = c.execute(SQL_IT_RECENT_REPORTS, (user_id,)).fetchall()
+    else:
+         rows = user_recent_24h_reports(user_id)
+         
+    if not rows:
+        client.send_message(to=user_id, text="📝 За последние 24 часа записей нет.")
+        return
+    
+    state = S()
+    state["data"]["edit_records"] = rows
+    # Change state to new multi-select state
+    set_state(user_id, "waiting_edit_selection_multi", state["data"])
+    
+    lines = ["Выберите *записи* для изменения (через запятую или пробел):"]
+    for i, r in enumerate(rows, 1):
+        rid, wdate, act, loc, h, _ = r
+        lines.append(f"{i}. {wdate} | {act} ({loc}) — *{h}ч*")
+    lines.append("\n0. 🔙 Назад")
+    
+    text = "\n".join(lines)
+    client.send_message(to=user_id, text=text)
+
+def _cb_menu_delete_list(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Список последних записей для удаления."""
+    # Logic to show list for deletion
+    if is_brigadier(user_id):
+         with connect() as con, closing(con.cursor()) as c:
+            rows = c.execute(SQL_BRIG_RECENT_REPORTS, (user_id,)).fetchall()
+         
+         if not rows:
+             client.send_message(to=user_id, text="🗑 Нет недавних записей для удаления.")
              return
+             
+         lines = ["Выберите *запись* для удаления (отправьте номер):"]
+         state = S()
+         state["data"]["del_list_brig"] = rows
+         set_state(user_id, "wait_del_brig_select", state["data"])
+         
+         for i, r in enumerate(rows, 1):
+             rid, wd, wt, wr, wf = r
+             lines.append(f"{i}. {wd} | {wt} ({wr}р) {wf or ''}")
+         lines.append("\n0. 🔙 Назад")
+         client.send_message(to=user_id, text="\n".join(lines))
+         return
+
+    # Regular user or IT user delete list
+    if is_it(user_id):
+         # IT user sees everything for last 24h
+         with connect() as con, closing(con.cursor()) as c:
+            rows = c.execute(SQL_IT_RECENT_REPORTS, (user_id,)).fetchall()
+    else:
+         rows = user_recent_24h_reports(user_id)
 
-        # Regular user or IT user delete list
-        if is_it(user_id):
-             # IT user sees everything for last 24h
-             with connect() as con, closing(con.cursor()) as c:
-                rows = c.execute("""
-                    SELECT id, work_date, activity, location, hours, created_at
-                    FROM reports 
-                    WHERE user_id=? AND created_at >= datetime('now', '-1 day')
-                    ORDER BY created_at DESC
-                """, (user_id,)).fetchall()
-        else:
-             rows = user_recent_24h_reports(user_id)
+    if not rows:
+        client.send_message(to=user_id, text="🗑 За последние 24 часа записей нет.")
+        return
+        
+    state = S()
+    state["data"]["del_records"] = rows
+    set_state(user_id, "waiting_del_selection", state["data"])
+    
+    lines = ["Выберите *запись* для удаления (отправьте номер):"]
+    for i, r in enumerate(rows, 1):
+        rid, wdate, act, loc, h, _ = r
+        lines.append(f"{i}. {wdate} | {act} ({loc}) — *{h}ч*")
+    lines.append("\n0. 🔙 Назад")
+    client.send_message(to=user_id, text="\n".join(lines))
+
+def _cb_menu_name(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Смена имени."""
+    set_state(user_id, "waiting_name")
+    client.send_message(to=user_id, text="✏️ Введите *Фамилию Имя* для изменения (например: *Иванов Иван*):")
+
+def _cb_tim_party(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """TIM: выбор даты отчета."""
+    if not is_tim(user_id):
+        client.send_message(to=user_id, text="❌ Нет прав")
+        return
+    # Start TIM flow: Date selection
+    show_date_selection(client, user_id, prefix="tim:date")
+
+def _cb_tim_tmpl_yes(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """TIM: заполнить отчет по шаблону."""
+    # Use template
+    state = S()
+    tmpl = state["data"].get("template")
+    work_date = state["data"].get("date")
+    
+    if not tmpl or not work_date:
+        client.send_message(to=user_id, text="❌ Ошибка шаблона. Начните заново.")
+        return
+        
+    # Go to hours confirmation (or skip if we trust the template hours completely? 
+    # The prompt says "simplified filling of date and hours", implying loc/act are auto-filled.
+    # So we should probably let them edit hours if they want, or just confirm.
+    # "simplified filling of date and hours" -> maybe we just ask hours?
+    # Let's confirm hours.
+    
+    state["data"]["tim_report"] = {
+        "activity": tmpl["activity"],
+        "location": tmpl["location"],
+        "date": work_date
+    }
+    # Pre-fill hours from template but allow change? 
+    # Or just go to confirmation. Let's go to confirmation with template hours.
+    state["data"]["tim_report"]["hours"] = tmpl["hours"]
+    
+    set_state(user_id, "tim_confirm", state["data"], push_history=False)
+    
+    d_str = _iso_to_ddmmyyyy(work_date)
+    text = (
+        f"🇨🇳 *Подтверждение*\n\n"
+        f"📅 Дата: *{d_str}*\n"
+        f"Работа: *{tmpl['activity']}*\n"
+        f"Место: *{tmpl['location']}*\n"
+        f"Часы: *{tmpl['hours']}*\n\n"
+        f"Все верно?"
+    )
+    buttons = [
+        Button(title="✅ Подтвердить", callback_data="tim:save:simple"),
+        Button(title="✏️ Изменить часы", callback_data="tim:edit:hours"), # Option to edit hours
+        Button(title="🔄 Заново", callback_data="tim:party")
+    ]
+    client.send_message(to=user_id, text=text, buttons=buttons)
 
-        if not rows:
-            client.send_message(to=user_id, text="🗑 За последние 24 часа записей нет.")
-            return
+def _cb_tim_tmpl_no(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """TIM: заполнить отчет вручную."""
+    # Manual flow
+    state = S()
+    work_date = state["data"].get("date")
+    set_state(user_id, "tim_wait_activity", {"date": work_date}, push_history=False)
+    client.send_message(to=user_id, text="🇨🇳 Введите *вид работы*:\n\n0. 🔙 Назад")
+
+def _cb_tim_edit_hours(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """TIM: изменить часы."""
+    state = S()
+    set_state(user_id, "tim_wait_hours", state["data"], push_history=False)
+    client.send_message(to=user_id, text="🕒 Введите *количество часов*:\n\n0. 🔙 Назад")
+
+def _cb_tim_save_simple(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """TIM: сохранить отчет по шаблону."""
+    # Save from template/confirmed state
+    _save_tim_report(client, user_id)
+
+def _cb_tim_save_template(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """TIM: сохранить отчет, введенный вручную."""
+    # Save manual entry AND allow future templating (implicit by saving to DB)
+    _save_tim_report(client, user_id)
+
+def _cb_menu_admin(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Админ-меню."""
+    if not is_admin(user_id):
+        client.send_message(to=user_id, text="❌ Нет прав")
+        return
+    
+    # Сохраняем текущее состояние в историю перед переходом
+    save_to_history(user_id, "menu:more")
+    buttons = [
+        Button(title="➕➖ Работы", callback_data="adm:menu:activities"),
+        Button(title="➕➖ Локации", callback_data="adm:menu:locations"),
+        Button(title="📤 Экспорт", callback_data="adm:export"),
+    ]
+    # Добавляем кнопку управления бригадирами
+    buttons.append(Button(title="👷 Бригадиры", callback_data="adm:menu:brigadiers"))
+    client.send_message(to=user_id, text="⚙️ *Админ-панель*:", buttons=buttons[:3])
+
+def _cb_adm_menu_activities(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Админ: управление видами работ."""
+    if not is_admin(user_id):
+        client.send_message(to=user_id, text="❌ Нет прав")
+        return
+    # Сохраняем текущее состояние в историю перед переходом
+    save_to_history(user_id, "menu:admin")
+    buttons = [
+        Button(title="➕ Добавить работу", callback_data="adm:add:act"),
+        Button(title="➖ Удалить работу", callback_data="adm:del:act"),
+        BTN_BACK,
+    ]
+    client.send_message(to=user_id, text="⚙️ *Управление работами*:", buttons=buttons)
+
+def _cb_adm_menu_locations(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Админ: управление локациями."""
+    if not is_admin(user_id):
+        client.send_message(to=user_id, text="❌ Нет прав")
+        return
+    # Сохраняем текущее состояние в историю перед переходом
+    save_to_history(user_id, "menu:admin")
+    client.send_message(to=user_id, text="⚙️ *Управление локациями*:", buttons=_LOC_ADMIN_MENU)
+
+def _cb_stats_today(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Статистика за сегодня."""
+    cmd_today(client, btn)
+
+def _cb_stats_week(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Статистика за неделю."""
+    cmd_my(client, btn)
+
+def _cb_cancel_activity(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Отмена выбора вида работ — назад к типу работ."""
+    # Cancel activity selection, return to work type selection
+    buttons = [
+        Button(title="🚜 Трактор", callback_data="work:type:tractor"),
+        Button(title="🚛 КамАЗ", callback_data="work:type:kamaz"),
+        Button(title="✋ Ручная", callback_data="work:type:manual"),
+    ]
+    client.send_message(to=user_id, text="Выберите *тип работы*:", buttons=buttons)
+    # Don't clear state, just go back to work_pick_type? 
+    # Actually we need to reset state to work_pick_type to be clean
+    # state = get_state(user_id)
+    # date = state["data"].get("date")
+    # set_state(user_id, "work_pick_type", {"date": date})
+    return
+
+def _cb_cancel_location(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Отмена выбора локации — шаг назад."""
+    # Cancel location selection, return back using history
+    if go_back(client, user_id):
+        return
+    else:
+        # Fallback: return to location group selection
+        state = S()
+        work_data = state["data"].get("work", {})
+        activity_name = work_data.get("activity", "работа")
+        
+        buttons = [
+            Button(title="Поля", callback_data="work:locgrp:fields"),
+            Button(title="Склад", callback_data="work:locgrp:ware"),
+            BTN_BACK,
+        ]
+        client.send_message(to=user_id, text=f"✅ Выбрано: *{activity_name}*\n\nТеперь выберите *локацию*:", buttons=buttons)
+    return
+
+def _cb_work_grp_tech(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Техника: выбор Трактор/КамАЗ."""
+    # Intermediate step: Technique -> Tractor/KamAZ choice
+    state = S()
+    data_payload = state.get("data", {}) if state else {}
+    work_date = data_payload.get("date", today_iso())
+    # Сохраняем префил часов, если он уже введен
+    prefilled_hours = data_payload.get("prefilled_hours")
+    work_data = data_payload.get("work", {}) or {}
+    work_data["date"] = work_date
+    new_data = {
+        "date": work_date,
+        "work": work_data,
+        "prefilled_hours": prefilled_hours,
+    }
+    
+    # Save current state so Back works (returns to date selection/menu:work)
+    set_state(user_id, "work_pick_type", new_data, back_callback="menu:work")
+    
+    buttons = [
+        Button(title="🚜 Трактор", callback_data="work:type:tractor"),
+        Button(title="🚛 КамАЗ", callback_data="work:type:kamaz"),
+        BTN_BACK,
+    ]
+    d_str = _iso_to_ddmmyyyy(work_date)
+    client.send_message(to=user_id, text=f"📅 Дата: *{d_str}*\n\nВыберите *технику*:", buttons=buttons)
+
+def _cb_confirm_it(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """IT: подтверждение отчета."""
+    if not is_it(user_id):
+        client.send_message(to=user_id, text="❌ Нет прав")
+        return
+    # IT отчет (loc_grp/act_grp = "it" — не в общую группу), без релея
+    _finalize_report(client, user_id, S()["data"].get("temp_report"), relay=False)
+
+def _cb_edit_it(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """IT: изменить отчет перед сохранением."""
+    if not is_it(user_id):
+        client.send_message(to=user_id, text="❌ Нет прав")
+        return
+    # Возвращаемся к вводу часов
+    set_state(user_id, "it_waiting_hours", {}, push_history=False)
+    client.send_message(to=user_id, text="Введите *количество часов*:\n\n0. 🔙 Назад")
+
+def _cb_confirm_worker(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Подтверждение отчета работяги."""
+    _finalize_report(client, user_id, S()["data"].get("temp_report"), relay=True)
+
+def _cb_edit_worker(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Изменить отчет работяги — заново с выбора даты."""
+    # Restart flow
+    show_date_selection(client, user_id, prefix="work:date")
+
+def _cb_confirm_brig(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Подтверждение отчета бригадира."""
+    state = S()
+    temp_report = state["data"].get("temp_report")
+    if not temp_report:
+        client.send_message(to=user_id, text="❌ Данные устарели. Начните заново.")
+        return
+        
+    # Save report
+    u = get_user(user_id)
+    username = u.get("full_name") if u else user_id
+    
+    report_id = save_brigadier_report(
+        user_id=user_id,
+        username=username,
+        work_type=temp_report["work_type"],
+        rows=temp_report["rows"],
+        field=temp_report["field"],
+        bags=temp_report.get("bags", 0),
+        workers=temp_report["workers"],
+        work_date=temp_report["work_date"]
+    )
+    
+    # Auto-export (в фоне, ответ пользователю не ждет Google Sheets)
+    if GOOGLE_SHEETS_AVAILABLE:
+        run_in_background(export_brigadier_report_to_sheet, report_id)
+    
+    d_str = _iso_to_ddmmyyyy(temp_report["work_date"])
+    
+    text = (
+        f"✅ *Отчет сохранен*\n\n"
+        f"📅 Дата: *{d_str}*\n"
+        f"Тип: *{temp_report['work_type']}*\n"
+        f"Рядов: *{temp_report['rows']}*\n"
+        f"Поле: *{temp_report['field']}*\n"
+    )
+    if temp_report.get("bags"):
+         text += f"Сеток: *{temp_report['bags']}*\n"
+         
+    text += (
+        f"Людей: *{temp_report['workers']}*\n"
+        f"ID отчета: `#{report_id}`"
+    )
+    
+    clear_state(user_id)
+    client.send_message(to=user_id, text=text)
+    show_main_menu(client, user_id, u)
+
+def _cb_edit_brig(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Изменить отчет бригадира — заново с выбора даты."""
+    # Restart brigadier flow
+    # We need to know the date to restart correctly, or just go to date selection
+    # Let's go to date selection for simplicity
+    show_date_selection(client, user_id, prefix="brig:date")
+
+def _cb_adm_add_act(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Админ: добавить вид работ."""
+    if not is_admin(user_id):
+        client.send_message(to=user_id, text="❌ Нет прав")
+        return
+    buttons = [
+        Button(title="🚜 Техника", callback_data="adm:add:act:tech"),
+        Button(title="✋ Ручная", callback_data="adm:add:act:hand"),
+        BTN_BACK,
+    ]
+    client.send_message(to=user_id, text="Выберите *группу работы*:", buttons=buttons)
+
+def _cb_adm_del_act(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Админ: удалить вид работ (выбор группы)."""
+    if not is_admin(user_id):
+        client.send_message(to=user_id, text="❌ Нет прав")
+        return
+    client.send_message(to=user_id, text="Выберите *группу работы*:", buttons=_ACT_ADMIN_MENU)
+
+def _cb_adm_add_loc(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Админ: добавить локацию."""
+    if not is_admin(user_id):
+        client.send_message(to=user_id, text="❌ Нет прав")
+        return
+    existing = list_locations(GROUP_FIELDS)
+    text = (
+        "📋 *Существующие локации:*\n"
+        + "\n".join(f"{i}. {name}" for i, name in enumerate(existing, 1))
+        + "\n\n✏️ Введите название *новой локации*:"
+    )
+    set_state(user_id, "adm_wait_loc_add")
+    client.send_message(to=user_id, text=text)
+
+def _cb_adm_export(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Админ: экспорт отчетов в Google Sheets."""
+    if not is_admin(user_id):
+        client.send_message(to=user_id, text="❌ Нет прав")
+        return
+    
+    def _export_job():
+        try:
+            count, message = export_reports_to_sheets()
+            text = f"✅ {message}" if count > 0 else f"ℹ️ {message}"
             
-        state = get_state(user_id)
-        state["data"]["del_records"] = rows
-        set_state(user_id, "waiting_del_selection", state["data"])
+            # Экспорт бригадиров
+            brig_count, brig_msg = export_brigadier_reports()
+            if brig_count > 0:
+                text += f"\n✅ {brig_msg}"
+            elif "Ошибка" in brig_msg:
+                text += f"\n❌ {brig_msg}"
+            
+            created, sheet_msg = check_and_create_next_month_sheet()
+            if created:
+                text += f"\n\n📅 {sheet_msg}"
+        except Exception as e:
+            logging.error(f"Export error: {e}")
+            text = f"❌ Ошибка экспорта: {str(e)}"
         
-        lines = ["Выберите *запись* для удаления (отправьте номер):"]
-        for i, r in enumerate(rows, 1):
-            rid, wdate, act, loc, h, _ = r
-            lines.append(f"{i}. {wdate} | {act} ({loc}) — *{h}ч*")
-        lines.append("\n0. 🔙 Назад")
-        client.send_message(to=user_id, text="\n".join(lines))
-    
-    elif data == "menu:name":
-        set_state(user_id, "waiting_name")
-        client.send_message(to=user_id, text="✏️ Введите *Фамилию Имя* для изменения (например: *Иванов Иван*):")
+        client.send_message(to=user_id, text=text)
     
-    elif data == "tim:party":
-        if not is_tim(user_id):
-            client.send_message(to=user_id, text="❌ Нет прав")
-            return
-        # Start TIM flow: Date selection
-        show_date_selection(client, user_id, prefix="tim:date")
+    # Экспорт идет в фоне, результат придет отдельным сообщением.
+    # Уведомление отправляем до запуска задачи, иначе быстрый результат обгоняет его
+    client.send_message(to=user_id, text="⏳ Экспортирую отчеты в Google Sheets...")
+    run_in_background(_export_job)
+    
+    # Возврат в главное меню
+    u = get_user(user_id)
+    show_main_menu(client, user_id, u)
+
+# -----------------------------
+# Обработчики для бригадиров
+# -----------------------------
+def _cb_menu_brigadier(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Меню бригадира."""
+    # Показать меню выбора действия (кнопки, как на первом скрине)
+    # IT и админам тоже разрешаем вход для тестов/поддержки
+    if not (is_brigadier(user_id) or is_it(user_id) or is_admin(user_id)):
+        client.send_message(to=user_id, text="❌ У вас нет прав бригадира")
+        return
+    save_to_history(user_id, "menu:root")
+    buttons = [
+        Button(title="👷 ОБ (Отчет)", callback_data="brig:report"),
+        Button(title="🚜 ОТД", callback_data="brig:work"),
+        Button(title="⚙️ Настройки", callback_data="brig:settings"),
+    ]
+    client.send_message(to=user_id, text="👷 *Меню бригадира*\n\nВыберите действие: 🌻", buttons=buttons)
+
+def _cb_brig_report(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """ОБ (Отчет): выбор даты."""
+    # ОБ (Отчет) -> выбор даты
+    show_date_selection(client, user_id, prefix="brig:report:date")
+
+def _cb_brig_menu_zucchini(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Бригадир: выбор даты для кабачков."""
+    # Выбор даты для кабачков
+    show_date_selection(client, user_id, prefix="brig:date:zucchini")
+
+def _cb_brig_menu_potato(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Бригадир: выбор даты для картошки."""
+    # Выбор даты для картошки
+    show_date_selection(client, user_id, prefix="brig:date:potato")
+
+def _cb_brig_stats(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Меню статистики бригадира."""
+    show_brigadier_stats_menu(client, user_id)
+
+def _cb_brig_stats_today(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Статистика бригадира за сегодня."""
+    text = get_brigadier_stats(user_id, 'today')
+    client.send_message(to=user_id, text=text)
+    show_brigadier_stats_menu(client, user_id)
+
+def _cb_reminder_cancel(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Напоминание: сегодня выходной."""
+    today_str = today_iso()
+    set_reminder_status(user_id, today_str, "disabled")
+    client.send_message(to=user_id, text="🔕 Уведомления на сегодня отключены.")
+    u = get_user(user_id)
+    clear_state(user_id)
+    show_main_menu(client, user_id, u)
+
+def _cb_reminder_done(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Напоминание: отчет уже заполнен."""
+    today_str = today_iso()
+    set_reminder_status(user_id, today_str, "disabled")
+    client.send_message(to=user_id, text="✅ Спасибо, отмечено. Уведомления на сегодня отключены.")
+    u = get_user(user_id)
+    clear_state(user_id)
+    show_main_menu(client, user_id, u)
+
+def _cb_brig_stats_week(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Статистика бригадира за неделю."""
+    text = get_brigadier_stats(user_id, 'week')
+    client.send_message(to=user_id, text=text)
+    show_brigadier_stats_menu(client, user_id)
+
+def _cb_brig_zucchini(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Бригадир: отчет по кабачкам."""
+    # Получаем выбранную дату из состояния
+    state = S()
+    selected_date = state["data"].get("date", today_iso())
+    
+    # Сохраняем текущее состояние в историю перед переходом
+    save_to_history(user_id, "brig:date:" + selected_date)
+    # Начать форму для кабачков
+    set_state(user_id, "brig_zucchini_rows", {"work_type": "Кабачок", "date": selected_date}, push_history=False)
+    buttons = BACK_BUTTONS
+    client.send_message(to=user_id, text="🥒 *Кабачок*\n\nВведите *количество рядов*:", buttons=buttons)
+
+def _cb_brig_potato(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Бригадир: отчет по картошке."""
+    # Получаем выбранную дату из состояния
+    state = S()
+    selected_date = state["data"].get("date", today_iso())
+    
+    # Сохраняем текущее состояние в историю перед переходом
+    save_to_history(user_id, "brig:date:" + selected_date)
+    # Начать форму для картошки
+    set_state(user_id, "brig_potato_rows", {"work_type": "Картошка", "date": selected_date}, push_history=False)
+    buttons = BACK_BUTTONS
+    client.send_message(to=user_id, text="🥔 *Картошка*\n\nВведите *количество выкопанных рядов*:", buttons=buttons)
+
+# -----------------------------
+# Админ: Управление бригадирами
+# -----------------------------
+def _cb_adm_menu_brigadiers(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Админ: управление бригадирами."""
+    if not is_admin(user_id):
+        client.send_message(to=user_id, text="❌ Нет прав")
+        return
+    # Сохраняем текущее состояние в историю перед переходом
+    save_to_history(user_id, "menu:admin")
+    client.send_message(to=user_id, text="👷 *Управление бригадирами*:", buttons=_BRIG_ADMIN_MENU)
+
+def _cb_adm_add_brigadier(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Админ: добавить бригадира."""
+    if not is_admin(user_id):
+        client.send_message(to=user_id, text="❌ Нет прав")
+        return
+    set_state(user_id, "adm_wait_brigadier_add")
+    client.send_message(
+        to=user_id, 
+        text="➕ *Добавление бригадира*\n\nОтправьте *контакт* бригадира или введите *номер телефона* (например: 79001234567):"
+    )
 
+def _cb_adm_del_brigadier(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Админ: удалить бригадира."""
+    if not is_admin(user_id):
+        client.send_message(to=user_id, text="❌ Нет прав")
+        return
+    brigadiers = get_all_brigadiers()
+    if not brigadiers:
+        client.send_message(to=user_id, text="❌ Нет бригадиров для удаления.")
+        return
+    
+    state = S()
+    state["data"]["brigadiers_list"] = brigadiers
+    set_state(user_id, "adm_wait_brigadier_del", state["data"])
+    
+    text = (
+        "Выберите *бригадира* для удаления (отправьте номер):\n"
+        + "\n".join(f"{i}. {fname or uname} ({uid})" for i, (uid, uname, fname, *_) in enumerate(brigadiers, 1))
+        + "\n\n0. 🔙 Назад"
+    )
+    client.send_message(to=user_id, text=text)
+
+def _cb_adm_list_brigadiers(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Админ: список бригадиров."""
+    if not is_admin(user_id):
+        client.send_message(to=user_id, text="❌ Нет прав")
+        return
+    brigadiers = get_all_brigadiers()
+    if not brigadiers:
+        client.send_message(to=user_id, text="📋 *Список бригадиров*\n\nСписок пуст.")
+        return
+    
+    lines = ["📋 *Список бригадиров*:\n"]
+    for i, (uid, uname, fname, added_by, added_date) in enumerate(brigadiers, 1):
+        # Показываем Имя (или username) и ID — одна строка на запись
+        display_name = fname or uname or "Без имени"
+        lines.append(f"{i}. {display_name}\n   ID: `{uid}`\n")
+    text = "\n".join(lines)
+    client.send_message(to=user_id, text=text)
+
+def _cb_back_to_date(client: WhatsApp360Client, btn: CallbackObject, user_id: str, S: Callable[[], dict]):
+    """Возврат к выбору даты (IT)."""
+    # Возврат к выбору даты (для IT)
+    show_date_selection(client, user_id, prefix="it:date")
+
+# callback_data -> обработчик(client, btn, user_id, S); S() — состояние пользователя, читается лениво
+CALLBACK_HANDLERS: Dict[str, Callable[[WhatsApp360Client, CallbackObject, str, Callable[[], dict]], None]] = {
+    "back:prev": _cb_back_prev,
+    "work:tractor:machinery": _cb_work_tractor_machinery,
+    "work:tractor:activity": _cb_work_tractor_activity,
+    "work:tractor:field": _cb_work_tractor_field,
+    "work:tractor:crop": _cb_work_tractor_crop,
+    "work:choose:type": _cb_work_choose_type,
+    "work:manual:activity": _cb_work_manual_activity,
+    "work:manual:field": _cb_work_manual_field,
+    "work:manual:crop": _cb_work_manual_crop,
+    "it:star": _cb_it_star,
+    "menu:root": _cb_menu_root,
+    "menu:settings": _cb_menu_settings,
+    "brig:settings": _cb_brig_settings,
+    "menu:work": _cb_menu_work,
+    "brig:work": _cb_brig_work,
+    "menu:stats": _cb_menu_stats,
+    "stats:admin:terra": _cb_stats_admin_terra,
+    "stats:admin:brig": _cb_stats_admin_brig,
+    "menu:edit_list": _cb_menu_edit_list,
+    "menu:delete_list": _cb_menu_delete_list,
+    "menu:name": _cb_menu_name,
+    "tim:party": _cb_tim_party,
+    "tim:tmpl:yes": _cb_tim_tmpl_yes,
+    "tim:tmpl:no": _cb_tim_tmpl_no,
+    "tim:edit:hours": _cb_tim_edit_hours,
+    "tim:save:simple": _cb_tim_save_simple,
+    "tim:save:template": _cb_tim_save_template,
+    "menu:admin": _cb_menu_admin,
+    "adm:menu:activities": _cb_adm_menu_activities,
+    "adm:menu:locations": _cb_adm_menu_locations,
+    "stats:today": _cb_stats_today,
+    "stats:week": _cb_stats_week,
+    "cancel_activity": _cb_cancel_activity,
+    "cancel_location": _cb_cancel_location,
+    "work:grp:tech": _cb_work_grp_tech,
+    "confirm:it": _cb_confirm_it,
+    "edit:it": _cb_edit_it,
+    "confirm:worker": _cb_confirm_worker,
+    "edit:worker": _cb_edit_worker,
+    "confirm:brig": _cb_confirm_brig,
+    "edit:brig": _cb_edit_brig,
+    "adm:add:act": _cb_adm_add_act,
+    "adm:del:act": _cb_adm_del_act,
+    "adm:add:loc": _cb_adm_add_loc,
+    "adm:export": _cb_adm_export,
+    "menu:brigadier": _cb_menu_brigadier,
+    "brig:report": _cb_brig_report,
+    "brig:menu:zucchini": _cb_brig_menu_zucchini,
+    "brig:menu:potato": _cb_brig_menu_potato,
+    "brig:stats": _cb_brig_stats,
+    "brig:stats:today": _cb_brig_stats_today,
+    "reminder:cancel": _cb_reminder_cancel,
+    "reminder:done": _cb_reminder_done,
+    "brig:stats:week": _cb_brig_stats_week,
+    "brig:zucchini": _cb_brig_zucchini,
+    "brig:potato": _cb_brig_potato,
+    "adm:menu:brigadiers": _cb_adm_menu_brigadiers,
+    "adm:add:brigadier": _cb_adm_add_brigadier,
+    "adm:del:brigadier": _cb_adm_del_brigadier,
+    "adm:list:brigadiers": _cb_adm_list_brigadiers,
+    "back_to_date": _cb_back_to_date,
+}
+
+@wa.on_callback_button
+def handle_callback(client, btn: CallbackObject):
+    user_id = btn.from_user.wa_id
+    data = btn.data
+    
+    # Состояние читаем один раз за callback (лениво). set_state меняет тот же dict,
+    # а clear_state создает новый — тогда перечитываем.
+    _state_cache: Dict[str, dict] = {}
+    def S() -> dict:
+        st = _state_cache.get("s")
+        if st is None or user_states.get(user_id) is not st:
+            st = _state_cache["s"] = get_state(user_id)
+        return st
+
+    # Точные callback_data — одним поиском в словаре; префиксные разбираются ниже
+    handler = CALLBACK_HANDLERS.get(data)
+    if handler is not None:
+        handler(client, btn, user_id, S)
+        return
+
+    if data.startswith("it:date:"):
+        # IT flow: Date selected via list
+        selected_date = data[len("it:date:"):]
+        
+        # Calculate current IT hours for today
+        current_sum = sum_hours_for_user_date(user_id, selected_date, include_it=True)
+        
+        d_str = _iso_to_ddmmyyyy(selected_date)
+        text = (
+            f"📅 Дата: *{d_str}*\n"
+            f"📊 Уже внесено: *{current_sum}* ч\n\n"
+            f"Введите *количество часов*:"
+        )
+        
+        set_state(user_id, "it_waiting_hours", {"date": selected_date}, push_history=False)
+        quick_replies = [{"id": "back_to_date", "title": "🔙 Назад"}]
+        client.send_text_with_quick_replies(to=user_id, text=text, quick_replies=quick_replies)
+        return
+    
     elif data.startswith("tim:date:"):
         # TIM Date selected
-        selected_date = data.split(":")[2]
+        selected_date = data[len("tim:date:"):]
         
         # Check for saved template (last TIM report)
         # We can use the last report for this user with a specific flag or just last report in 'tim' group
@@ -1940,7 +2973,7 @@ def handle_callback(client, btn: CallbackObject):
         # But we need to support "Save and Confirm" template logic.
         # We can look for the last report in 'tim' group to suggest default values.
         
-        state = get_state(user_id)
+        state = S()
         
         # Check if user has a "template" (last report)
         last_report = None
@@ -1960,9 +2993,9 @@ def handle_callback(client, btn: CallbackObject):
             set_state(user_id, "tim_template_confirm", {
                 "date": selected_date,
                 "template": last_report
-            }, save_to_history=False)
+            }, push_history=False)
             
-            d_str = date.fromisoformat(selected_date).strftime("%d.%m.%Y")
+            d_str = _iso_to_ddmmyyyy(selected_date)
             text = (
                 f"🇨🇳 *Партия следить*\n"
                 f"📅 Дата: *{d_str}*\n\n"
@@ -1974,237 +3007,65 @@ def handle_callback(client, btn: CallbackObject):
             buttons = [
                 Button(title="✅ Да, использовать", callback_data="tim:tmpl:yes"),
                 Button(title="✏️ Нет, новые", callback_data="tim:tmpl:no"),
-                Button(title="🔙 Назад", callback_data="back:prev")
+                BTN_BACK
             ]
             client.send_message(to=user_id, text=text, buttons=buttons)
         else:
             # No template, start manual flow
-            set_state(user_id, "tim_wait_activity", {"date": selected_date}, save_to_history=False)
+            set_state(user_id, "tim_wait_activity", {"date": selected_date}, push_history=False)
             client.send_message(to=user_id, text="🇨🇳 Введите *вид работы*:\n\n0. 🔙 Назад")
 
-    elif data == "tim:tmpl:yes":
-        # Use template
-        state = get_state(user_id)
-        tmpl = state["data"].get("template")
-        work_date = state["data"].get("date")
-        
-        if not tmpl or not work_date:
-            client.send_message(to=user_id, text="❌ Ошибка шаблона. Начните заново.")
-            return
-            
-        # Go to hours confirmation (or skip if we trust the template hours completely? 
-        # The prompt says "simplified filling of date and hours", implying loc/act are auto-filled.
-        # So we should probably let them edit hours if they want, or just confirm.
-        # "simplified filling of date and hours" -> maybe we just ask hours?
-        # Let's confirm hours.
-        
-        state["data"]["tim_report"] = {
-            "activity": tmpl["activity"],
-            "location": tmpl["location"],
-            "date": work_date
-        }
-        # Pre-fill hours from template but allow change? 
-        # Or just go to confirmation. Let's go to confirmation with template hours.
-        state["data"]["tim_report"]["hours"] = tmpl["hours"]
-        
-        set_state(user_id, "tim_confirm", state["data"], save_to_history=False)
-        
-        d_str = date.fromisoformat(work_date).strftime("%d.%m.%Y")
+    elif data.startswith("work:date:"):
+        # Дата выбрана (через callback, если бы мы использовали кнопки, но мы используем текстовый ввод)
+        # Но оставим этот handler на случай, если мы решим использовать кнопки в будущем
+        # или если вызов идет из другого места.
+        selected_date = data[len("work:date:"):]
+        # Сохраняем текущее состояние в историю перед переходом
+        save_to_history(user_id, "menu:work")
+        current_sum = sum_hours_for_user_date(user_id, selected_date)
+        d_str = _iso_to_ddmmyyyy(selected_date)
         text = (
-            f"🇨🇳 *Подтверждение*\n\n"
             f"📅 Дата: *{d_str}*\n"
-            f"Работа: *{tmpl['activity']}*\n"
-            f"Место: *{tmpl['location']}*\n"
-            f"Часы: *{tmpl['hours']}*\n\n"
-            f"Все верно?"
+            f"📊 Уже внесено: *{current_sum}* ч\n\n"
+            f"Введите *количество часов*:\n\n0. 🔙 Назад"
         )
-        buttons = [
-            Button(title="✅ Подтвердить", callback_data="tim:save:simple"),
-            Button(title="✏️ Изменить часы", callback_data="tim:edit:hours"), # Option to edit hours
-            Button(title="🔄 Заново", callback_data="tim:party")
-        ]
-        client.send_message(to=user_id, text=text, buttons=buttons)
-
-    elif data == "tim:tmpl:no":
-        # Manual flow
-        state = get_state(user_id)
-        work_date = state["data"].get("date")
-        set_state(user_id, "tim_wait_activity", {"date": work_date}, save_to_history=False)
-        client.send_message(to=user_id, text="🇨🇳 Введите *вид работы*:\n\n0. 🔙 Назад")
-
-    elif data == "tim:edit:hours":
-        state = get_state(user_id)
-        set_state(user_id, "tim_wait_hours", state["data"], save_to_history=False)
-        client.send_message(to=user_id, text="🕒 Введите *количество часов*:\n\n0. 🔙 Назад")
-
-    elif data == "tim:save:simple":
-        # Save from template/confirmed state
-        _save_tim_report(client, user_id)
-
-    elif data == "tim:save:template":
-        # Save manual entry AND allow future templating (implicit by saving to DB)
-        _save_tim_report(client, user_id)
+        set_state(user_id, "waiting_hours_prefill", {"date": selected_date, "work": {"date": selected_date}}, push_history=False)
+        client.send_message(to=user_id, text=text)
 
-    elif data == "menu:admin":
-        if not is_admin(user_id):
-            client.send_message(to=user_id, text="❌ Нет прав")
-            return
-        
-        # Сохраняем текущее состояние в историю перед переходом
-        save_to_history(user_id, "menu:more")
-        buttons = [
-            Button(title="➕➖ Работы", callback_data="adm:menu:activities"),
-            Button(title="➕➖ Локации", callback_data="adm:menu:locations"),
-            Button(title="📤 Экспорт", callback_data="adm:export"),
-        ]
-        # Добавляем кнопку управления бригадирами
-        buttons.append(Button(title="👷 Бригадиры", callback_data="adm:menu:brigadiers"))
-        client.send_message(to=user_id, text="⚙️ *Админ-панель*:", buttons=buttons[:3])
-    
-    elif data == "adm:menu:activities":
-        if not is_admin(user_id):
-            client.send_message(to=user_id, text="❌ Нет прав")
-            return
-        # Сохраняем текущее состояние в историю перед переходом
-        save_to_history(user_id, "menu:admin")
-        buttons = [
-            Button(title="➕ Добавить работу", callback_data="adm:add:act"),
-            Button(title="➖ Удалить работу", callback_data="adm:del:act"),
-            Button(title="🔙 Назад", callback_data="back:prev"),
-        ]
-        client.send_message(to=user_id, text="⚙️ *Управление работами*:", buttons=buttons)
-    
-    elif data == "adm:menu:locations":
-        if not is_admin(user_id):
-            client.send_message(to=user_id, text="❌ Нет прав")
-            return
-        # Сохраняем текущее состояние в историю перед переходом
-        save_to_history(user_id, "menu:admin")
-        buttons = [
-            Button(title="➕ Добавить локацию", callback_data="adm:add:loc"),
-            Button(title="➖ Удалить локацию", callback_data="adm:del:loc"),
-            Button(title="🔙 Назад", callback_data="back:prev"),
-        ]
-        client.send_message(to=user_id, text="⚙️ *Управление локациями*:", buttons=buttons)
-    
-    elif data == "stats:today":
-        cmd_today(client, btn)
-    
-    elif data == "stats:week":
-        cmd_my(client, btn)
-    
-
-    
-    elif data == "cancel_activity":
-        # Cancel activity selection, return to work type selection
-        buttons = [
-            Button(title="🚜 Трактор", callback_data="work:type:tractor"),
-            Button(title="🚛 КамАЗ", callback_data="work:type:kamaz"),
-            Button(title="✋ Ручная", callback_data="work:type:manual"),
-        ]
-        client.send_message(to=user_id, text="Выберите *тип работы*:", buttons=buttons)
-        # Don't clear state, just go back to work_pick_type? 
-        # Actually we need to reset state to work_pick_type to be clean
-        # state = get_state(user_id)
-        # date = state["data"].get("date")
-        # set_state(user_id, "work_pick_type", {"date": date})
-        return
-    
-    elif data == "cancel_location":
-        # Cancel location selection, return back using history
-        if go_back(client, user_id):
-            return
-        else:
-            # Fallback: return to location group selection
-            state = get_state(user_id)
-            work_data = state["data"].get("work", {})
-            activity_name = work_data.get("activity", "работа")
-            
-            buttons = [
-                Button(title="Поля", callback_data="work:locgrp:fields"),
-                Button(title="Склад", callback_data="work:locgrp:ware"),
-                Button(title="🔙 Назад", callback_data="back:prev"),
-            ]
-            client.send_message(to=user_id, text=f"✅ Выбрано: *{activity_name}*\n\nТеперь выберите *локацию*:", buttons=buttons)
-        return
-    
-    elif data.startswith("work:date:"):
-        # Дата выбрана (через callback, если бы мы использовали кнопки, но мы используем текстовый ввод)
-        # Но оставим этот handler на случай, если мы решим использовать кнопки в будущем
-        # или если вызов идет из другого места.
-        selected_date = data.split(":")[2]
-        # Сохраняем текущее состояние в историю перед переходом
-        save_to_history(user_id, "menu:work")
-        current_sum = sum_hours_for_user_date(user_id, selected_date)
-        d_str = date.fromisoformat(selected_date).strftime("%d.%m.%Y")
-        text = (
-            f"📅 Дата: *{d_str}*\n"
-            f"📊 Уже внесено: *{current_sum}* ч\n\n"
-            f"Введите *количество часов*:\n\n0. 🔙 Назад"
-        )
-        set_state(user_id, "waiting_hours_prefill", {"date": selected_date, "work": {"date": selected_date}}, save_to_history=False)
-        client.send_message(to=user_id, text=text)
-
-    elif data == "work:grp:tech":
-        # Intermediate step: Technique -> Tractor/KamAZ choice
-        state = get_state(user_id)
-        data_payload = state.get("data", {}) if state else {}
-        work_date = data_payload.get("date", date.today().isoformat())
-        # Сохраняем префил часов, если он уже введен
-        prefilled_hours = data_payload.get("prefilled_hours")
-        work_data = data_payload.get("work", {}) or {}
-        work_data["date"] = work_date
-        new_data = {
-            "date": work_date,
-            "work": work_data,
-            "prefilled_hours": prefilled_hours,
-        }
-        
-        # Save current state so Back works (returns to date selection/menu:work)
-        set_state(user_id, "work_pick_type", new_data, back_callback="menu:work")
-        
-        buttons = [
-            Button(title="🚜 Трактор", callback_data="work:type:tractor"),
-            Button(title="🚛 КамАЗ", callback_data="work:type:kamaz"),
-            Button(title="🔙 Назад", callback_data="back:prev"),
-        ]
-        d_str = date.fromisoformat(work_date).strftime("%d.%m.%Y")
-        client.send_message(to=user_id, text=f"📅 Дата: *{d_str}*\n\nВыберите *технику*:", buttons=buttons)
-    
-    elif data.startswith("work:type:"):
-        wtype = data.split(":")[2]
-        state = get_state(user_id)
-        # Preserve date for all work types (tractor / kamaz / manual)
-        work_date = state["data"].get("date") or date.today().isoformat()
-        work_data = state.get("data", {}).get("work", {})
-        work_data["date"] = work_date
-        state["data"]["work"] = work_data
-        state["data"]["work_type"] = wtype
+    elif data.startswith("work:type:"):
+        wtype = data[len("work:type:"):]
+        state = S()
+        # Preserve date for all work types (tractor / kamaz / manual)
+        work_date = state["data"].get("date") or today_iso()
+        work_data = state.get("data", {}).get("work", {})
+        work_data["date"] = work_date
+        state["data"]["work"] = work_data
+        state["data"]["work_type"] = wtype
         
         if wtype == "tractor":
             # Трактор: выбор техники
-            set_state(user_id, "work_tractor_machinery", state["data"], save_to_history=True, back_callback="work:choose:type")
+            set_state(user_id, "work_tractor_machinery", state["data"], push_history=True, back_callback="work:choose:type")
             
             lines = ["Выберите *трактор* (отправьте номер):"]
             for i, m in enumerate(TRACTORS, 1):
                 lines.append(f"{i}. {m}")
             
-            client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
+            client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
             
         elif wtype == "kamaz":
             # КамАЗ: выбор культуры
-            set_state(user_id, "work_kamaz_crop", state["data"], save_to_history=False)
+            set_state(user_id, "work_kamaz_crop", state["data"], push_history=False)
             
             lines = ["Выберите *культуру* (отправьте номер):"]
             for i, c in enumerate(CROPS_KAMAZ, 1):
                 lines.append(f"{i}. {c}")
                 
-            client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
+            client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
             
         elif wtype == "manual":
             # Ручная: выбор вида работы
             # Сохраняем шаг для корректной работы кнопки Назад
-            set_state(user_id, "work_manual_activity", state["data"], save_to_history=True, back_callback="work:choose:type")
+            set_state(user_id, "work_manual_activity", state["data"], push_history=True, back_callback="work:choose:type")
             
             lines = ["Выберите *вид работы* (отправьте номер):"]
             for i, a in enumerate(ACTIVITIES_MANUAL, 1):
@@ -2213,18 +3074,18 @@ def handle_callback(client, btn: CallbackObject):
             client.send_message(
                 to=user_id,
                 text="\n".join(lines),
-                buttons=[Button(title="🔙 Назад", callback_data="back:prev")]
+                buttons=BACK_BUTTONS
             )
 
     elif data.startswith("brig:shift:"):
-        shift_code = data.split(":")[2]
+        shift_code = data[len("brig:shift:"):]
         shift_name = "Утренняя" if shift_code == "morning" else "Вечерняя"
         
-        state = get_state(user_id)
+        state = S()
         state["data"]["shift"] = shift_name
         
         # Next: Crop selection (Кабачок, Картошка, прочее)
-        set_state(user_id, "brig_crop", state["data"], save_to_history=False)
+        set_state(user_id, "brig_crop", state["data"], push_history=False)
         
         # Build list from CROPS but prioritizing Zucchini/Potato if they are in there, or custom list
         # Prompt says: "Кабачок, Картошка, прочее (списком)"
@@ -2235,12 +3096,12 @@ def handle_callback(client, btn: CallbackObject):
         for i, c in enumerate(BRIG_CROPS, 1):
             lines.append(f"{i}. {c}")
             
-        client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
+        client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
     
     elif data.startswith("work:locgrp:"):
-        lg = data.split(":")[2]
+        lg = data[len("work:locgrp:"):]
         grp = GROUP_FIELDS if lg == "fields" else GROUP_WARE
-        state = get_state(user_id)
+        state = S()
         work_data = state["data"].get("work", {})
         work_data["loc_grp"] = grp
         
@@ -2261,12 +3122,12 @@ def handle_callback(client, btn: CallbackObject):
             if prefilled:
                 _build_worker_confirmation(client, user_id, state, prefilled)
             else:
-                set_state(user_id, "waiting_hours", state["data"], save_to_history=False)
+                set_state(user_id, "waiting_hours", state["data"], push_history=False)
                 
                 # Calculate current hours for today
-                work_date = state["data"].get("work", {}).get("date", date.today().isoformat())
-                current_sum = sum_hours_for_user_date(user_id, work_date)
-                d_str = date.fromisoformat(work_date).strftime("%d.%m.%Y")
+                work_date = state["data"].get("work", {}).get("date", today_iso())
+                current_sum = cached_day_hours(user_id, work_date)
+                d_str = _iso_to_ddmmyyyy(work_date)
                 
                 text = (
                     f"📅 Дата: *{d_str}*\n"
@@ -2283,197 +3144,21 @@ def handle_callback(client, btn: CallbackObject):
             state["data"]["locs"] = locations
             state["data"]["locs_group"] = lg
             
-            set_state(user_id, "waiting_location_selection", state["data"], save_to_history=False)
+            set_state(user_id, "waiting_location_selection", state["data"], push_history=False)
             
             if not locations:
                 client.send_message(to=user_id, text="❌ Локаций нет.")
                 return
 
-            lines = ["Выберите *место* (отправьте номер или название):"]
-            for i, (lid, name) in enumerate(locations, 1):
-                lines.append(f"{i}. {name}")
-            
-            text = "\n".join(lines)
+            text = "Выберите *место* (отправьте номер или название):\n" + "\n".join(
+                f"{i}. {name}" for i, (_, name) in enumerate(locations, 1)
+            )
             quick_replies = [{"id": "cancel_location", "title": "🔙 Back"}]
             client.send_text_with_quick_replies(to=user_id, text=text, quick_replies=quick_replies)
     
-    elif data == "confirm:it":
-        if not is_it(user_id):
-            client.send_message(to=user_id, text="❌ Нет прав")
-            return
-        
-        state = get_state(user_id)
-        temp_report = state["data"].get("temp_report")
-        if not temp_report:
-            client.send_message(to=user_id, text="❌ Данные устарели. Начните заново.")
-            return
-
-        # Save IT report (не в общую группу)
-        u = get_user(user_id)
-        reg_name = u.get("full_name") if u else user_id
-        
-        report_id = insert_report(
-            user_id=user_id,
-            reg_name=reg_name,
-            location=temp_report.get("location"),
-            loc_grp=temp_report.get("loc_grp"),  # "it" - специальная группа
-            activity=temp_report.get("activity"),
-            act_grp=temp_report.get("act_grp"),  # "it" - специальная группа
-            work_date=temp_report.get("work_date"),
-            hours=temp_report.get("hours")
-        )
-        
-        d_str = date.fromisoformat(temp_report.get("work_date")).strftime("%d.%m.%y")
-
-        lines = [
-            f"1. Дата - {d_str}",
-            f"2. Часы - {temp_report.get('hours', '—')}",
-        ]
-
-        work_type = temp_report.get("work_type")
-        if work_type == "tractor":
-            lines.extend([
-                "3. Трактор",
-                f"4. {temp_report.get('machinery', '—')}",
-                f"5. Работа - {temp_report.get('activity_base', temp_report.get('activity', '—'))}",
-                f"6. Культура - {temp_report.get('crop', '—')}",
-                f"7. Место - {temp_report.get('location', '—')}",
-            ])
-        elif work_type == "kamaz":
-            lines.extend([
-                "3. КамАЗ",
-                f"4. Груз - {temp_report.get('crop', '—')}",
-                f"5. Рейсы - {temp_report.get('trips', '—')}",
-                f"6. Место - {temp_report.get('location', '—')}",
-            ])
-        else:
-            lines.extend([
-                "3. Ручная работа",
-                f"4. Работа - {temp_report.get('activity_base', temp_report.get('activity', '—'))}",
-                f"5. Культура - {temp_report.get('crop', '—')}",
-                f"6. Место - {temp_report.get('location', '—')}",
-            ])
-
-        lines.append(f"ID: #{report_id}")
-
-        text = "✅ *Отчет сохранен*\n\n" + "\n".join(lines)
-        
-        clear_state(user_id)
-        client.send_message(to=user_id, text=text)
-        show_main_menu(client, user_id, u)
-    
-    elif data == "edit:it":
-        if not is_it(user_id):
-            client.send_message(to=user_id, text="❌ Нет прав")
-            return
-        # Возвращаемся к вводу часов
-        set_state(user_id, "it_waiting_hours", {}, save_to_history=False)
-        client.send_message(to=user_id, text="Введите *количество часов*:\n\n0. 🔙 Назад")
-    
-    elif data == "confirm:worker":
-        state = get_state(user_id)
-        temp_report = state["data"].get("temp_report")
-        if not temp_report:
-            client.send_message(to=user_id, text="❌ Данные устарели. Начните заново.")
-            return
-
-        # Save report
-        u = get_user(user_id)
-        reg_name = u.get("full_name") if u else user_id
-        
-        report_id = insert_report(
-            user_id=user_id,
-            reg_name=reg_name,
-            location=temp_report.get("location"),
-            loc_grp=temp_report.get("loc_grp"),
-            activity=temp_report.get("activity"),
-            act_grp=temp_report.get("act_grp"),
-            work_date=temp_report.get("work_date"),
-            hours=temp_report.get("hours")
-        )
-        
-        d_str = date.fromisoformat(temp_report.get("work_date")).strftime("%d.%m.%Y")
-        
-        text = (
-            f"✅ *Отчет сохранен*\n\n"
-            f"📅 Дата: *{d_str}*\n"
-            f"Работа: *{temp_report.get('activity')}*\n"
-            f"Место: *{temp_report.get('location')}*\n"
-            f"Часы: *{temp_report.get('hours')}*\n"
-            f"ID: `#{report_id}`"
-        )
-        
-        clear_state(user_id)
-        client.send_message(to=user_id, text=text)
-        
-        # Отправляем копию отчета на релейный номер
-        send_report_to_relay(original_from=user_id, original_text=text, user_name=reg_name, is_edit=False)
-        
-        show_main_menu(client, user_id, u)
-
-    elif data == "edit:worker":
-        # Restart flow
-        show_date_selection(client, user_id, prefix="work:date")
-
-    elif data == "confirm:brig":
-        state = get_state(user_id)
-        temp_report = state["data"].get("temp_report")
-        if not temp_report:
-            client.send_message(to=user_id, text="❌ Данные устарели. Начните заново.")
-            return
-            
-        # Save report
-        u = get_user(user_id)
-        username = u.get("full_name") if u else user_id
-        
-        report_id = save_brigadier_report(
-            user_id=user_id,
-            username=username,
-            work_type=temp_report["work_type"],
-            rows=temp_report["rows"],
-            field=temp_report["field"],
-            bags=temp_report.get("bags", 0),
-            workers=temp_report["workers"],
-            work_date=temp_report["work_date"]
-        )
-        
-        # Auto-export
-        if GOOGLE_SHEETS_AVAILABLE:
-            try:
-                export_brigadier_report_to_sheet(report_id)
-            except Exception as e:
-                logging.error(f"Auto-export error: {e}")
-        
-        d_str = date.fromisoformat(temp_report["work_date"]).strftime("%d.%m.%Y")
-        
-        text = (
-            f"✅ *Отчет сохранен*\n\n"
-            f"📅 Дата: *{d_str}*\n"
-            f"Тип: *{temp_report['work_type']}*\n"
-            f"Рядов: *{temp_report['rows']}*\n"
-            f"Поле: *{temp_report['field']}*\n"
-        )
-        if temp_report.get("bags"):
-             text += f"Сеток: *{temp_report['bags']}*\n"
-             
-        text += (
-            f"Людей: *{temp_report['workers']}*\n"
-            f"ID отчета: `#{report_id}`"
-        )
-        
-        clear_state(user_id)
-        client.send_message(to=user_id, text=text)
-        show_main_menu(client, user_id, u)
-
-    elif data == "edit:brig":
-        # Restart brigadier flow
-        # We need to know the date to restart correctly, or just go to date selection
-        # Let's go to date selection for simplicity
-        show_date_selection(client, user_id, prefix="brig:date")
-    
     elif data.startswith("edit:del:"):
         try:
-            rid = int(data.split(":")[2])
+            rid = int(data[len("edit:del:"):])
         except Exception:
             client.send_message(to=user_id, text="❌ Не удалось разобрать команду.")
             return
@@ -2487,493 +3172,156 @@ def handle_callback(client, btn: CallbackObject):
     
     elif data.startswith("edit:chg:"):
         try:
-            _, _, rid, work_d = data.split(":", 3)
-            rid = int(rid)
+            rid_s, sep, work_d = data[len("edit:chg:"):].partition(":")
+            if not sep:
+                raise ValueError(data)
+            rid = int(rid_s)
         except Exception:
             client.send_message(to=user_id, text="❌ Команда устарела или повреждена.")
             return
         
-        state = get_state(user_id)
+        state = S()
         state["data"]["edit_id"] = rid
         state["data"]["edit_date"] = work_d
         set_state(user_id, "waiting_edit_hours", state["data"])
         
         client.send_message(to=user_id, text=f"Введите *новое количество часов* для записи #{rid}:")
     
-    elif data == "adm:add:act":
-        if not is_admin(user_id):
-            client.send_message(to=user_id, text="❌ Нет прав")
-            return
-        buttons = [
-            Button(title="🚜 Техника", callback_data="adm:add:act:tech"),
-            Button(title="✋ Ручная", callback_data="adm:add:act:hand"),
-            Button(title="🔙 Назад", callback_data="back:prev"),
-        ]
-        client.send_message(to=user_id, text="Выберите *группу работы*:", buttons=buttons)
-
-    elif data == "adm:del:act":
-        if not is_admin(user_id):
-            client.send_message(to=user_id, text="❌ Нет прав")
-            return
-        buttons = [
-            Button(title="🚜 Техника", callback_data="adm:del:act:tech"),
-            Button(title="✋ Ручная", callback_data="adm:del:act:hand"),
-            Button(title="🔙 Назад", callback_data="back:prev"),
-        ]
-        client.send_message(to=user_id, text="Выберите *группу работы*:", buttons=buttons)
-
-    elif data == "adm:add:loc":
-        if not is_admin(user_id):
-            client.send_message(to=user_id, text="❌ Нет прав")
-            return
-        existing = list_locations(GROUP_FIELDS)
-        lines = ["📋 *Существующие локации:*"]
-        for i, name in enumerate(existing, 1):
-            lines.append(f"{i}. {name}")
-        lines.append("\n✏️ Введите название *новой локации*:")
-        text = "\n".join(lines)
-        set_state(user_id, "adm_wait_loc_add")
-        client.send_message(to=user_id, text=text)
-
-    elif data.startswith("adm:del:loc"):
-        if not is_admin(user_id):
-            client.send_message(to=user_id, text="❌ Нет прав")
-            return
-        
-        # Parse page number
-        page = 0
-        if ":PAGE:" in data:
-            try:
-                page = int(data.split(":PAGE:")[1])
-            except:
-                page = 0
-                
-        locations = list_locations_with_id(GROUP_FIELDS)
-        if not locations:
-            client.send_message(to=user_id, text="❌ Нет локаций для удаления.")
-            return
-        
-        # Pagination logic
-        PAGE_SIZE = 8
-        total_items = len(locations)
-        total_pages = (total_items + PAGE_SIZE - 1) // PAGE_SIZE
-        
-        if page >= total_pages: page = total_pages - 1
-        if page < 0: page = 0
-        
-        start_idx = page * PAGE_SIZE
-        end_idx = start_idx + PAGE_SIZE
-        current_page_items = locations[start_idx:end_idx]
-        
-        rows = []
-        for lid, name in current_page_items:
-            rows.append({
-                "id": f"adm:del:loc:CONFIRM:{lid}",
-                "title": name,
-                "description": ""
-            })
-            
-        # Add navigation buttons
-        if page > 0:
-            rows.append({
-                "id": f"adm:del:loc:PAGE:{page-1}",
-                "title": "⬅️ Назад",
-                "description": ""
-            })
-        if page < total_pages - 1:
-            rows.append({
-                "id": f"adm:del:loc:PAGE:{page+1}",
-                "title": "Вперед ➡️",
-                "description": ""
-            })
-            
-        sections = [{"title": f"Локации (Стр. {page+1}/{total_pages})", "rows": rows}]
-        
-        client.send_list_message(
-            to=user_id,
-            header_text="🗑 Удаление локации",
-            body_text="Выберите локацию для удаления:",
-            button_text="Выбрать локацию",
-            sections=sections
-        )
-
     elif data.startswith("adm:add:act:"):
         if not is_admin(user_id):
             client.send_message(to=user_id, text="❌ Нет прав")
             return
-        kind = data.split(":")[3]
+        kind = data[len("adm:add:act:"):]
         grp = GROUP_TECH if kind == "tech" else GROUP_HAND
         grp_label = "Техника" if kind == "tech" else "Ручная"
         
         existing = list_activities(grp)
-        lines = [f"📋 *Существующие работы ({grp_label}):*"]
-        for i, name in enumerate(existing, 1):
-            lines.append(f"{i}. {name}")
-        lines.append("\n✏️ Введите название *новой работы*:")
-        text = "\n".join(lines)
+        text = (
+            f"📋 *Существующие работы ({grp_label}):*\n"
+            + "\n".join(f"{i}. {name}" for i, name in enumerate(existing, 1))
+            + "\n\n✏️ Введите название *новой работы*:"
+        )
         
-        state = get_state(user_id)
+        state = S()
         state["data"]["act_grp"] = grp
         set_state(user_id, "adm_wait_act_add", state["data"])
         client.send_message(to=user_id, text=text)
-    
-    elif data.startswith("adm:del:act:"):
+
+    elif (m := ADM_DEL_CALLBACK_RE.fullmatch(data)):
+        # Удаление локаций/работ: adm:del:{loc|act}:CONFIRM:<id>, adm:del:loc[:PAGE:<n>], adm:del:act:<kind>[:PAGE:<n>]
         if not is_admin(user_id):
             client.send_message(to=user_id, text="❌ Нет прав")
             return
+        confirm_kind, item_id, loc_page, act_kind, act_page = m.groups()
         
-        # Parse kind and page
-        parts = data.split(":")
-        # Format: adm:del:act:<kind> or adm:del:act:<kind>:PAGE:<page>
-        kind = parts[3]
-        
-        page = 0
-        if "PAGE" in parts:
+        if confirm_kind == "loc":
             try:
-                page = int(parts[parts.index("PAGE") + 1])
-            except:
-                page = 0
-                
-        grp = GROUP_TECH if kind == "tech" else GROUP_HAND
-        grp_label = "Техника" if kind == "tech" else "Ручная"
-        
-        activities = list_activities_with_id(grp)
-        if not activities:
-            client.send_message(to=user_id, text=f"❌ Нет работ в группе '{grp_label}' для удаления.")
-            return
-        
-        # Pagination logic
-        PAGE_SIZE = 8
-        total_items = len(activities)
-        total_pages = (total_items + PAGE_SIZE - 1) // PAGE_SIZE
-        
-        if page >= total_pages: page = total_pages - 1
-        if page < 0: page = 0
+                result_text = "✅ Локация удалена." if remove_location_by_id(int(item_id)) else "❌ Ошибка удаления."
+            except Exception as e:
+                logging.error(f"Error deleting location: {e}")
+                result_text = "❌ Ошибка."
+            
+            # Результат и меню — одним сообщением
+            client.send_message(to=user_id, text=f"{result_text}\n\n⚙️ *Управление локациями*:", buttons=_LOC_ADMIN_MENU)
         
-        start_idx = page * PAGE_SIZE
-        end_idx = start_idx + PAGE_SIZE
-        current_page_items = activities[start_idx:end_idx]
+        elif confirm_kind == "act":
+            try:
+                result_text = "✅ Работа удалена." if remove_activity_by_id(int(item_id)) else "❌ Ошибка удаления."
+            except Exception as e:
+                logging.error(f"Error deleting activity: {e}")
+                result_text = "❌ Ошибка."
+            
+            # Результат и меню — одним сообщением
+            client.send_message(to=user_id, text=f"{result_text}\n\nВыберите *группу работы*:", buttons=_ACT_ADMIN_MENU)
         
-        rows = []
-        for aid, name in current_page_items:
-            rows.append({
-                "id": f"adm:del:act:CONFIRM:{aid}",
-                "title": name,
-                "description": ""
-            })
+        elif act_kind:
+            page = int(act_page or 0)
+            grp = GROUP_TECH if act_kind == "tech" else GROUP_HAND
+            grp_label = "Техника" if act_kind == "tech" else "Ручная"
             
-        # Add navigation buttons
-        if page > 0:
-            rows.append({
-                "id": f"adm:del:act:{kind}:PAGE:{page-1}",
-                "title": "⬅️ Назад",
-                "description": ""
-            })
-        if page < total_pages - 1:
-            rows.append({
-                "id": f"adm:del:act:{kind}:PAGE:{page+1}",
-                "title": "Вперед ➡️",
-                "description": ""
-            })
+            activities = list_activities_with_id(grp)
+            if not activities:
+                client.send_message(to=user_id, text=f"❌ Нет работ в группе '{grp_label}' для удаления.")
+                return
             
-        sections = [{"title": f"{grp_label} (Стр. {page+1}/{total_pages})", "rows": rows}]
-        
-        client.send_list_message(
-            to=user_id,
-            header_text="🗑 Удаление работы",
-            body_text=f"Выберите работу ({grp_label}) для удаления:",
-            button_text="Выбрать работу",
-            sections=sections
-        )
-    
-
-
-    elif data.startswith("adm:del:loc:CONFIRM:"):
-        if not is_admin(user_id): return
-        try:
-            lid = int(data.split(":")[4])
-            if remove_location_by_id(lid):
-                client.send_message(to=user_id, text="✅ Локация удалена.")
-            else:
-                client.send_message(to=user_id, text="❌ Ошибка удаления.")
-        except Exception as e:
-            logging.error(f"Error deleting location: {e}")
-            client.send_message(to=user_id, text="❌ Ошибка.")
-        
-        # Return to menu
-        buttons = [
-            Button(title="➕ Добавить", callback_data="adm:add:loc"),
-            Button(title="➖ Удалить", callback_data="adm:del:loc"),
-            Button(title="🔙 Назад", callback_data="back:prev"),
-        ]
-        client.send_message(to=user_id, text="⚙️ *Управление локациями*:", buttons=buttons)
-
-    elif data.startswith("adm:del:act:CONFIRM:"):
-        if not is_admin(user_id): return
-        try:
-            aid = int(data.split(":")[4])
-            if remove_activity_by_id(aid):
-                client.send_message(to=user_id, text="✅ Работа удалена.")
-            else:
-                client.send_message(to=user_id, text="❌ Ошибка удаления.")
-        except Exception as e:
-            logging.error(f"Error deleting activity: {e}")
-            client.send_message(to=user_id, text="❌ Ошибка.")
+            rows, page, total_pages = build_paginated_rows(
+                activities, page, 8, "adm:del:act:CONFIRM:", f"adm:del:act:{act_kind}:PAGE:"
+            )
+            sections = [{"title": f"{grp_label} (Стр. {page+1}/{total_pages})", "rows": rows}]
             
-        # Return to menu
-        buttons = [
-            Button(title="➕ Добавить", callback_data="adm:add:act"),
-            Button(title="➖ Удалить", callback_data="adm:del:act"),
-            Button(title="🔙 Назад", callback_data="back:prev"),
-        ]
-        client.send_message(to=user_id, text="⚙️ *Управление работами*:", buttons=buttons)
-    
-    elif data == "adm:export":
-        if not is_admin(user_id):
-            client.send_message(to=user_id, text="❌ Нет прав")
-            return
+            client.send_list_message(
+                to=user_id,
+                header_text="🗑 Удаление работы",
+                body_text=f"Выберите работу ({grp_label}) для удаления:",
+                button_text="Выбрать работу",
+                sections=sections
+            )
         
-        # client.send_message(to=user_id, text="⏳ Экспортирую отчеты в Google Sheets...")
-        try:
-            count, message = export_reports_to_sheets()
-            text = f"✅ {message}" if count > 0 else f"ℹ️ {message}"
+        else:
+            page = int(loc_page or 0)
+            locations = list_locations_with_id(GROUP_FIELDS)
+            if not locations:
+                client.send_message(to=user_id, text="❌ Нет локаций для удаления.")
+                return
             
-            # Экспорт бригадиров
-            brig_count, brig_msg = export_brigadier_reports()
-            if brig_count > 0:
-                text += f"\n✅ {brig_msg}"
-            elif "Ошибка" in brig_msg:
-                text += f"\n❌ {brig_msg}"
+            rows, page, total_pages = build_paginated_rows(
+                locations, page, 8, "adm:del:loc:CONFIRM:", "adm:del:loc:PAGE:"
+            )
+            sections = [{"title": f"Локации (Стр. {page+1}/{total_pages})", "rows": rows}]
             
-            created, sheet_msg = check_and_create_next_month_sheet()
-            if created:
-                text += f"\n\n📅 {sheet_msg}"
-        except Exception as e:
-            logging.error(f"Export error: {e}")
-            text = f"❌ Ошибка экспорта: {str(e)}"
-        
-        client.send_message(to=user_id, text=text)
-        
-        # Возврат в главное меню
-        u = get_user(user_id)
-        show_main_menu(client, user_id, u)
-    
-    # -----------------------------
-    # Обработчики для бригадиров
-    # -----------------------------
+            client.send_list_message(
+                to=user_id,
+                header_text="🗑 Удаление локации",
+                body_text="Выберите локацию для удаления:",
+                button_text="Выбрать локацию",
+                sections=sections
+            )
     
-    elif data == "menu:brigadier":
-        # Показать меню выбора действия (кнопки, как на первом скрине)
-        # IT и админам тоже разрешаем вход для тестов/поддержки
-        if not (is_brigadier(user_id) or is_it(user_id) or is_admin(user_id)):
-            client.send_message(to=user_id, text="❌ У вас нет прав бригадира")
-            return
-        save_to_history(user_id, "menu:root")
-        buttons = [
-            Button(title="👷 ОБ (Отчет)", callback_data="brig:report"),
-            Button(title="🚜 ОТД", callback_data="brig:work"),
-            Button(title="⚙️ Настройки", callback_data="brig:settings"),
-        ]
-        client.send_message(to=user_id, text="👷 *Меню бригадира*\n\nВыберите действие: 🌻", buttons=buttons)
-
-    elif data == "brig:report":
-        # ОБ (Отчет) -> выбор даты
-        show_date_selection(client, user_id, prefix="brig:report:date")
-
     elif data.startswith("brig:report:date:"):
         # После выбора даты -> выбор культуры
-        selected_date = data.split(":")[3]
+        selected_date = data[len("brig:report:date:"):]
         buttons = [
             Button(title="🥒 Кабачок", callback_data=f"brig:report:type:zucchini:{selected_date}"),
             Button(title="🥔 Картошка", callback_data=f"brig:report:type:potato:{selected_date}"),
             Button(title="🔙 Назад", callback_data="brig:report"),
         ]
-        d_str = date.fromisoformat(selected_date).strftime("%d.%m.%Y")
+        d_str = _iso_to_ddmmyyyy(selected_date)
         client.send_message(to=user_id, text=f"📅 *{d_str}*\nВыберите культуру:", buttons=buttons)
 
     elif data.startswith("brig:report:type:zucchini:"):
-        selected_date = data.split(":")[4]
+        selected_date = data[len("brig:report:type:zucchini:"):]
         work_payload = {"work_type": "Кабачок", "date": selected_date, "brig_stage": "brig_zucchini_rows"}
-        set_state(user_id, "brig_zucchini_rows", work_payload, save_to_history=False)
+        set_state(user_id, "brig_zucchini_rows", work_payload, push_history=False)
         buttons = [Button(title="🔙 Назад", callback_data=f"brig:report:date:{selected_date}")]
         client.send_message(to=user_id, text=f"🥒 *Кабачок* ({selected_date})\n\nВведите *количество рядов*:", buttons=buttons)
 
     elif data.startswith("brig:report:type:potato:"):
-        selected_date = data.split(":")[4]
+        selected_date = data[len("brig:report:type:potato:"):]
         work_payload = {"work_type": "Картошка", "date": selected_date, "brig_stage": "brig_potato_rows"}
-        set_state(user_id, "brig_potato_rows", work_payload, save_to_history=False)
+        set_state(user_id, "brig_potato_rows", work_payload, push_history=False)
         buttons = [Button(title="🔙 Назад", callback_data=f"brig:report:date:{selected_date}")]
         client.send_message(to=user_id, text=f"🥔 *Картошка* ({selected_date})\n\nВведите *количество выкопанных рядов*:", buttons=buttons)
 
-    elif data == "brig:menu:zucchini":
-        # Выбор даты для кабачков
-        show_date_selection(client, user_id, prefix="brig:date:zucchini")
-        
-    elif data == "brig:menu:potato":
-        # Выбор даты для картошки
-        show_date_selection(client, user_id, prefix="brig:date:potato")
-    
     elif data.startswith("brig:date:zucchini:"):
-        selected_date = data.split(":")[3]
+        selected_date = data[len("brig:date:zucchini:"):]
         # Start zucchini flow
-        set_state(user_id, "brig_zucchini_rows", {"work_type": "Кабачок", "date": selected_date}, save_to_history=False)
+        set_state(user_id, "brig_zucchini_rows", {"work_type": "Кабачок", "date": selected_date}, push_history=False)
         buttons = [Button(title="🔙 Назад", callback_data="menu:brigadier")] # Back to brig menu
         client.send_message(to=user_id, text=f"🥒 *Кабачок* ({selected_date})\n\nВведите *количество рядов*:", buttons=buttons)
 
     elif data.startswith("brig:date:potato:"):
-        selected_date = data.split(":")[3]
+        selected_date = data[len("brig:date:potato:"):]
         # Start potato flow
-        set_state(user_id, "brig_potato_rows", {"work_type": "Картошка", "date": selected_date}, save_to_history=False)
+        set_state(user_id, "brig_potato_rows", {"work_type": "Картошка", "date": selected_date}, push_history=False)
         buttons = [Button(title="🔙 Назад", callback_data="menu:brigadier")]
         client.send_message(to=user_id, text=f"🥔 *Картошка* ({selected_date})\n\nВведите *количество выкопанных рядов*:", buttons=buttons)
-    
-    elif data == "brig:stats":
-        show_brigadier_stats_menu(client, user_id)
-        
-    elif data == "brig:stats:today":
-        text = get_brigadier_stats(user_id, 'today')
-        client.send_message(to=user_id, text=text)
-        show_brigadier_stats_menu(client, user_id)
-        
-    elif data == "reminder:cancel":
-        today_str = date.today().isoformat()
-        set_reminder_status(user_id, today_str, "disabled")
-        client.send_message(to=user_id, text="🔕 Уведомления на сегодня отключены.")
-        u = get_user(user_id)
-        clear_state(user_id)
-        show_main_menu(client, user_id, u)
-    
-    elif data == "reminder:done":
-        today_str = date.today().isoformat()
-        set_reminder_status(user_id, today_str, "disabled")
-        client.send_message(to=user_id, text="✅ Спасибо, отмечено. Уведомления на сегодня отключены.")
-        u = get_user(user_id)
-        clear_state(user_id)
-        show_main_menu(client, user_id, u)
-
-    elif data == "brig:stats:week":
-        text = get_brigadier_stats(user_id, 'week')
-        client.send_message(to=user_id, text=text)
-        show_brigadier_stats_menu(client, user_id)
-
-    elif data == "brig:zucchini":
-        # Получаем выбранную дату из состояния
-        state = get_state(user_id)
-        selected_date = state["data"].get("date", date.today().isoformat())
-        
-        # Сохраняем текущее состояние в историю перед переходом
-        save_to_history(user_id, "brig:date:" + selected_date)
-        # Начать форму для кабачков
-        set_state(user_id, "brig_zucchini_rows", {"work_type": "Кабачок", "date": selected_date}, save_to_history=False)
-        buttons = [Button(title="🔙 Назад", callback_data="back:prev")]
-        client.send_message(to=user_id, text="🥒 *Кабачок*\n\nВведите *количество рядов*:", buttons=buttons)
-    
-    elif data == "brig:potato":
-        # Получаем выбранную дату из состояния
-        state = get_state(user_id)
-        selected_date = state["data"].get("date", date.today().isoformat())
-        
-        # Сохраняем текущее состояние в историю перед переходом
-        save_to_history(user_id, "brig:date:" + selected_date)
-        # Начать форму для картошки
-        set_state(user_id, "brig_potato_rows", {"work_type": "Картошка", "date": selected_date}, save_to_history=False)
-        buttons = [Button(title="🔙 Назад", callback_data="back:prev")]
-        client.send_message(to=user_id, text="🥔 *Картошка*\n\nВведите *количество выкопанных рядов*:", buttons=buttons)
-    
-    # -----------------------------
-    # Админ: Управление бригадирами
-    # -----------------------------
-    
-    elif data == "adm:menu:brigadiers":
-        if not is_admin(user_id):
-            client.send_message(to=user_id, text="❌ Нет прав")
-            return
-        # Сохраняем текущее состояние в историю перед переходом
-        save_to_history(user_id, "menu:admin")
-        buttons = [
-            Button(title="➕ Добавить бригадира", callback_data="adm:add:brigadier"),
-            Button(title="➖ Удалить бригадира", callback_data="adm:del:brigadier"),
-            Button(title="📋 Список бригадиров", callback_data="adm:list:brigadiers"),
-        ]
-        client.send_message(to=user_id, text="👷 *Управление бригадирами*:", buttons=buttons)
-    
-    elif data == "adm:add:brigadier":
-        if not is_admin(user_id):
-            client.send_message(to=user_id, text="❌ Нет прав")
-            return
-        set_state(user_id, "adm_wait_brigadier_add")
-        client.send_message(
-            to=user_id, 
-            text="➕ *Добавление бригадира*\n\nОтправьте *контакт* бригадира или введите *номер телефона* (например: 79001234567):"
-        )
-    
-    elif data == "adm:del:brigadier":
-        if not is_admin(user_id):
-            client.send_message(to=user_id, text="❌ Нет прав")
-            return
-        brigadiers = get_all_brigadiers()
-        if not brigadiers:
-            client.send_message(to=user_id, text="❌ Нет бригадиров для удаления.")
-            return
-        
-        state = get_state(user_id)
-        state["data"]["brigadiers_list"] = brigadiers
-        set_state(user_id, "adm_wait_brigadier_del", state["data"])
-        
-        lines = ["Выберите *бригадира* для удаления (отправьте номер):"]
-        for i, (uid, uname, fname, added_by, added_date) in enumerate(brigadiers, 1):
-            lines.append(f"{i}. {fname or uname} ({uid})")
-        lines.append("\n0. 🔙 Назад")
-        text = "\n".join(lines)
-        client.send_message(to=user_id, text=text)
-    
-    elif data == "adm:list:brigadiers":
-        if not is_admin(user_id):
-            client.send_message(to=user_id, text="❌ Нет прав")
-            return
-        brigadiers = get_all_brigadiers()
-        if not brigadiers:
-            client.send_message(to=user_id, text="📋 *Список бригадиров*\n\nСписок пуст.")
-            return
-        
-        lines = ["📋 *Список бригадиров*:\n"]
-        for i, (uid, uname, fname, added_by, added_date) in enumerate(brigadiers, 1):
-            # Показываем Имя (или username) и ID
-            display_name = fname or uname or "Без имени"
-            lines.append(f"{i}. {display_name}")
-            lines.append(f"   ID: `{uid}`\n")
-        text = "\n".join(lines)
-        client.send_message(to=user_id, text=text)
-
-    elif data == "back_to_date":
-        # Возврат к выбору даты (для IT)
-        show_date_selection(client, user_id, prefix="it:date")
 
  # -----------------------------
  # Хелперы для текстовых сообщений
  # -----------------------------
 
-def _build_worker_confirmation(client, user_id: str, state: dict, hours: int):
-    work_data = state["data"].get("work", {})
-    work_date = work_data.get("date", date.today().isoformat())
-    temp_report = {
-        "location": work_data.get("location"),
-        "loc_grp": work_data.get("loc_grp"),
-        "activity": work_data.get("activity"),
-        "act_grp": work_data.get("grp"),
-        "work_date": work_date,
-        "hours": hours,
-        "work_type": work_data.get("work_type"),
-        "machinery": work_data.get("machinery"),
-        "activity_base": work_data.get("activity_base") or work_data.get("activity"),
-        "crop": work_data.get("crop"),
-        "trips": work_data.get("trips"),
-    }
-
-    state["data"]["temp_report"] = temp_report
-    back_callback = "work:manual:crop" if work_data.get("work_type") == "manual" else None
-    set_state(user_id, "waiting_confirmation_worker", state["data"], save_to_history=True, back_callback=back_callback)
-
+def _report_summary_lines(temp_report: dict) -> List[str]:
+    """Нумерованные строки отчета (дата, часы, тип работы и детали)."""
     d_str = date.fromisoformat(temp_report["work_date"]).strftime("%d.%m.%y")
     lines = [
         f"1. Дата - {d_str}",
@@ -3003,7 +3351,78 @@ def _build_worker_confirmation(client, user_id: str, state: dict, hours: int):
             f"5. Культура - {temp_report.get('crop', '—')}",
             f"6. Место - {temp_report.get('location', '—')}",
         ])
+    return lines
+
+def _finalize_report(client, user_id: str, temp_report: Optional[dict], *, relay: bool):
+    """
+    Сохранить подтвержденный отчет (confirm:worker / confirm:it), показать итог и главное меню.
+    relay=True — обычный отчет: краткий итог + копия на релейный номер;
+    relay=False — IT отчет: подробный итог, без релея.
+    """
+    if not temp_report:
+        client.send_message(to=user_id, text="❌ Данные устарели. Начните заново.")
+        return
+
+    u = get_user(user_id)
+    reg_name = u.get("full_name") if u else user_id
+    
+    report_id = insert_report(
+        user_id=user_id,
+        reg_name=reg_name,
+        location=temp_report.get("location"),
+        loc_grp=temp_report.get("loc_grp"),
+        activity=temp_report.get("activity"),
+        act_grp=temp_report.get("act_grp"),
+        work_date=temp_report.get("work_date"),
+        hours=temp_report.get("hours")
+    )
+    
+    if relay:
+        d_str = _iso_to_ddmmyyyy(temp_report.get("work_date"))
+        text = (
+            f"✅ *Отчет сохранен*\n\n"
+            f"📅 Дата: *{d_str}*\n"
+            f"Работа: *{temp_report.get('activity')}*\n"
+            f"Место: *{temp_report.get('location')}*\n"
+            f"Часы: *{temp_report.get('hours')}*\n"
+            f"ID: `#{report_id}`"
+        )
+    else:
+        lines = _report_summary_lines(temp_report)
+        lines.append(f"ID: #{report_id}")
+        text = "✅ *Отчет сохранен*\n\n" + "\n".join(lines)
+    
+    clear_state(user_id)
+    client.send_message(to=user_id, text=text)
+    
+    if relay:
+        # Отправляем копию отчета на релейный номер (в фоне, меню показываем сразу)
+        send_report_to_relay(original_from=user_id, original_text=text, user_name=reg_name, is_edit=False)
+    
+    show_main_menu(client, user_id, u)
+
+def _build_worker_confirmation(client, user_id: str, state: dict, hours: int):
+    work_data = state["data"].get("work", {})
+    work_date = work_data.get("date", today_iso())
+    temp_report = {
+        "location": work_data.get("location"),
+        "loc_grp": work_data.get("loc_grp"),
+        "activity": work_data.get("activity"),
+        "act_grp": work_data.get("grp"),
+        "work_date": work_date,
+        "hours": hours,
+        "work_type": work_data.get("work_type"),
+        "machinery": work_data.get("machinery"),
+        "activity_base": work_data.get("activity_base") or work_data.get("activity"),
+        "crop": work_data.get("crop"),
+        "trips": work_data.get("trips"),
+    }
+
+    state["data"]["temp_report"] = temp_report
+    back_callback = "work:manual:crop" if work_data.get("work_type") == "manual" else None
+    set_state(user_id, "waiting_confirmation_worker", state["data"], push_history=True, back_callback=back_callback)
 
+    lines = _report_summary_lines(temp_report)
     text = "📋 *Проверьте данные*\n\n" + "\n".join(lines) + "\n\nВсе верно?"
     buttons = [
         Button(title="✅ Подтвердить", callback_data="confirm:worker"),
@@ -3012,2229 +3431,2259 @@ def _build_worker_confirmation(client, user_id: str, state: dict, hours: int):
     client.send_message(to=user_id, text=text, buttons=buttons)
 
 # -----------------------------
-# Обработка текстовых сообщений
+# Текстовые команды
 # -----------------------------
 
-@wa.on_message
-def handle_text(client: WhatsApp360Client, msg: MessageObject):
-    if not msg.from_user or not msg.from_user.wa_id:
-        return
+CMD_ADMIN = frozenset(("admin",))
+CMD_EXPO = frozenset(("expo",))
+CMD_RNAME = frozenset(("rname",))
+CMD_STS = frozenset(("sts",))
+CMD_BRIQ = frozenset(("briq", "/briq"))
+CMD_BRIG = frozenset(("бриг", "/бриг"))
+CMD_IT = frozenset(("it", "ит", "itmenu", "итменю", "checkit", "чекит"))
+CMD_RB1 = frozenset(("rb1",))
+CMD_TIM = frozenset(("tim", "тим"))
+CMD_STAR = frozenset(("⭐", "star", "звездочка", "звезда"))
+CMD_MENU = frozenset(("menu", "меню"))
+CMD_START = frozenset(("start", "старт"))
+CMD_TODAY = frozenset(("today", "сегодня"))
+CMD_MY = frozenset(("my", "мои"))
+CMD_X = frozenset(("x", "х", "ч", "{", "/x"))  # x (eng), х (rus), ч (typo), { (shift+x), /x
+
+BRIG_RESTORABLE_STATES = frozenset(("brig_zucchini_rows", "brig_potato_rows"))
+
+DEBUG_IT_TEMPLATE = (
+    "❌ *Ваш номер не найден в IT_IDS*\n\n"
+    "Ваш номер: `{uid}`\n"
+    "Нормализованный: `{norm_uid}`\n"
+    "Текущие IT_IDS: {it_ids}\n\n"
+    "Для добавления добавьте ваш номер в .env на сервере:\n"
+    "`IT_IDS={norm_uid}`\n\n"
+    "После этого перезапустите бота командой:\n"
+    "`systemctl restart terra-bot.service`"
+)
 
-    user_id = msg.from_user.wa_id
-    message_text = (msg.text or "").strip()
-    norm_text = message_text.lower()
-    logging.info(f"[TEXT] {user_id}: {message_text}")
+HOURS_LIMIT_TEMPLATE = (
+    "❌ *Превышен лимит часов!*\n\n"
+    "Можно добавить не более *{max_can_add}* ч.\n\n"
+    "Уже записано: *{existing}* ч из 24\n"
+)
 
-    # 1. Обработка команд
-    # Глобальный сброс
-    if message_text == "00":
-        clear_state(user_id)
+def _hours_limit_text(existing: int, hours: int, existing_reports: List[tuple], current_label: str) -> str:
+    """Сообщение о превышении лимита 24 ч: записи за день + текущая запись."""
+    detail = ""
+    if existing_reports:
+        detail = "\n\n*Существующие записи за этот день:*\n" + "\n".join(
+            f"• {act} ({loc}): *{h}* ч" for act, loc, h in existing_reports
+        )
+    return (
+        f"{HOURS_LIMIT_TEMPLATE.format(max_can_add=24 - existing, existing=existing)}{detail}\n\n\n"
+        f"Текущая запись:\n"
+        f"• {current_label}: *{hours}* ч\n\n"
+        f"Итого будет: *{existing + hours}* ч (максимум 24)"
+    )
+
+def _it_only(func: Callable) -> Callable:
+    """Команда только для IT: для остальных не срабатывает (текст идет дальше в FSM)."""
+    def wrapper(client: WhatsApp360Client, msg: MessageObject, user_id: str) -> bool:
+        if not is_it(user_id):
+            return False
+        return func(client, msg, user_id)
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+def _simple_cmd(func: Callable) -> Callable:
+    """Адаптер для cmd_*(client, msg) к сигнатуре текстовых команд."""
+    def wrapper(client: WhatsApp360Client, msg: MessageObject, user_id: str) -> bool:
+        func(client, msg)
+        return True
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+@_it_only
+def _cmd_admin(client: WhatsApp360Client, msg: MessageObject, user_id: str) -> bool:
+    """admin (IT): админское меню с функционалом работяги."""
+    # Сохраняем текущее состояние в историю перед переходом
+    save_to_history(user_id, "menu:more")
+    # Показываем админское меню, но с полным функционалом работяги
+    buttons = [
+        Button(title="🚜 ОТД", callback_data="menu:work"),
+        Button(title="📊 Статистика", callback_data="menu:stats"),
+        Button(title="⚙️ Админ", callback_data="menu:admin"),
+    ]
+    client.send_message(to=user_id, text="⚙️ *Админ-меню*\n\nВыберите действие:", buttons=buttons)
+    return True
+
+@_it_only
+def _cmd_expo(client: WhatsApp360Client, msg: MessageObject, user_id: str) -> bool:
+    """expo (IT): ручной запуск экспорта отчетов."""
+    # IT command to trigger export
+    client.send_message(to=user_id, text="⏳ Запуск экспорта отчетов...")
+    try:
+        count, message = export_reports_to_sheets()
+        text = f"✅ {message}" if count > 0 else f"ℹ️ {message}"
+        
+        # Экспорт бригадиров
+        brig_count, brig_msg = export_brigadier_reports()
+        if brig_count > 0:
+            text += f"\n✅ {brig_msg}"
+        elif "Ошибка" in brig_msg:
+            text += f"\n❌ {brig_msg}"
+        
+        created, sheet_msg = check_and_create_next_month_sheet()
+        if created:
+            text += f"\n\n📅 {sheet_msg}"
+    except Exception as e:
+        logging.error(f"Export error: {e}")
+        text = f"❌ Ошибка экспорта: {str(e)}"
+
+    client.send_message(to=user_id, text=text)
+    return True
+
+@_it_only
+def _cmd_rname(client: WhatsApp360Client, msg: MessageObject, user_id: str) -> bool:
+    """rname (IT): смена имени."""
+    set_state(user_id, "waiting_name", push_history=False)
+    client.send_message(to=user_id, text="Введите *Фамилию Имя* для изменения:")
+    return True
+
+@_it_only
+def _cmd_sts(client: WhatsApp360Client, msg: MessageObject, user_id: str) -> bool:
+    """sts (IT): админская статистика."""
+    # Для IT sts работает как админская статистика
+    save_to_history(user_id, "menu:more")
+    buttons = [
+        Button(title="🚜 Terra (Все)", callback_data="stats:admin:terra"),
+        Button(title="👷 Бригадиры (Все)", callback_data="stats:admin:brig"),
+        BTN_BACK,
+    ]
+    client.send_message(to=user_id, text="📊 *Статистика (IT/Admin)*\n\nВыберите категорию:", buttons=buttons)
+    return True
+
+def _cmd_briq(client: WhatsApp360Client, msg: MessageObject, user_id: str) -> bool:
+    """briq: открыть меню бригадира."""
+    save_to_history(user_id, "menu:more")
+    if not (is_brigadier(user_id) or is_it(user_id) or is_admin(user_id)):
+        client.send_message(to=user_id, text="❌ У вас нет прав для доступа к меню бригадира.")
+        return True
+    btn_obj = SimpleNamespace(from_user=msg.from_user, data='menu:brigadier')
+    handle_callback(client, btn_obj)
+    return True
+
+def _cmd_brig_admin(client: WhatsApp360Client, msg: MessageObject, user_id: str) -> bool:
+    """бриг: управление бригадирами (админ/IT)."""
+    save_to_history(user_id, "menu:more")
+    if not (is_admin(user_id) or is_it(user_id)):
+        client.send_message(to=user_id, text="❌ У вас нет прав для управления бригадирами.")
+        return True
+    btn_obj = SimpleNamespace(from_user=msg.from_user, data='adm:menu:brigadiers')
+    handle_callback(client, btn_obj)
+    return True
+
+def _cmd_it_check(client: WhatsApp360Client, msg: MessageObject, user_id: str) -> bool:
+    """Проверка IT роли и показ меню."""
+    # Нормализуем номер для сравнения
+    normalized_user_id = _normalize_phone(user_id)
+    is_it_user = is_it(user_id)
+    if logging.getLogger().isEnabledFor(logging.INFO):
+        logging.info(
+            "🔍 Проверка IT роли для %s (нормализован: %s): is_it=%s, IT_IDS=%s",
+            user_id, normalized_user_id, is_it_user, IT_IDS,
+        )
+
+    if is_it_user:
         u = get_user(user_id)
-        client.send_message(to=user_id, text="🔄 Сброс в главное меню")
+        clear_state(user_id)
         show_main_menu(client, user_id, u)
-        return
+        client.send_message(to=user_id, text="✅ IT меню активировано!")
+    else:
+        # Показываем отладочную информацию
+        debug_info = DEBUG_IT_TEMPLATE.format(
+            uid=user_id,
+            norm_uid=normalized_user_id,
+            it_ids=", ".join(IT_IDS) if IT_IDS else "не настроены",
+        )
+        client.send_message(to=user_id, text=debug_info)
+    return True
 
-    # Команды для IT роли
+def _cmd_rb1(client: WhatsApp360Client, msg: MessageObject, user_id: str) -> bool:
+    """rb1 (IT): показать меню обычного работяги."""
     if is_it(user_id):
-        if norm_text == "admin":
-            # Сохраняем текущее состояние в историю перед переходом
-            save_to_history(user_id, "menu:more")
-            # Показываем админское меню, но с полным функционалом работяги
-            buttons = [
-                Button(title="🚜 ОТД", callback_data="menu:work"),
-                Button(title="📊 Статистика", callback_data="menu:stats"),
-                Button(title="⚙️ Админ", callback_data="menu:admin"),
-            ]
-            client.send_message(to=user_id, text="⚙️ *Админ-меню*\n\nВыберите действие:", buttons=buttons)
-            return
-        elif norm_text == "expo":
-            # IT command to trigger export
-            client.send_message(to=user_id, text="⏳ Запуск экспорта отчетов...")
-            try:
-                count, message = export_reports_to_sheets()
-                text = f"✅ {message}" if count > 0 else f"ℹ️ {message}"
-                
-                # Экспорт бригадиров
-                brig_count, brig_msg = export_brigadier_reports()
-                if brig_count > 0:
-                    text += f"\n✅ {brig_msg}"
-                elif "Ошибка" in brig_msg:
-                    text += f"\n❌ {brig_msg}"
-                
-                created, sheet_msg = check_and_create_next_month_sheet()
-                if created:
-                    text += f"\n\n📅 {sheet_msg}"
-            except Exception as e:
-                logging.error(f"Export error: {e}")
-                text = f"❌ Ошибка экспорта: {str(e)}"
-            
-            client.send_message(to=user_id, text=text)
-            return
-        elif norm_text == "rname":
-            set_state(user_id, "waiting_name", save_to_history=False)
-            client.send_message(to=user_id, text="Введите *Фамилию Имя* для изменения:")
-            return
-        elif norm_text == "sts":
-            # Для IT sts работает как админская статистика
-            save_to_history(user_id, "menu:more")
-            buttons = [
-                Button(title="🚜 Terra (Все)", callback_data="stats:admin:terra"),
-                Button(title="👷 Бригадиры (Все)", callback_data="stats:admin:brig"),
-                Button(title="🔙 Назад", callback_data="back:prev"),
-            ]
-            client.send_message(to=user_id, text="📊 *Статистика (IT/Admin)*\n\nВыберите категорию:", buttons=buttons)
-            return
-    
-    # Команда briq: открыть меню бригадира
-    if norm_text in {"briq", "/briq"}:
-        save_to_history(user_id, "menu:more")
-        if not (is_brigadier(user_id) or is_it(user_id) or is_admin(user_id)):
-            client.send_message(to=user_id, text="❌ У вас нет прав для доступа к меню бригадира.")
-            return
-        btn_obj = type('obj', (object,), {'from_user': msg.from_user, 'data': 'menu:brigadier'})()
-        handle_callback(client, btn_obj)
-        return
-
-    # Команда бриг: управление бригадирами (админ/IT)
-    if norm_text in {"бриг", "/бриг"}:
-        save_to_history(user_id, "menu:more")
-        if not (is_admin(user_id) or is_it(user_id)):
-            client.send_message(to=user_id, text="❌ У вас нет прав для управления бригадирами.")
-            return
-        btn_obj = type('obj', (object,), {'from_user': msg.from_user, 'data': 'adm:menu:brigadiers'})()
-        handle_callback(client, btn_obj)
-        return
+        u = get_user(user_id)
+        # Принудительно показываем меню работяги (ОТД, Статистика, Настройки)
+        name = (u or {}).get("full_name") or "—"
+        buttons = [
+            Button(title="🚜 ОТД", callback_data="menu:work"),
+            Button(title="📊 Статистика", callback_data="menu:stats"),
+            Button(title="⚙️ Настройки", callback_data="menu:settings"),
+        ]
+        text = f"👤 *{name}*\n\nВыберите действие: 🌻"
+        client.send_message(to=user_id, text=text, buttons=buttons)
+        return True
+    else:
+        client.send_message(to=user_id, text="❌ Эта команда только для IT отдела.")
+        return True
 
-    # Команда для проверки IT роли и показа меню (обрабатывается ДО команды menu)
-    if norm_text in {"it", "ит", "itmenu", "итменю", "checkit", "чекит"}:
-        # Нормализуем номер для сравнения
-        normalized_user_id = _normalize_phone(user_id)
-        is_it_user = is_it(user_id)
-        logging.info(f"🔍 Проверка IT роли для {user_id} (нормализован: {normalized_user_id}): is_it={is_it_user}, IT_IDS={IT_IDS}")
+def _cmd_tim(client: WhatsApp360Client, msg: MessageObject, user_id: str) -> bool:
+    """tim: меню TIM (для IT и TIM)."""
+    # Разрешаем вызывать TIM меню как IT-шникам, так и самим TIM-ам
+    if is_it(user_id) or is_tim(user_id):
+        # Сохраняем текущее состояние в историю перед переходом
+        save_to_history(user_id, "menu:root")
         
-        if is_it_user:
-            u = get_user(user_id)
-            clear_state(user_id)
-            show_main_menu(client, user_id, u)
-            client.send_message(to=user_id, text="✅ IT меню активировано!")
-        else:
-            # Показываем отладочную информацию
-            debug_info = (
-                f"❌ *Ваш номер не найден в IT_IDS*\n\n"
-                f"Ваш номер: `{user_id}`\n"
-                f"Нормализованный: `{normalized_user_id}`\n"
-                f"Текущие IT_IDS: {', '.join(IT_IDS) if IT_IDS else 'не настроены'}\n\n"
-                f"Для добавления добавьте ваш номер в .env на сервере:\n"
-                f"`IT_IDS={normalized_user_id}`\n\n"
-                f"После этого перезапустите бота командой:\n"
-                f"`systemctl restart terra-bot.service`"
-            )
-            client.send_message(to=user_id, text=debug_info)
+        # Показываем меню TIM. Но show_main_menu определяет вид меню по правам.
+        # Поэтому мы либо временно выдаем права, либо напрямую вызываем рендер меню TIM.
+        # Т.к. is_tim(user_id) проверяется внутри show_main_menu, то для реальных TIM всё ок.
+        # Для IT-шников, которые хотят "подсмотреть", show_main_menu покажет IT-меню.
+        # Поэтому для IT-шников, вызывающих tim, мы должны сэмулировать TIM-меню.
+        
+        # Но лучше просто добавить кнопку в IT меню, что я уже сделал.
+        # Если IT хочет вызвать TIM меню командой, ему нужно стать TIM.
+        # Но мы можем просто показать меню, как если бы он был TIM.
+        
+        u = get_user(user_id)
+        name = (u or {}).get("full_name") or "—"
+        text = (
+            f"Первый зам директора по Информационным Технологиям\n"
+            f"*{name}*\n\n"
+            f"Выберите действие:"
+        )
+        buttons = [
+            Button(title="🇨🇳 Партия следить 🇨🇳", callback_data="tim:party"),
+            Button(title="📊 Статистика", callback_data="menu:stats"),
+            Button(title="✏️ Сменить имя", callback_data="menu:name"),
+        ]
+        client.send_message(to=user_id, text=text, buttons=buttons)
+        return True
+    else:
+        client.send_message(to=user_id, text="❌ Нет прав для доступа к меню TIM.")
+        return True
+
+def _cmd_star(client: WhatsApp360Client, msg: MessageObject, user_id: str) -> bool:
+    """Звездочка: для не-IT — подсказка; для IT обрабатывается дальше (callback)."""
+    if not is_it(user_id):
+        client.send_message(to=user_id, text="⭐\n\nЭта команда доступна только для IT пользователей.")
+        return True
+    # Для IT пользователей звездочка обрабатывается через callback
+    return False
+
+def _chunk_lines(lines: List[str], limit: int = 3000) -> List[str]:
+    """Склеить строки в сообщения не длиннее limit, разрывая только по границам строк."""
+    chunks, buf, size = [], [], 0
+    for ln in lines:
+        if size + len(ln) + 1 > limit and buf:
+            chunks.append("\n".join(buf))
+            buf, size = [], 0
+        buf.append(ln)
+        size += len(ln) + 1
+    if buf:
+        chunks.append("\n".join(buf))
+    return chunks
+
+def _send_chunks(client: WhatsApp360Client, user_id: str, chunks: List[str]):
+    """
+    Отправить части длинного сообщения. Первая уходит сразу, остальные — одной
+    фоновой задачей по порядку (параллельная отправка перемешала бы части).
+    """
+    if not chunks:
         return
-    
-    # Команда rb1 для IT: показать меню обычного работяги
-    if norm_text == "rb1":
-        if is_it(user_id):
-            u = get_user(user_id)
-            # Принудительно показываем меню работяги (ОТД, Статистика, Настройки)
-            name = (u or {}).get("full_name") or "—"
-            buttons = [
-                Button(title="🚜 ОТД", callback_data="menu:work"),
-                Button(title="📊 Статистика", callback_data="menu:stats"),
-                Button(title="⚙️ Настройки", callback_data="menu:settings"),
-            ]
-            text = f"👤 *{name}*\n\nВыберите действие: 🌻"
-            client.send_message(to=user_id, text=text, buttons=buttons)
-            return
-        else:
-            client.send_message(to=user_id, text="❌ Эта команда только для IT отдела.")
-            return
-    
-    # Команда для проверки TIM роли
-    if norm_text in {"tim", "тим"}:
-        # Разрешаем вызывать TIM меню как IT-шникам, так и самим TIM-ам
-        if is_it(user_id) or is_tim(user_id):
-            # Сохраняем текущее состояние в историю перед переходом
-            save_to_history(user_id, "menu:root")
+    client.send_message(to=user_id, text=chunks[0])
+    if len(chunks) > 1:
+        def _send_rest():
+            for chunk in chunks[1:]:
+                client.send_message(to=user_id, text=chunk)
+        run_in_background(_send_rest)
+
+def _cmd_x_stats(client: WhatsApp360Client, msg: MessageObject, user_id: str) -> bool:
+    """x: детализация статистики (только в режиме admin_viewing_stats)."""
+    state = get_state(user_id)
+    if state.get("state") == "admin_viewing_stats":
+        st_type = state["data"].get("type")
+        if st_type == "terra":
+            start_date, month_name, _ = _month_start(date.today().toordinal())
             
-            # Показываем меню TIM. Но show_main_menu определяет вид меню по правам.
-            # Поэтому мы либо временно выдаем права, либо напрямую вызываем рендер меню TIM.
-            # Т.к. is_tim(user_id) проверяется внутри show_main_menu, то для реальных TIM всё ок.
-            # Для IT-шников, которые хотят "подсмотреть", show_main_menu покажет IT-меню.
-            # Поэтому для IT-шников, вызывающих tim, мы должны сэмулировать TIM-меню.
+            # Группировка Дата -> Пользователь делается в SQLite: одна строка на (дата, имя),
+            # записи склеены через CHAR(30), поля записи — через CHAR(31)
+            with connect() as con, closing(con.cursor()) as c:
+                rows = c.execute("""
+                    SELECT work_date, reg_name,
+                           GROUP_CONCAT(COALESCE(location, '') || CHAR(31) || COALESCE(activity, '') || CHAR(31) || COALESCE(hours, ''), CHAR(30))
+                    FROM (SELECT * FROM reports WHERE work_date >= ? ORDER BY id)
+                    GROUP BY work_date, reg_name
+                    ORDER BY work_date DESC, reg_name ASC
+                """, (start_date,)).fetchall()
             
-            # Но лучше просто добавить кнопку в IT меню, что я уже сделал.
-            # Если IT хочет вызвать TIM меню командой, ему нужно стать TIM.
-            # Но мы можем просто показать меню, как если бы он был TIM.
+            if not rows:
+                client.send_message(to=user_id, text="ℹ️ Детальных записей нет.")
+                return True
             
-            u = get_user(user_id)
-            name = (u or {}).get("full_name") or "—"
-            text = (
-                f"Первый зам директора по Информационным Технологиям\n"
-                f"*{name}*\n\n"
-                f"Выберите действие:"
-            )
-            buttons = [
-                Button(title="🇨🇳 Партия следить 🇨🇳", callback_data="tim:party"),
-                Button(title="📊 Статистика", callback_data="menu:stats"),
-                Button(title="✏️ Сменить имя", callback_data="menu:name"),
-            ]
-            client.send_message(to=user_id, text=text, buttons=buttons)
-            return
-        else:
-            client.send_message(to=user_id, text="❌ Нет прав для доступа к меню TIM.")
-            return
-    
-    # Обработка звездочки для не-IT пользователей
-    if message_text in {"⭐", "star", "звездочка", "звезда"}:
-        if not is_it(user_id):
-            client.send_message(to=user_id, text="⭐\n\nЭта команда доступна только для IT пользователей.")
-            return
-        # Для IT пользователей звездочка обрабатывается через callback
-
-    if norm_text in {"menu", "меню"}:
-        cmd_menu(client, msg)
-        return
-    if norm_text in {"start", "старт"}:
-        cmd_start(client, msg)
-        return
-    if norm_text in {"today", "сегодня"}:
-        cmd_today(client, msg)
-        return
-    if norm_text in {"my", "мои"}:
-        cmd_my(client, msg)
-        return
-
-    # Special command for extended stats
-    if norm_text in {"x", "х", "ч", "{", "/x"}: # x (eng), х (rus), ч (typo), { (shift+x), /x
-        state = get_state(user_id)
-        if state.get("state") == "admin_viewing_stats":
-            st_type = state["data"].get("type")
-            if st_type == "terra":
-                today = date.today()
-                start_date = date(today.year, today.month, 1).isoformat()
-                
-                with connect() as con, closing(con.cursor()) as c:
-                    rows = c.execute("""
-                        SELECT work_date, reg_name, location, activity, hours
-                        FROM reports
-                        WHERE work_date >= ?
-                        ORDER BY work_date DESC, reg_name ASC
-                    """, (start_date,)).fetchall()
-                
-                if not rows:
-                    client.send_message(to=user_id, text="ℹ️ Детальных записей нет.")
-                    return
-                
-                # Group by Date -> User
-                grouped = {}
-                for r in rows:
-                    wd, name, loc, act, h = r
-                    grouped.setdefault(wd, {}).setdefault(name, []).append((loc, act, h))
-                
-                lines = [f"📋 *Детализация Terra - {calendar.month_name[today.month]}*"]
-                
-                for d in sorted(grouped.keys(), reverse=True):
+            lines = [f"📋 *Детализация Terra - {month_name}*"]
+            
+            prev_d = None
+            for d, name, items in rows:
+                if d != prev_d:
+                    prev_d = d
                     d_str = date.fromisoformat(d).strftime("%d.%m")
                     lines.append(f"\n📅 *{d_str}*")
-                    for name in sorted(grouped[d].keys()):
-                        lines.append(f"👤 *{name}*")
-                        for loc, act, h in grouped[d][name]:
-                            lines.append(f"   • {loc} — {act}: *{h}* ч")
-                
-                # Split message if too long (WhatsApp limit ~4096 chars)
-                full_text = "\n".join(lines)
-                if len(full_text) > 3000:
-                    # Simple split by chunks
-                    chunks = [full_text[i:i+3000] for i in range(0, len(full_text), 3000)]
-                    for chunk in chunks:
-                        client.send_message(to=user_id, text=chunk)
-                else:
-                    client.send_message(to=user_id, text=full_text)
-                return
-
-            elif st_type == "brig":
-                today = date.today()
-                start_date = date(today.year, today.month, 1).isoformat()
-                
-                with connect() as con, closing(con.cursor()) as c:
-                    rows = c.execute("""
-                        SELECT work_date, username, work_type, rows, bags, workers, field
-                        FROM brigadier_reports
-                        WHERE work_date >= ?
-                        ORDER BY work_date DESC, username ASC
-                    """, (start_date,)).fetchall()
-                
-                if not rows:
-                    client.send_message(to=user_id, text="ℹ️ Детальных записей нет.")
-                    return
-                
-                # Group by Date -> User
-                grouped = {}
-                for r in rows:
-                    wd, name, w_type, w_rows, w_bags, w_workers, w_field = r
-                    grouped.setdefault(wd, {}).setdefault(name, []).append((w_type, w_rows, w_bags, w_workers, w_field))
-                
-                lines = [f"📋 *Детализация Бригадиры - {calendar.month_name[today.month]}*"]
-                
-                for d in sorted(grouped.keys(), reverse=True):
+                lines.append(f"👤 *{name}*")
+                for item in items.split("\x1e"):
+                    loc, act, h = item.split("\x1f")
+                    lines.append(f"   • {loc} — {act}: *{h}* ч")
+            
+            # Split message if too long (WhatsApp limit ~4096 chars)
+            _send_chunks(client, user_id, _chunk_lines(lines))
+            return True
+
+        elif st_type == "brig":
+            start_date, month_name, _ = _month_start(date.today().toordinal())
+            
+            # Группировка Дата -> Бригадир в SQLite (см. terra выше)
+            with connect() as con, closing(con.cursor()) as c:
+                rows = c.execute("""
+                    SELECT work_date, username,
+                           GROUP_CONCAT(COALESCE(work_type, '') || CHAR(31) || COALESCE(rows, '') || CHAR(31) || COALESCE(bags, '')
+                                        || CHAR(31) || COALESCE(workers, '') || CHAR(31) || COALESCE(field, ''), CHAR(30))
+                    FROM (SELECT * FROM brigadier_reports WHERE work_date >= ? ORDER BY id)
+                    GROUP BY work_date, username
+                    ORDER BY work_date DESC, username ASC
+                """, (start_date,)).fetchall()
+            
+            if not rows:
+                client.send_message(to=user_id, text="ℹ️ Детальных записей нет.")
+                return True
+            
+            lines = [f"📋 *Детализация Бригадиры - {month_name}*"]
+            
+            prev_d = None
+            for d, name, items in rows:
+                if d != prev_d:
+                    prev_d = d
                     d_str = date.fromisoformat(d).strftime("%d.%m")
                     lines.append(f"\n📅 *{d_str}*")
-                    for name in sorted(grouped[d].keys()):
-                        lines.append(f"👷 *{name}*")
-                        for w_type, w_rows, w_bags, w_workers, w_field in grouped[d][name]:
-                            field_info = f" ({w_field})" if w_field else ""
-                            if w_type == "Кабачок":
-                                lines.append(f"   • 🥒 {w_rows}р, {w_workers}чел{field_info}")
-                            else:
-                                lines.append(f"   • 🥔 {w_rows}р, {w_bags}с, {w_workers}чел{field_info}")
-                
-                # Split message if too long
-                full_text = "\n".join(lines)
-                if len(full_text) > 3000:
-                    chunks = [full_text[i:i+3000] for i in range(0, len(full_text), 3000)]
-                    for chunk in chunks:
-                        client.send_message(to=user_id, text=chunk)
-                else:
-                    client.send_message(to=user_id, text=full_text)
-                return
+                lines.append(f"👷 *{name}*")
+                for item in items.split("\x1e"):
+                    w_type, w_rows, w_bags, w_workers, w_field = item.split("\x1f")
+                    field_info = f" ({w_field})" if w_field else ""
+                    if w_type == "Кабачок":
+                        lines.append(f"   • 🥒 {w_rows}р, {w_workers}чел{field_info}")
+                    else:
+                        lines.append(f"   • 🥔 {w_rows}р, {w_bags}с, {w_workers}чел{field_info}")
+            
+            # Split message if too long
+            _send_chunks(client, user_id, _chunk_lines(lines))
+            return True
+    return False
 
-    # 2. Обработка состояний (FSM)
-    state = get_state(user_id)
-    current_state = state.get("state")
-    
-    logging.info(f"📩 Message from {user_id}: '{message_text}' | State: {current_state}")
+# Команда (norm_text) -> обработчик(client, msg, user_id) -> bool (True — сообщение обработано)
+TEXT_COMMANDS: Dict[str, Callable[[WhatsApp360Client, MessageObject, str], bool]] = {
+    k: handler
+    for keys, handler in [
+        (CMD_ADMIN, _cmd_admin),
+        (CMD_EXPO, _cmd_expo),
+        (CMD_RNAME, _cmd_rname),
+        (CMD_STS, _cmd_sts),
+        (CMD_BRIQ, _cmd_briq),
+        (CMD_BRIG, _cmd_brig_admin),
+        (CMD_IT, _cmd_it_check),
+        (CMD_RB1, _cmd_rb1),
+        (CMD_TIM, _cmd_tim),
+        (CMD_STAR, _cmd_star),
+        (CMD_MENU, _simple_cmd(cmd_menu)),
+        (CMD_START, _simple_cmd(cmd_start)),
+        (CMD_TODAY, _simple_cmd(cmd_today)),
+        (CMD_MY, _simple_cmd(cmd_my)),
+        (CMD_X, _cmd_x_stats),
+    ]
+    for k in keys
+}
 
-    # Восстановление шага бригадира, если состояние потерялось, но данные остались
-    brig_stage = state.get("data", {}).get("brig_stage")
-    if not current_state and brig_stage in {"brig_zucchini_rows", "brig_potato_rows"}:
-        set_state(user_id, brig_stage, state.get("data", {}), save_to_history=False)
-        current_state = brig_stage
-        state = get_state(user_id)
+# -----------------------------
+# Обработчики состояний (FSM)
+# -----------------------------
 
-    if current_state == "waiting_name":
-        # Feature 5: Mandatory Full Name Registration
-        parts = message_text.strip().split()
-        if len(parts) < 2:
-            client.send_message(to=user_id, text="❌ Пожалуйста, введите **Фамилию** и **Имя** (два слова).\nНапример: *Иванов Иван*")
-            return
-            
-        if len(message_text) < 3:
-            client.send_message(to=user_id, text="❌ Слишком короткое имя. Введите Фамилию и Имя.")
-            return
+def _parse_uint(s: str) -> Optional[int]:
+    """Неотрицательное целое из ASCII-цифр или None (isdigit() пропускает '²', на котором падает int())."""
+    return int(s) if s.isascii() and s.isdigit() else None
+
+def _state_waiting_name(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Ввод Фамилии Имени при регистрации/смене имени."""
+    # Feature 5: Mandatory Full Name Registration
+    parts = message_text.split()
+    if len(parts) < 2:
+        client.send_message(to=user_id, text="❌ Пожалуйста, введите **Фамилию** и **Имя** (два слова).\nНапример: *Иванов Иван*")
+        return
         
-        upsert_user(user_id, message_text, TZ)
+    if len(message_text) < 3:
+        client.send_message(to=user_id, text="❌ Слишком короткое имя. Введите Фамилию и Имя.")
+        return
+    
+    upsert_user(user_id, message_text, TZ)
+    clear_state(user_id)
+    client.send_message(to=user_id, text=f"✅ Приятно познакомиться, {message_text}!")
+    
+    u = get_user(user_id)
+    show_main_menu(client, user_id, u)
+
+def _state_waiting_activity_selection(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Выбор вида работы из списка (номер или название)."""
+    work_data = state["data"].setdefault("work", {})
+    if message_text == "0":
+        buttons = [
+            Button(title="Техника", callback_data="work:grp:tech"),
+            Button(title="Ручная", callback_data="work:type:manual"),
+            BTN_BACK,
+        ]
+        client.send_message(to=user_id, text="Выберите *тип работы*:", buttons=buttons)
         clear_state(user_id)
-        client.send_message(to=user_id, text=f"✅ Приятно познакомиться, {message_text}!")
-        
-        u = get_user(user_id)
-        show_main_menu(client, user_id, u)
         return
 
-    if current_state == "tim_wait_activity":
-        if message_text == "0":
-            show_date_selection(client, user_id, prefix="tim:date")
+    acts = state["data"].get("acts", [])
+    
+    # Проверяем, выбрал ли пользователь "Прочее"
+    choice_num = _parse_uint(message_text)
+    if choice_num is not None:
+        if choice_num == len(acts) + 1:
+            # Пользователь выбрал "Прочее"
+            set_state(user_id, "waiting_custom_activity_input", state["data"])
+            client.send_message(
+                to=user_id, 
+                text="📝 Введите *название работы* (от 3 до 50 символов):",
+                buttons=BACK_BUTTONS
+            )
             return
+    
+    found = find_best_match(message_text, acts)
+    if not found:
+        client.send_message(to=user_id, text="❌ Не удалось распознать. Введите номер или название (или 0 для возврата).")
+        return
+    
+    act_id, act_name = found
+    
+    res = get_activity_name(act_id)
+    if not res:
+        client.send_message(to=user_id, text="❌ Ошибка базы данных.")
+        clear_state(user_id)
+        return
+        
+    activity_name, grp_name = res
+    work_data["grp"] = grp_name
+    work_data["activity"] = activity_name
+    set_state(user_id, "pick_loc_group", state["data"])
+    
+    buttons = [
+        Button(title="Поля", callback_data="work:locgrp:fields"),
+        Button(title="Склад", callback_data="work:locgrp:ware"),
+        BTN_BACK,
+    ]
+    client.send_message(to=user_id, text=f"✅ Выбрано: *{activity_name}*\n\nТеперь выберите *локацию*:", buttons=buttons)
+
+def _state_waiting_custom_activity_input(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Ввод своего вида работы."""
+    work_data = state["data"].setdefault("work", {})
+    if message_text == "0":
+        # Возврат к выбору работы
+        grp_name = work_data.get("grp", GROUP_TECH)
         
-        state["data"]["tim_report"] = {"activity": message_text}
-        # Pass date along
-        state["data"]["tim_report"]["date"] = state["data"]["date"]
+        activities = list_activities_with_id(grp_name)
+        state["data"]["acts"] = activities
+        set_state(user_id, "waiting_activity_selection", state["data"])
         
-        set_state(user_id, "tim_wait_location", state["data"], save_to_history=False)
-        client.send_message(to=user_id, text="📍 Введите *локацию*:\n\n0. 🔙 Назад")
+        lines = ["Выберите *вид работы* (отправьте номер или название):"]
+        for i, (aid, name) in enumerate(activities, 1):
+            lines.append(f"{i}. {name}")
+        lines.append(f"{len(activities) + 1}. 📝 Прочее")
+        
+        text = "\n".join(lines)
+        client.send_message(to=user_id, text=text, buttons=BACK_BUTTONS)
+        return
+    
+    # Валидация пользовательского ввода
+    custom_activity = message_text
+    if len(custom_activity) < 3:
+        client.send_message(to=user_id, text="❌ Слишком короткое название. Минимум 3 символа.", buttons=BACK_BUTTONS)
+        return
+    
+    if len(custom_activity) > 50:
+        client.send_message(to=user_id, text="❌ Слишком длинное название. Максимум 50 символов.", buttons=BACK_BUTTONS)
         return
+    
+    # Сохраняем пользовательский ввод
+    grp_name = work_data.get("grp", GROUP_TECH)
+    work_data["activity"] = custom_activity
+    work_data["grp"] = grp_name
+    set_state(user_id, "pick_loc_group", state["data"])
+    
+    buttons = [
+        Button(title="Поля", callback_data="work:locgrp:fields"),
+        Button(title="Склад", callback_data="work:locgrp:ware"),
+        BTN_BACK,
+    ]
+    client.send_message(to=user_id, text=f"✅ Выбрано: *{custom_activity}*\n\nТеперь выберите *локацию*:", buttons=buttons)
 
-    if current_state == "tim_wait_location":
-        if message_text == "0":
-            # Back to activity
-            set_state(user_id, "tim_wait_activity", state["data"], save_to_history=False)
-            client.send_message(to=user_id, text="🇨🇳 Введите *вид работы*:\n\n0. 🔙 Назад")
-            return
-            
-        state["data"]["tim_report"]["location"] = message_text
-        set_state(user_id, "tim_wait_hours", state["data"], save_to_history=False)
-        client.send_message(to=user_id, text="🕒 Введите *количество часов*:\n\n0. 🔙 Назад")
+def _state_waiting_location_selection(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Выбор места из списка (номер или название)."""
+    work_data = state["data"].setdefault("work", {})
+    if message_text == "0":
+        buttons = [
+            Button(title="Поля", callback_data="work:locgrp:fields"),
+            Button(title="Склад", callback_data="work:locgrp:ware"),
+            BTN_BACK,
+        ]
+        client.send_message(to=user_id, text="Выберите *локацию*:", buttons=buttons)
         return
 
-    if current_state == "tim_wait_hours":
-        if message_text == "0":
-            # Back to location
-            set_state(user_id, "tim_wait_location", state["data"], save_to_history=False)
-            client.send_message(to=user_id, text="📍 Введите *локацию*:\n\n0. 🔙 Назад")
-            return
-            
-        if not message_text.isdigit():
-            client.send_message(to=user_id, text="❌ Введите число.")
-            return
-            
-        hours = int(message_text)
-        if not (1 <= hours <= 24):
-            client.send_message(to=user_id, text="❌ От 1 до 24.")
-            return
-            
-        state["data"]["tim_report"]["hours"] = hours
+    locs = state["data"].get("locs", [])
+    found = find_best_match(message_text, locs)
+    if not found:
+        client.send_message(to=user_id, text="❌ Не удалось распознать. Введите номер или название (или 0 для возврата).")
+        return
+        
+    loc_id, loc_name = found
+    
+    res = get_location_name(loc_id)
+    if not res:
+        client.send_message(to=user_id, text="❌ Ошибка базы данных.")
+        clear_state(user_id)
+        return
+        
+    location_name, grp = res
+    work_data["loc_grp"] = grp
+    work_data["location"] = location_name
+    
+    # New flow: Date is already selected, go to hours (or сразу к подтверждению, если часы были введены)
+    prefilled = state["data"].get("prefilled_hours")
+    if prefilled:
+        _build_worker_confirmation(client, user_id, state, prefilled)
+    else:
+        acts_kind = state["data"].get("acts_kind", "tech")
+        save_to_history(user_id, f"work:grp:{acts_kind}")
+        set_state(user_id, "waiting_hours", state["data"], push_history=False)
         
-        # Confirmation
-        rep = state["data"]["tim_report"]
-        d_str = date.fromisoformat(rep["date"]).strftime("%d.%m.%Y")
+        work_date = work_data.get("date", date.today().isoformat())
+        current_sum = sum_hours_for_user_date(user_id, work_date)
+        d_str = _iso_to_ddmmyyyy(work_date)
+        
+        text = (
+            f"📅 Дата: *{d_str}*\n"
+            f"📊 Уже внесено: *{current_sum}* ч\n\n"
+            f"Введите *количество часов*:"
+        )
+        quick_replies = [{"id": "back_to_loc", "title": "🔙 Назад"}]
+        client.send_text_with_quick_replies(to=user_id, text=text, quick_replies=quick_replies)
+
+def _state_waiting_date_selection_universal(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Выбор даты текстом (номер из списка последних дней)."""
+    if message_text == "0":
+        # Back button logic depends on where we came from
+        # For now, just go to root menu
+        back_to_main_menu(client, user_id)
+        return
+
+    dates = state["data"].get("dates_list", [])
+    idx = int(message_text) - 1
+    if not (0 <= idx < len(dates)):
+        client.send_message(to=user_id, text="❌ Неверный номер.")
+        return
         
+    selected_date = dates[idx]
+    next_prefix = state["data"].get("next_prefix")
+    
+    if next_prefix == "work:date":
+        # Worker flow: Date selected -> immediately ask for hours
+        current_sum = sum_hours_for_user_date(user_id, selected_date)
+        d_str = _iso_to_ddmmyyyy(selected_date)
         text = (
-            f"🇨🇳 *Проверка данных*\n\n"
             f"📅 Дата: *{d_str}*\n"
-            f"Работа: *{rep['activity']}*\n"
-            f"Место: *{rep['location']}*\n"
-            f"Часы: *{hours}*\n"
+            f"📊 Уже внесено: *{current_sum}* ч\n\n"
+            f"Введите *количество часов*:\n\n0. 🔙 Назад"
         )
+        set_state(user_id, "waiting_hours_prefill", {"date": selected_date, "work": {"date": selected_date}}, push_history=False)
+        client.send_message(to=user_id, text=text)
+        
+    elif next_prefix == "brig:date":
+        # Brigadier flow: Date selected -> Choose Shift
+        set_state(user_id, "brig_pick_shift", {"date": selected_date})
         
         buttons = [
-            Button(title="✅ Подтвердить", callback_data="tim:save:simple"),
-            Button(title="💾 Сохранить и подтв.", callback_data="tim:save:template"),
-            Button(title="🔄 Заново", callback_data="tim:party")
+            Button(title="☀️ Утренняя", callback_data="brig:shift:morning"),
+            Button(title="🌙 Вечерняя", callback_data="brig:shift:evening"),
+            Button(title="🔙 Назад", callback_data="menu:brigadier")
         ]
-        client.send_message(to=user_id, text=text, buttons=buttons)
-        set_state(user_id, "tim_confirm", state["data"], save_to_history=False)
+        d_str = _iso_to_ddmmyyyy(selected_date)
+        client.send_message(to=user_id, text=f"📅 Дата: *{d_str}*\n\nВыберите *смену*:", buttons=buttons)
+        
+    elif next_prefix == "it:date":
+        # IT flow: Date selected, now ask for hours
+        # Calculate current IT hours for today
+        current_sum = sum_hours_for_user_date(user_id, selected_date, include_it=True)
+        
+        d_str = _iso_to_ddmmyyyy(selected_date)
+        text = (
+            f"📅 Дата: *{d_str}*\n"
+            f"📊 Уже внесено: *{current_sum}* ч\n\n"
+            f"Введите *количество часов*:"
+        )
+        
+        # IMPORTANT: We must pass the selected date in the data
+        set_state(user_id, "it_waiting_hours", {"date": selected_date}, push_history=False)
+        quick_replies = [{"id": "back_to_date", "title": "🔙 Back"}]
+        client.send_text_with_quick_replies(to=user_id, text=text, quick_replies=quick_replies)
+        
+    elif next_prefix == "tim:date":
+        # TIM Date selected -> Free input Activity
+        set_state(user_id, "tim_wait_activity", {"date": selected_date}, push_history=False)
+        client.send_message(to=user_id, text="🇨🇳 Введите *вид работы*:\n\n0. 🔙 Назад")
+
+def _process_hours_entry(client: WhatsApp360Client, user_id: str, state: dict, message_text: str, *, it_report: bool):
+    """
+    Общий ввод часов для waiting_hours / it_waiting_hours:
+    проверка числа, лимит 24 ч за день и переход к подтверждению.
+    """
+    hours = _parse_uint(message_text)
+    if hours is None:
+        client.send_message(to=user_id, text="❌ Введите число (1-24) или 0 для возврата назад.")
+        return
+    if not (1 <= hours <= 24):
+        client.send_message(to=user_id, text="❌ Часы должны быть от 1 до 24 (или 0 для возврата назад).")
+        return
+    
+    if it_report:
+        work_date = state["data"].get("date", date.today().isoformat())
+        current_label = "Автоматизация учета (Манхэттен)"
+    else:
+        work_data = state["data"].setdefault("work", {})
+        work_date = work_data.get("date")
+        current_label = f"{work_data.get('activity', 'работа')} ({work_data.get('location', 'место')})"
+    
+    # Проверка суммы часов за день (для IT роли учитываются только IT отчеты)
+    existing_reports, existing_hours = day_reports_with_total(user_id, work_date, it_only=it_report)
+    if existing_hours + hours > 24:
+        client.send_message(to=user_id, text=_hours_limit_text(existing_hours, hours, existing_reports, current_label))
+        return
+    
+    if not it_report:
+        _build_worker_confirmation(client, user_id, state, hours)
         return
+    
+    temp_report = {
+        "location": "Манхэттен",
+        "loc_grp": "it",  # Специальная группа для IT
+        "activity": "Автоматизация учета",
+        "act_grp": "it",  # Специальная группа для IT
+        "work_date": work_date,
+        "hours": hours
+    }
+    
+    # Сохраняем временный отчет в состояние
+    state["data"]["temp_report"] = temp_report
+    set_state(user_id, "waiting_confirmation_it", state["data"], push_history=False)
+    
+    # Показываем подтверждение (такое же как у всех)
+    d_str = _iso_to_ddmmyyyy(work_date)
+    text = (
+        f"📋 *Подтверждение отчета*\n\n"
+        f"📅 Дата: *{d_str}*\n"
+        f"Работа: *{temp_report['activity']}*\n"
+        f"Место: *{temp_report['location']}*\n"
+        f"Часы: *{hours}*\n\n"
+        f"Всё верно?"
+    )
+    
+    buttons = [
+        Button(title="✅ Подтвердить", callback_data="confirm:it"),
+        Button(title="✏️ Изменить", callback_data="edit:it"),
+    ]
+    client.send_message(to=user_id, text=text, buttons=buttons)
 
-    # -----------------------------
-    # Новый поток: Трактор / КамАЗ / Ручная
-    # -----------------------------
-    if current_state == "work_tractor_activity_custom":
-        if message_text == "0":
-            # Назад к списку видов деятельности
-            lines = ["Выберите *вид деятельности* (отправьте номер):"]
-            for i, a in enumerate(ACTIVITIES_TRACTOR, 1):
-                lines.append(f"{i}. {a}")
-            client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            set_state(user_id, "work_tractor_activity", state["data"], save_to_history=False)
+def _state_it_waiting_hours(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Ввод часов для IT отчета."""
+    if not is_it(user_id):
+        client.send_message(to=user_id, text="❌ Нет прав")
+        clear_state(user_id)
+        return
+    
+    # Обработка кнопки "Назад" (0) или Quick Reply "Back"
+    if message_text == "0" or message_text.lower() == "back" or message_text == "back_to_date" or message_text == "🔙 Back":
+        # Return to date selection
+        show_date_selection(client, user_id, prefix="it:date")
+        return
+    
+    if message_text == "back:prev": # Generic back
+         if go_back(client, user_id):
             return
-        if len(message_text.strip()) < 2:
-            client.send_message(to=user_id, text="❌ Введите название (минимум 2 символа) или 0 для возврата.")
+         else:
+            back_to_main_menu(client, user_id)
             return
-        work_data = state.get("data", {}).get("work", {})
-        work_data["activity_base"] = message_text.strip()
-        work_data["grp"] = GROUP_TECH
-        state["data"]["work"] = work_data
-        set_state(user_id, "work_tractor_field", state["data"], save_to_history=True, back_callback="work:tractor:activity")
+    
+    _process_hours_entry(client, user_id, state, message_text, it_report=True)
 
-        locations = list_locations_with_id(GROUP_FIELDS)
-        state["data"]["locs"] = locations
-        lines = ["Выберите *поле* (отправьте номер):"]
-        for i, (_, name) in enumerate(locations, 1):
-            lines.append(f"{i}. {name}")
-        client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
+def _state_waiting_hours(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Ввод часов для обычного отчета."""
+    work_data = state["data"].setdefault("work", {})
+    # Обработка кнопки "Назад" (0) или Quick Reply
+    if message_text == "0" or message_text == "back_to_loc":
+        # Fallback: возврат к выбору локации
+        activity_name = work_data.get("activity", "работа")
+        
+        # Check if we came from warehouse (skip loc selection) or fields
+        loc_grp = work_data.get("loc_grp")
+        
+        if loc_grp == GROUP_WARE:
+             # If warehouse, we skipped location selection, so back should go to loc group selection
+             # But in handle_callback we saved history before waiting_hours.
+             # Let's try go_back first.
+             if go_back(client, user_id):
+                 return
+             else:
+                 # Fallback
+                 buttons = [
+                    Button(title="Поля", callback_data="work:locgrp:fields"),
+                    Button(title="Склад", callback_data="work:locgrp:ware"),
+                    BTN_BACK,
+                ]
+                 client.send_message(to=user_id, text=f"✅ Выбрано: *{activity_name}*\n\nТеперь выберите *локацию*:", buttons=buttons)
+                 return
+        else:
+            # Fields - go back to location selection
+            # We can try go_back, but if we want to show the list again explicitly:
+            locations = list_locations_with_id(GROUP_FIELDS)
+            state["data"]["locs"] = locations
+            set_state(user_id, "waiting_location_selection", state["data"], push_history=False)
+            
+            lines = ["Выберите *место* (отправьте номер или название):"]
+            for i, (lid, name) in enumerate(locations, 1):
+                lines.append(f"{i}. {name}")
+            
+            text = "\n".join(lines)
+            quick_replies = [{"id": "cancel_location", "title": "🔙 Назад"}]
+            client.send_text_with_quick_replies(to=user_id, text=text, quick_replies=quick_replies)
+            return
+    
+    _process_hours_entry(client, user_id, state, message_text, it_report=False)
+
+def _state_waiting_record_selection(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Выбор записи для редактирования."""
+    data = state["data"]
+    if message_text == "0":
+        client.send_message(to=user_id, text="🔄 Отмена редактирования")
+        back_to_main_menu(client, user_id)
         return
 
-    if current_state == "work_tractor_machinery":
-        # Выбор трактора
-        if message_text == "0":
-            # Назад к выбору техники (Трактор/КамАЗ)
-            buttons = [
-                Button(title="🚜 Трактор", callback_data="work:type:tractor"),
-                Button(title="🚛 КамАЗ", callback_data="work:type:kamaz"),
-                Button(title="🔙 Назад", callback_data="back:prev"),
-            ]
-            client.send_message(to=user_id, text="Выберите *технику*:", buttons=buttons)
-            return
-        if not message_text.isdigit():
-            client.send_message(to=user_id, text="❌ Введите номер трактора или используйте кнопку Назад.", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            return
-        choice = int(message_text)
-        if not (1 <= choice <= len(TRACTORS)):
-            client.send_message(to=user_id, text="❌ Неверный номер. Введите номер из списка или нажмите Назад.", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            return
-        # Прочее -> свободный ввод
-        if choice == len(TRACTORS) and TRACTORS[choice - 1].lower() == "прочее":
-            set_state(user_id, "work_tractor_machinery_custom", state["data"], save_to_history=False)
-            client.send_message(to=user_id, text="📝 Введите *трактор* текстом:", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            return
-        machinery = TRACTORS[choice - 1]
-        work_data = state.get("data", {}).get("work", {})
-        work_data["machinery"] = machinery
-        work_data["date"] = state.get("data", {}).get("date", date.today().isoformat())
-        work_data["work_type"] = "tractor"
-        state["data"]["work"] = work_data
-        set_state(user_id, "work_tractor_activity", state["data"], save_to_history=True, back_callback="work:tractor:machinery")
+    idx = int(message_text) - 1
+    records = data.get("edit_records", [])
+    
+    if not (0 <= idx < len(records)):
+        client.send_message(to=user_id, text="❌ Неверный номер.")
+        return
+        
+    rid, wdate, act, loc, h = records[idx][:5]
+    
+    text = (
+        f"📝 *Запись #{rid}*\n"
+        f"Дата: {wdate}\n"
+        f"Место: {loc}\n"
+        f"Работа: {act}\n"
+        f"Часы: *{h}*\n\n"
+        f"Введите новое количество часов:"
+    )
+    
+    data["edit_id"] = rid
+    data["edit_date"] = wdate
+    data["edit_old_hours"] = h
+    data["edit_activity"] = act
+    data["edit_location"] = loc
+    set_state(user_id, "waiting_edit_hours", data)
+    buttons = BACK_BUTTONS
+    client.send_message(to=user_id, text=text, buttons=buttons)
 
-        lines = ["Выберите *вид деятельности* (отправьте номер):"]
-        for i, a in enumerate(ACTIVITIES_TRACTOR, 1):
-            lines.append(f"{i}. {a}")
-        client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
+# Состояние FSM -> обработчик(client, user_id, state, message_text);
+# message_text приходит из handle_text уже обрезанным и непустым
+def _state_tim_wait_activity(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """TIM: ввод вида работы."""
+    if message_text == "0":
+        show_date_selection(client, user_id, prefix="tim:date")
         return
+    
+    state["data"]["tim_report"] = {"activity": message_text}
+    # Pass date along
+    state["data"]["tim_report"]["date"] = state["data"]["date"]
+    
+    set_state(user_id, "tim_wait_location", state["data"], push_history=False)
+    client.send_message(to=user_id, text="📍 Введите *локацию*:\n\n0. 🔙 Назад")
 
-    if current_state == "work_tractor_machinery_custom":
-        if message_text == "0":
-            # Назад к списку тракторов
-            lines = ["Выберите *трактор* (отправьте номер):"]
-            for i, m in enumerate(TRACTORS, 1):
-                lines.append(f"{i}. {m}")
-            client.send_message(
-                to=user_id,
-                text="\n".join(lines),
-                buttons=[Button(title="🔙 Назад", callback_data="back:prev")]
-            )
-            set_state(user_id, "work_tractor_machinery", state["data"], save_to_history=False)
-            return
-        if len(message_text.strip()) < 2:
-            client.send_message(to=user_id, text="❌ Введите название трактора (мин. 2 символа) или нажмите Назад.", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            return
-        machinery = message_text.strip()
-        work_data = state.get("data", {}).get("work", {})
-        work_data["machinery"] = machinery
-        work_data["date"] = state.get("data", {}).get("date", date.today().isoformat())
-        work_data["work_type"] = "tractor"
-        state["data"]["work"] = work_data
-        set_state(user_id, "work_tractor_activity", state["data"], save_to_history=True, back_callback="work:tractor:machinery")
+def _state_tim_wait_location(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """TIM: ввод места."""
+    if message_text == "0":
+        # Back to activity
+        set_state(user_id, "tim_wait_activity", state["data"], push_history=False)
+        client.send_message(to=user_id, text="🇨🇳 Введите *вид работы*:\n\n0. 🔙 Назад")
+        return
+        
+    state["data"]["tim_report"]["location"] = message_text
+    set_state(user_id, "tim_wait_hours", state["data"], push_history=False)
+    client.send_message(to=user_id, text="🕒 Введите *количество часов*:\n\n0. 🔙 Назад")
+
+def _state_tim_wait_hours(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """TIM: ввод часов и сохранение отчета."""
+    if message_text == "0":
+        # Back to location
+        set_state(user_id, "tim_wait_location", state["data"], push_history=False)
+        client.send_message(to=user_id, text="📍 Введите *локацию*:\n\n0. 🔙 Назад")
+        return
+        
+    hours = int(message_text)
+    if not (1 <= hours <= 24):
+        client.send_message(to=user_id, text="❌ От 1 до 24.")
+        return
+        
+    state["data"]["tim_report"]["hours"] = hours
+    
+    # Confirmation
+    rep = state["data"]["tim_report"]
+    d_str = _iso_to_ddmmyyyy(rep["date"])
+    
+    text = (
+        f"🇨🇳 *Проверка данных*\n\n"
+        f"📅 Дата: *{d_str}*\n"
+        f"Работа: *{rep['activity']}*\n"
+        f"Место: *{rep['location']}*\n"
+        f"Часы: *{hours}*\n"
+    )
+    
+    buttons = [
+        Button(title="✅ Подтвердить", callback_data="tim:save:simple"),
+        Button(title="💾 Сохранить и подтв.", callback_data="tim:save:template"),
+        Button(title="🔄 Заново", callback_data="tim:party")
+    ]
+    client.send_message(to=user_id, text=text, buttons=buttons)
+    set_state(user_id, "tim_confirm", state["data"], push_history=False)
+
+# -----------------------------
+# Новый поток: Трактор / КамАЗ / Ручная
+# -----------------------------
 
+def _state_work_tractor_activity_custom(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Трактор: свой вариант работы."""
+    if message_text == "0":
+        # Назад к списку видов деятельности
         lines = ["Выберите *вид деятельности* (отправьте номер):"]
         for i, a in enumerate(ACTIVITIES_TRACTOR, 1):
             lines.append(f"{i}. {a}")
-        client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
+        client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+        set_state(user_id, "work_tractor_activity", state["data"], push_history=False)
         return
-    if current_state == "work_tractor_activity":
-        if message_text == "0":
-            # Назад к выбору трактора
-            lines = ["Выберите *трактор* (отправьте номер):"]
-            for i, m in enumerate(TRACTORS, 1):
-                lines.append(f"{i}. {m}")
-            client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            set_state(user_id, "work_tractor_machinery", state["data"], save_to_history=False)
-            return
-        if not message_text.isdigit():
-            client.send_message(to=user_id, text="❌ Введите номер вида деятельности или используйте кнопку Назад.", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            return
-        choice = int(message_text)
-        if not (1 <= choice <= len(ACTIVITIES_TRACTOR)):
-            client.send_message(to=user_id, text="❌ Неверный номер. Введите номер из списка или нажмите Назад.", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            return
-        # Прочее -> свободный ввод
-        if choice == len(ACTIVITIES_TRACTOR) and ACTIVITIES_TRACTOR[choice - 1].lower() == "прочее":
-            set_state(user_id, "work_tractor_activity_custom", state["data"], save_to_history=False)
-            client.send_message(to=user_id, text="📝 Введите *вид деятельности* текстом:", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            return
-        activity = ACTIVITIES_TRACTOR[choice - 1]
-        work_data = state.get("data", {}).get("work", {})
-        work_data["activity_base"] = activity
-        work_data["grp"] = GROUP_TECH
-        state["data"]["work"] = work_data
-        set_state(user_id, "work_tractor_field", state["data"], save_to_history=True, back_callback="work:tractor:activity")
-
-        locations = list_locations_with_id(GROUP_FIELDS)
-        state["data"]["locs"] = locations
-        lines = ["Выберите *поле* (отправьте номер):"]
-        for i, (_, name) in enumerate(locations, 1):
-            lines.append(f"{i}. {name}")
-        client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
+    if len(message_text) < 2:
+        client.send_message(to=user_id, text="❌ Введите название (минимум 2 символа) или 0 для возврата.")
         return
+    work_data = state.get("data", {}).get("work", {})
+    work_data["activity_base"] = message_text
+    work_data["grp"] = GROUP_TECH
+    state["data"]["work"] = work_data
+    set_state(user_id, "work_tractor_field", state["data"], push_history=True, back_callback="work:tractor:activity")
+
+    locations = list_locations_with_id(GROUP_FIELDS)
+    state["data"]["locs"] = locations
+    lines = ["Выберите *поле* (отправьте номер):"]
+    for i, (_, name) in enumerate(locations, 1):
+        lines.append(f"{i}. {name}")
+    client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
 
-    if current_state == "work_tractor_field":
-        if message_text == "0":
-            # Назад к выбору вида деятельности
-            lines = ["Выберите *вид деятельности* (отправьте номер):"]
-            for i, a in enumerate(ACTIVITIES_TRACTOR, 1):
-                lines.append(f"{i}. {a}")
-            client.send_message(to=user_id, text="\n".join(lines) + "\n\n0. 🔙 Назад")
-            set_state(user_id, "work_tractor_activity", state["data"], save_to_history=False)
-            return
-        locs = state.get("data", {}).get("locs", [])
-        found_loc = None
-        if message_text.isdigit():
-            idx = int(message_text) - 1
-            if 0 <= idx < len(locs):
-                found_loc = locs[idx][1]
-        if not found_loc:
-            # allow exact name
-            for _, name in locs:
-                if name.lower() == message_text.lower():
-                    found_loc = name
-                    break
-        if not found_loc:
-            client.send_message(to=user_id, text="❌ Не найдено. Введите номер или точное название из списка, или 0.")
-            return
-        work_data = state.get("data", {}).get("work", {})
-        work_data["location"] = found_loc
-        work_data["loc_grp"] = GROUP_FIELDS
-        state["data"]["work"] = work_data
-        set_state(user_id, "work_tractor_crop", state["data"], save_to_history=True, back_callback="work:tractor:field")
+def _state_work_tractor_machinery(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Трактор: выбор техники."""
+    # Выбор трактора
+    if message_text == "0":
+        # Назад к выбору техники (Трактор/КамАЗ)
+        buttons = [
+            Button(title="🚜 Трактор", callback_data="work:type:tractor"),
+            Button(title="🚛 КамАЗ", callback_data="work:type:kamaz"),
+            BTN_BACK,
+        ]
+        client.send_message(to=user_id, text="Выберите *технику*:", buttons=buttons)
+        return
+    choice = _parse_uint(message_text)
+    if choice is None:
+        client.send_message(to=user_id, text="❌ Введите номер трактора или используйте кнопку Назад.", buttons=BACK_BUTTONS)
+        return
+    if not (1 <= choice <= len(TRACTORS)):
+        client.send_message(to=user_id, text="❌ Неверный номер. Введите номер из списка или нажмите Назад.", buttons=BACK_BUTTONS)
+        return
+    # Прочее -> свободный ввод
+    if choice == len(TRACTORS) and TRACTORS[choice - 1].lower() == "прочее":
+        set_state(user_id, "work_tractor_machinery_custom", state["data"], push_history=False)
+        client.send_message(to=user_id, text="📝 Введите *трактор* текстом:", buttons=BACK_BUTTONS)
+        return
+    machinery = TRACTORS[choice - 1]
+    work_data = state.get("data", {}).get("work", {})
+    work_data["machinery"] = machinery
+    work_data["date"] = state.get("data", {}).get("date", date.today().isoformat())
+    work_data["work_type"] = "tractor"
+    state["data"]["work"] = work_data
+    set_state(user_id, "work_tractor_activity", state["data"], push_history=True, back_callback="work:tractor:machinery")
+
+    lines = ["Выберите *вид деятельности* (отправьте номер):"]
+    for i, a in enumerate(ACTIVITIES_TRACTOR, 1):
+        lines.append(f"{i}. {a}")
+    client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+
+def _state_work_tractor_machinery_custom(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Трактор: своя техника."""
+    if message_text == "0":
+        # Назад к списку тракторов
+        lines = ["Выберите *трактор* (отправьте номер):"]
+        for i, m in enumerate(TRACTORS, 1):
+            lines.append(f"{i}. {m}")
+        client.send_message(
+            to=user_id,
+            text="\n".join(lines),
+            buttons=BACK_BUTTONS
+        )
+        set_state(user_id, "work_tractor_machinery", state["data"], push_history=False)
+        return
+    if len(message_text) < 2:
+        client.send_message(to=user_id, text="❌ Введите название трактора (мин. 2 символа) или нажмите Назад.", buttons=BACK_BUTTONS)
+        return
+    machinery = message_text
+    work_data = state.get("data", {}).get("work", {})
+    work_data["machinery"] = machinery
+    work_data["date"] = state.get("data", {}).get("date", date.today().isoformat())
+    work_data["work_type"] = "tractor"
+    state["data"]["work"] = work_data
+    set_state(user_id, "work_tractor_activity", state["data"], push_history=True, back_callback="work:tractor:machinery")
+
+    lines = ["Выберите *вид деятельности* (отправьте номер):"]
+    for i, a in enumerate(ACTIVITIES_TRACTOR, 1):
+        lines.append(f"{i}. {a}")
+    client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+
+def _state_work_tractor_activity(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Трактор: выбор вида работы."""
+    if message_text == "0":
+        # Назад к выбору трактора
+        lines = ["Выберите *трактор* (отправьте номер):"]
+        for i, m in enumerate(TRACTORS, 1):
+            lines.append(f"{i}. {m}")
+        client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+        set_state(user_id, "work_tractor_machinery", state["data"], push_history=False)
+        return
+    choice = _parse_uint(message_text)
+    if choice is None:
+        client.send_message(to=user_id, text="❌ Введите номер вида деятельности или используйте кнопку Назад.", buttons=BACK_BUTTONS)
+        return
+    if not (1 <= choice <= len(ACTIVITIES_TRACTOR)):
+        client.send_message(to=user_id, text="❌ Неверный номер. Введите номер из списка или нажмите Назад.", buttons=BACK_BUTTONS)
+        return
+    # Прочее -> свободный ввод
+    if choice == len(ACTIVITIES_TRACTOR) and ACTIVITIES_TRACTOR[choice - 1].lower() == "прочее":
+        set_state(user_id, "work_tractor_activity_custom", state["data"], push_history=False)
+        client.send_message(to=user_id, text="📝 Введите *вид деятельности* текстом:", buttons=BACK_BUTTONS)
+        return
+    activity = ACTIVITIES_TRACTOR[choice - 1]
+    work_data = state.get("data", {}).get("work", {})
+    work_data["activity_base"] = activity
+    work_data["grp"] = GROUP_TECH
+    state["data"]["work"] = work_data
+    set_state(user_id, "work_tractor_field", state["data"], push_history=True, back_callback="work:tractor:activity")
+
+    locations = list_locations_with_id(GROUP_FIELDS)
+    state["data"]["locs"] = locations
+    lines = ["Выберите *поле* (отправьте номер):"]
+    for i, (_, name) in enumerate(locations, 1):
+        lines.append(f"{i}. {name}")
+    client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+
+def _state_work_tractor_field(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Трактор: выбор поля."""
+    if message_text == "0":
+        # Назад к выбору вида деятельности
+        lines = ["Выберите *вид деятельности* (отправьте номер):"]
+        for i, a in enumerate(ACTIVITIES_TRACTOR, 1):
+            lines.append(f"{i}. {a}")
+        client.send_message(to=user_id, text="\n".join(lines) + "\n\n0. 🔙 Назад")
+        set_state(user_id, "work_tractor_activity", state["data"], push_history=False)
+        return
+    locs = state.get("data", {}).get("locs", [])
+    found_loc = None
+    num = _parse_uint(message_text)
+    if num is not None:
+        idx = num - 1
+        if 0 <= idx < len(locs):
+            found_loc = locs[idx][1]
+    if not found_loc:
+        # allow exact name
+        for _, name in locs:
+            if name.lower() == message_text.lower():
+                found_loc = name
+                break
+    if not found_loc:
+        client.send_message(to=user_id, text="❌ Не найдено. Введите номер или точное название из списка, или 0.")
+        return
+    work_data = state.get("data", {}).get("work", {})
+    work_data["location"] = found_loc
+    work_data["loc_grp"] = GROUP_FIELDS
+    state["data"]["work"] = work_data
+    set_state(user_id, "work_tractor_crop", state["data"], push_history=True, back_callback="work:tractor:field")
+
+    lines = ["Выберите *культуру* (отправьте номер):"]
+    for i, c in enumerate(CROPS, 1):
+        lines.append(f"{i}. {c}")
+    client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+
+def _state_work_tractor_crop(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Трактор: выбор культуры."""
+    if message_text == "0":
+        # Назад к выбору поля
+        locations = state.get("data", {}).get("locs", [])
+        lines = ["Выберите *поле* (отправьте номер):"]
+        for i, (_, name) in enumerate(locations, 1):
+            lines.append(f"{i}. {name}")
+        client.send_message(to=user_id, text="\n".join(lines) + "\n\n0. 🔙 Назад")
+        set_state(user_id, "work_tractor_field", state["data"], push_history=False)
+        return
+    choice = int(message_text)
+    if not (1 <= choice <= len(CROPS)):
+        client.send_message(to=user_id, text="❌ Неверный номер. Введите номер из списка или 0.")
+        return
+    selected_crop = CROPS[choice - 1]
+    # Прочее -> свободный ввод
+    if selected_crop.lower() == "прочее":
+        set_state(user_id, "work_tractor_crop_custom", state["data"], push_history=False)
+        client.send_message(to=user_id, text="📝 Введите *культуру* текстом:", buttons=BACK_BUTTONS)
+        return
+    crop = selected_crop
+    work_data = state.get("data", {}).get("work", {})
+    work_data["crop"] = crop
+    # Формируем activity строку с деталями
+    machinery = work_data.get("machinery", "Трактор")
+    activity_base = work_data.get("activity_base", "Работа")
+    work_data["activity"] = f"Трактор {machinery} — {activity_base} — {crop}"
+    work_data["act_grp"] = GROUP_TECH
+    # Сохраняем и переходим к вводу часов
+    state["data"]["work"] = work_data
+    prefilled = state["data"].get("prefilled_hours")
+    if prefilled:
+        _build_worker_confirmation(client, user_id, state, prefilled)
+    else:
+        set_state(user_id, "waiting_hours", state["data"], push_history=True, back_callback="work:tractor:crop")
+
+        work_date = work_data.get("date", date.today().isoformat())
+        current_sum = sum_hours_for_user_date(user_id, work_date)
+        d_str = _iso_to_ddmmyyyy(work_date)
+        text = (
+            f"📅 Дата: *{d_str}*\n"
+            f"🚜 {machinery}\n"
+            f"🔧 {activity_base}\n"
+            f"🌱 {crop}\n"
+            f"📍 {work_data.get('location','')}\n"
+            f"📊 Уже внесено: *{current_sum}* ч\n\n"
+            f"Введите *количество часов*:"
+        )
+        quick_replies = [{"id": "back_to_loc", "title": "🔙 Назад"}]
+        client.send_text_with_quick_replies(to=user_id, text=text, quick_replies=quick_replies)
 
+def _state_work_tractor_crop_custom(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Трактор: своя культура."""
+    if message_text == "0":
+        # Назад к выбору культуры
         lines = ["Выберите *культуру* (отправьте номер):"]
         for i, c in enumerate(CROPS, 1):
             lines.append(f"{i}. {c}")
-        client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
+        client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+        set_state(user_id, "work_tractor_crop", state["data"], push_history=True, back_callback="work:tractor:field")
         return
-
-    if current_state == "work_tractor_crop":
-        if message_text == "0":
-            # Назад к выбору поля
-            locations = state.get("data", {}).get("locs", [])
-            lines = ["Выберите *поле* (отправьте номер):"]
-            for i, (_, name) in enumerate(locations, 1):
-                lines.append(f"{i}. {name}")
-            client.send_message(to=user_id, text="\n".join(lines) + "\n\n0. 🔙 Назад")
-            set_state(user_id, "work_tractor_field", state["data"], save_to_history=False)
-            return
-        if not message_text.isdigit():
-            client.send_message(to=user_id, text="❌ Введите номер культуры или 0 для возврата.")
-            return
-        choice = int(message_text)
-        if not (1 <= choice <= len(CROPS)):
-            client.send_message(to=user_id, text="❌ Неверный номер. Введите номер из списка или 0.")
-            return
-        selected_crop = CROPS[choice - 1]
-        # Прочее -> свободный ввод
-        if selected_crop.lower() == "прочее":
-            set_state(user_id, "work_tractor_crop_custom", state["data"], save_to_history=False)
-            client.send_message(to=user_id, text="📝 Введите *культуру* текстом:", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            return
-        crop = selected_crop
-        work_data = state.get("data", {}).get("work", {})
-        work_data["crop"] = crop
-        # Формируем activity строку с деталями
-        machinery = work_data.get("machinery", "Трактор")
-        activity_base = work_data.get("activity_base", "Работа")
-        work_data["activity"] = f"Трактор {machinery} — {activity_base} — {crop}"
-        work_data["act_grp"] = GROUP_TECH
-        # Сохраняем и переходим к вводу часов
-        state["data"]["work"] = work_data
-        prefilled = state["data"].get("prefilled_hours")
-        if prefilled:
-            _build_worker_confirmation(client, user_id, state, prefilled)
-        else:
-            set_state(user_id, "waiting_hours", state["data"], save_to_history=True, back_callback="work:tractor:crop")
-
-            work_date = work_data.get("date", date.today().isoformat())
-            current_sum = sum_hours_for_user_date(user_id, work_date)
-            d_str = date.fromisoformat(work_date).strftime("%d.%m.%Y")
-            text = (
-                f"📅 Дата: *{d_str}*\n"
-                f"🚜 {machinery}\n"
-                f"🔧 {activity_base}\n"
-                f"🌱 {crop}\n"
-                f"📍 {work_data.get('location','')}\n"
-                f"📊 Уже внесено: *{current_sum}* ч\n\n"
-                f"Введите *количество часов*:"
-            )
-            quick_replies = [{"id": "back_to_loc", "title": "🔙 Назад"}]
-            client.send_text_with_quick_replies(to=user_id, text=text, quick_replies=quick_replies)
+    if len(message_text) < 2:
+        client.send_message(to=user_id, text="❌ Введите название культуры (минимум 2 символа) или нажмите Назад.", buttons=BACK_BUTTONS)
         return
+    crop = message_text
+    work_data = state.get("data", {}).get("work", {})
+    work_data["crop"] = crop
+    machinery = work_data.get("machinery", "Трактор")
+    activity_base = work_data.get("activity_base", "Работа")
+    work_data["activity"] = f"Трактор {machinery} — {activity_base} — {crop}"
+    work_data["act_grp"] = GROUP_TECH
+    state["data"]["work"] = work_data
+    prefilled = state["data"].get("prefilled_hours")
+    if prefilled:
+        _build_worker_confirmation(client, user_id, state, prefilled)
+    else:
+        set_state(user_id, "waiting_hours", state["data"], push_history=True, back_callback="work:tractor:crop")
 
-    if current_state == "work_tractor_crop_custom":
-        if message_text == "0":
-            # Назад к выбору культуры
-            lines = ["Выберите *культуру* (отправьте номер):"]
-            for i, c in enumerate(CROPS, 1):
-                lines.append(f"{i}. {c}")
-            client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            set_state(user_id, "work_tractor_crop", state["data"], save_to_history=True, back_callback="work:tractor:field")
-            return
-        if len(message_text.strip()) < 2:
-            client.send_message(to=user_id, text="❌ Введите название культуры (минимум 2 символа) или нажмите Назад.", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            return
-        crop = message_text.strip()
-        work_data = state.get("data", {}).get("work", {})
-        work_data["crop"] = crop
-        machinery = work_data.get("machinery", "Трактор")
-        activity_base = work_data.get("activity_base", "Работа")
-        work_data["activity"] = f"Трактор {machinery} — {activity_base} — {crop}"
-        work_data["act_grp"] = GROUP_TECH
-        state["data"]["work"] = work_data
-        prefilled = state["data"].get("prefilled_hours")
-        if prefilled:
-            _build_worker_confirmation(client, user_id, state, prefilled)
-        else:
-            set_state(user_id, "waiting_hours", state["data"], save_to_history=True, back_callback="work:tractor:crop")
+        work_date = work_data.get("date", date.today().isoformat())
+        current_sum = sum_hours_for_user_date(user_id, work_date)
+        d_str = _iso_to_ddmmyyyy(work_date)
+        text = (
+            f"📅 Дата: *{d_str}*\n"
+            f"🚜 {machinery}\n"
+            f"🔧 {activity_base}\n"
+            f"🌱 {crop}\n"
+            f"📍 {work_data.get('location','')}\n"
+            f"📊 Уже внесено: *{current_sum}* ч\n\n"
+            f"Введите *количество часов*:"
+        )
+        quick_replies = [{"id": "back_to_loc", "title": "🔙 Назад"}]
+        client.send_text_with_quick_replies(to=user_id, text=text, quick_replies=quick_replies)
 
-            work_date = work_data.get("date", date.today().isoformat())
-            current_sum = sum_hours_for_user_date(user_id, work_date)
-            d_str = date.fromisoformat(work_date).strftime("%d.%m.%Y")
-            text = (
-                f"📅 Дата: *{d_str}*\n"
-                f"🚜 {machinery}\n"
-                f"🔧 {activity_base}\n"
-                f"🌱 {crop}\n"
-                f"📍 {work_data.get('location','')}\n"
-                f"📊 Уже внесено: *{current_sum}* ч\n\n"
-                f"Введите *количество часов*:"
-            )
-            quick_replies = [{"id": "back_to_loc", "title": "🔙 Назад"}]
-            client.send_text_with_quick_replies(to=user_id, text=text, quick_replies=quick_replies)
+def _state_work_kamaz_crop(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """КамАЗ: выбор культуры."""
+    if message_text == "0":
+        # Назад к выбору техники
+        buttons = [
+            Button(title="🚜 Трактор", callback_data="work:type:tractor"),
+            Button(title="🚛 КамАЗ", callback_data="work:type:kamaz"),
+            BTN_BACK,
+        ]
+        client.send_message(to=user_id, text="Выберите *технику*:", buttons=buttons)
         return
-
-    if current_state == "work_kamaz_crop":
-        if message_text == "0":
-            # Назад к выбору техники
-            buttons = [
-                Button(title="🚜 Трактор", callback_data="work:type:tractor"),
-                Button(title="🚛 КамАЗ", callback_data="work:type:kamaz"),
-                Button(title="🔙 Назад", callback_data="back:prev"),
-            ]
-            client.send_message(to=user_id, text="Выберите *технику*:", buttons=buttons)
-            return
-        if not message_text.isdigit():
-            client.send_message(to=user_id, text="❌ Введите номер культуры или используйте кнопку Назад.", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            return
-        choice = int(message_text)
-        if not (1 <= choice <= len(CROPS_KAMAZ)):
-            client.send_message(to=user_id, text="❌ Неверный номер. Введите номер из списка или нажмите Назад.", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            return
-        selected_crop = CROPS_KAMAZ[choice - 1]
-        if selected_crop.lower() == "прочее":
-            set_state(user_id, "work_kamaz_crop_custom", state["data"], save_to_history=False)
-            client.send_message(to=user_id, text="📝 Введите *культуру* текстом:", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            return
-        crop = selected_crop
-        work_data = state.get("data", {}).get("work", {})
-        work_data["crop"] = crop
-        work_data["work_type"] = "kamaz"
-        work_data["grp"] = GROUP_KAMAZ
-        state["data"]["work"] = work_data
-        set_state(user_id, "work_kamaz_trips", state["data"], save_to_history=False)
-        client.send_message(to=user_id, text="Введите *количество рейсов* (число):", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
+    choice = _parse_uint(message_text)
+    if choice is None:
+        client.send_message(to=user_id, text="❌ Введите номер культуры или используйте кнопку Назад.", buttons=BACK_BUTTONS)
+        return
+    if not (1 <= choice <= len(CROPS_KAMAZ)):
+        client.send_message(to=user_id, text="❌ Неверный номер. Введите номер из списка или нажмите Назад.", buttons=BACK_BUTTONS)
+        return
+    selected_crop = CROPS_KAMAZ[choice - 1]
+    if selected_crop.lower() == "прочее":
+        set_state(user_id, "work_kamaz_crop_custom", state["data"], push_history=False)
+        client.send_message(to=user_id, text="📝 Введите *культуру* текстом:", buttons=BACK_BUTTONS)
         return
+    crop = selected_crop
+    work_data = state.get("data", {}).get("work", {})
+    work_data["crop"] = crop
+    work_data["work_type"] = "kamaz"
+    work_data["grp"] = GROUP_KAMAZ
+    state["data"]["work"] = work_data
+    set_state(user_id, "work_kamaz_trips", state["data"], push_history=False)
+    client.send_message(to=user_id, text="Введите *количество рейсов* (число):", buttons=BACK_BUTTONS)
+
+def _state_work_kamaz_trips(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """КамАЗ: количество рейсов."""
+    if message_text == "0":
+        # Назад к выбору культуры
+        lines = ["Выберите *культуру* (отправьте номер):"]
+        for i, c in enumerate(CROPS_KAMAZ, 1):
+            lines.append(f"{i}. {c}")
+        client.send_message(to=user_id, text="\n".join(lines) + "\n\n0. 🔙 Назад")
+        set_state(user_id, "work_kamaz_crop", state["data"], push_history=False)
+        return
+    trips = int(message_text)
+    if trips <= 0:
+        client.send_message(to=user_id, text="❌ Число рейсов должно быть больше 0.")
+        return
+    work_data = state.get("data", {}).get("work", {})
+    work_data["trips"] = trips
+    state["data"]["work"] = work_data
+    set_state(user_id, "work_kamaz_loading", state["data"], push_history=False)
+
+    locations = list_locations_with_id(GROUP_FIELDS)
+    state["data"]["locs"] = locations
+    lines = ["Выберите *место погрузки* (номер):"]
+    for i, (_, name) in enumerate(locations, 1):
+        lines.append(f"{i}. {name}")
+    lines.append(f"{len(locations)+1}. Склад")
+    lines.append(f"{len(locations)+2}. Прочее")
+    client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+
+def _state_work_kamaz_loading(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """КамАЗ: место погрузки."""
+    if message_text == "0":
+        # Назад к вводу рейсов
+        client.send_message(to=user_id, text="Введите *количество рейсов* (число):\n\n0. 🔙 Назад")
+        set_state(user_id, "work_kamaz_trips", state["data"], push_history=False)
+        return
+    locs = state.get("data", {}).get("locs", [])
+    extra1 = len(locs) + 1  # склад
+    extra2 = len(locs) + 2  # прочее
+    chosen = None
+    idx = _parse_uint(message_text)
+    if idx is not None:
+        if 1 <= idx <= len(locs):
+            chosen = locs[idx-1][1]
+        elif idx == extra1:
+            chosen = "Склад"
+        elif idx == extra2:
+            # Прочее -> свободный ввод
+            set_state(user_id, "work_kamaz_loading_custom", state["data"], push_history=False)
+            client.send_message(to=user_id, text="Введите *место погрузки* текстом:", buttons=BACK_BUTTONS)
+            return
+    if not chosen:
+        # allow exact name
+        for _, name in locs:
+            if name.lower() == message_text.lower():
+                chosen = name
+                break
+        if message_text.lower() == "склад":
+            chosen = "Склад"
+    if not chosen:
+        client.send_message(to=user_id, text="❌ Не найдено. Введите номер из списка или 0.")
+        return
+    work_data = state.get("data", {}).get("work", {})
+    work_data["location"] = chosen
+    work_data["loc_grp"] = GROUP_FIELDS if chosen != "Склад" else GROUP_WARE
+    # Формируем activity строку
+    crop = work_data.get("crop", "Груз")
+    trips = work_data.get("trips")
+    work_data["activity"] = f"КамАЗ — {crop} — {trips} рейсов"
+    work_data["act_grp"] = GROUP_KAMAZ
+    state["data"]["work"] = work_data
+    prefilled = state["data"].get("prefilled_hours")
+    if prefilled:
+        _build_worker_confirmation(client, user_id, state, prefilled)
+    else:
+        set_state(user_id, "waiting_hours", state["data"], push_history=False)
 
-    if current_state == "work_kamaz_trips":
-        if message_text == "0":
-            # Назад к выбору культуры
-            lines = ["Выберите *культуру* (отправьте номер):"]
-            for i, c in enumerate(CROPS_KAMAZ, 1):
-                lines.append(f"{i}. {c}")
-            client.send_message(to=user_id, text="\n".join(lines) + "\n\n0. 🔙 Назад")
-            set_state(user_id, "work_kamaz_crop", state["data"], save_to_history=False)
-            return
-        if not message_text.isdigit():
-            client.send_message(to=user_id, text="❌ Введите число рейсов или 0 для возврата.")
-            return
-        trips = int(message_text)
-        if trips <= 0:
-            client.send_message(to=user_id, text="❌ Число рейсов должно быть больше 0.")
-            return
-        work_data = state.get("data", {}).get("work", {})
-        work_data["trips"] = trips
-        state["data"]["work"] = work_data
-        set_state(user_id, "work_kamaz_loading", state["data"], save_to_history=False)
+        work_date = work_data.get("date", date.today().isoformat())
+        current_sum = sum_hours_for_user_date(user_id, work_date)
+        d_str = _iso_to_ddmmyyyy(work_date)
+        text = (
+            f"📅 Дата: *{d_str}*\n"
+            f"🚛 КамАЗ\n"
+            f"📦 {crop} — {trips} рейсов\n"
+            f"📍 {chosen}\n"
+            f"📊 Уже внесено: *{current_sum}* ч\n\n"
+            f"Введите *количество часов*:"
+        )
+        quick_replies = [{"id": "back_to_loc", "title": "🔙 Назад"}]
+        client.send_text_with_quick_replies(to=user_id, text=text, quick_replies=quick_replies)
 
-        locations = list_locations_with_id(GROUP_FIELDS)
-        state["data"]["locs"] = locations
+def _state_work_kamaz_loading_custom(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """КамАЗ: свое место погрузки."""
+    if message_text == "0":
+        # Назад к выбору места
+        locations = state.get("data", {}).get("locs", [])
         lines = ["Выберите *место погрузки* (номер):"]
         for i, (_, name) in enumerate(locations, 1):
             lines.append(f"{i}. {name}")
         lines.append(f"{len(locations)+1}. Склад")
         lines.append(f"{len(locations)+2}. Прочее")
-        client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
+        client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+        set_state(user_id, "work_kamaz_loading", state["data"], push_history=False)
         return
+    work_data = state.get("data", {}).get("work", {})
+    work_data["location"] = message_text
+    work_data["loc_grp"] = GROUP_FIELDS
+    crop = work_data.get("crop", "Груз")
+    trips = work_data.get("trips")
+    work_data["activity"] = f"КамАЗ — {crop} — {trips} рейсов"
+    work_data["act_grp"] = GROUP_KAMAZ
+    state["data"]["work"] = work_data
+    prefilled = state["data"].get("prefilled_hours")
+    if prefilled:
+        _build_worker_confirmation(client, user_id, state, prefilled)
+    else:
+        set_state(user_id, "waiting_hours", state["data"], push_history=False)
 
-    if current_state == "work_kamaz_loading":
-        if message_text == "0":
-            # Назад к вводу рейсов
-            client.send_message(to=user_id, text="Введите *количество рейсов* (число):\n\n0. 🔙 Назад")
-            set_state(user_id, "work_kamaz_trips", state["data"], save_to_history=False)
-            return
-        locs = state.get("data", {}).get("locs", [])
-        extra1 = len(locs) + 1  # склад
-        extra2 = len(locs) + 2  # прочее
-        chosen = None
-        if message_text.isdigit():
-            idx = int(message_text)
-            if 1 <= idx <= len(locs):
-                chosen = locs[idx-1][1]
-            elif idx == extra1:
-                chosen = "Склад"
-            elif idx == extra2:
-                # Прочее -> свободный ввод
-                set_state(user_id, "work_kamaz_loading_custom", state["data"], save_to_history=False)
-                client.send_message(to=user_id, text="Введите *место погрузки* текстом:", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-                return
-        if not chosen:
-            # allow exact name
-            for _, name in locs:
-                if name.lower() == message_text.lower():
-                    chosen = name
-                    break
-            if message_text.lower() == "склад":
-                chosen = "Склад"
-        if not chosen:
-            client.send_message(to=user_id, text="❌ Не найдено. Введите номер из списка или 0.")
-            return
-        work_data = state.get("data", {}).get("work", {})
-        work_data["location"] = chosen
-        work_data["loc_grp"] = GROUP_FIELDS if chosen != "Склад" else GROUP_WARE
-        # Формируем activity строку
-        crop = work_data.get("crop", "Груз")
-        trips = work_data.get("trips")
-        work_data["activity"] = f"КамАЗ — {crop} — {trips} рейсов"
-        work_data["act_grp"] = GROUP_KAMAZ
-        state["data"]["work"] = work_data
-        prefilled = state["data"].get("prefilled_hours")
-        if prefilled:
-            _build_worker_confirmation(client, user_id, state, prefilled)
-        else:
-            set_state(user_id, "waiting_hours", state["data"], save_to_history=False)
+        work_date = work_data.get("date", date.today().isoformat())
+        current_sum = sum_hours_for_user_date(user_id, work_date)
+        d_str = _iso_to_ddmmyyyy(work_date)
+        text = (
+            f"📅 Дата: *{d_str}*\n"
+            f"🚛 КамАЗ\n"
+            f"📦 {crop} — {trips} рейсов\n"
+            f"📍 {work_data['location']}\n"
+            f"📊 Уже внесено: *{current_sum}* ч\n\n"
+            f"Введите *количество часов*:"
+        )
+        quick_replies = [{"id": "back_to_loc", "title": "🔙 Назад"}]
+        client.send_text_with_quick_replies(to=user_id, text=text, quick_replies=quick_replies)
 
-            work_date = work_data.get("date", date.today().isoformat())
-            current_sum = sum_hours_for_user_date(user_id, work_date)
-            d_str = date.fromisoformat(work_date).strftime("%d.%m.%Y")
-            text = (
-                f"📅 Дата: *{d_str}*\n"
-                f"🚛 КамАЗ\n"
-                f"📦 {crop} — {trips} рейсов\n"
-                f"📍 {chosen}\n"
-                f"📊 Уже внесено: *{current_sum}* ч\n\n"
-                f"Введите *количество часов*:"
-            )
-            quick_replies = [{"id": "back_to_loc", "title": "🔙 Назад"}]
-            client.send_text_with_quick_replies(to=user_id, text=text, quick_replies=quick_replies)
+def _state_work_kamaz_crop_custom(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """КамАЗ: своя культура."""
+    if message_text == "0":
+        # Назад к выбору культуры
+        lines = ["Выберите *культуру* (отправьте номер):"]
+        for i, c in enumerate(CROPS_KAMAZ, 1):
+            lines.append(f"{i}. {c}")
+        client.send_message(to=user_id, text="\n".join(lines) + "\n\n0. 🔙 Назад")
+        set_state(user_id, "work_kamaz_crop", state["data"], push_history=False)
         return
-
-    if current_state == "work_kamaz_loading_custom":
-        if message_text == "0":
-            # Назад к выбору места
-            locations = state.get("data", {}).get("locs", [])
-            lines = ["Выберите *место погрузки* (номер):"]
-            for i, (_, name) in enumerate(locations, 1):
-                lines.append(f"{i}. {name}")
-            lines.append(f"{len(locations)+1}. Склад")
-            lines.append(f"{len(locations)+2}. Прочее")
-            client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            set_state(user_id, "work_kamaz_loading", state["data"], save_to_history=False)
-            return
-        work_data = state.get("data", {}).get("work", {})
-        work_data["location"] = message_text.strip()
-        work_data["loc_grp"] = GROUP_FIELDS
-        crop = work_data.get("crop", "Груз")
-        trips = work_data.get("trips")
-        work_data["activity"] = f"КамАЗ — {crop} — {trips} рейсов"
-        work_data["act_grp"] = GROUP_KAMAZ
-        state["data"]["work"] = work_data
-        prefilled = state["data"].get("prefilled_hours")
-        if prefilled:
-            _build_worker_confirmation(client, user_id, state, prefilled)
-        else:
-            set_state(user_id, "waiting_hours", state["data"], save_to_history=False)
-
-            work_date = work_data.get("date", date.today().isoformat())
-            current_sum = sum_hours_for_user_date(user_id, work_date)
-            d_str = date.fromisoformat(work_date).strftime("%d.%m.%Y")
-            text = (
-                f"📅 Дата: *{d_str}*\n"
-                f"🚛 КамАЗ\n"
-                f"📦 {crop} — {trips} рейсов\n"
-                f"📍 {work_data['location']}\n"
-                f"📊 Уже внесено: *{current_sum}* ч\n\n"
-                f"Введите *количество часов*:"
-            )
-            quick_replies = [{"id": "back_to_loc", "title": "🔙 Назад"}]
-            client.send_text_with_quick_replies(to=user_id, text=text, quick_replies=quick_replies)
+    if len(message_text) < 2:
+        client.send_message(to=user_id, text="❌ Введите название культуры (минимум 2 символа) или 0 для возврата.")
         return
-
-    if current_state == "work_kamaz_crop_custom":
-        if message_text == "0":
-            # Назад к выбору культуры
-            lines = ["Выберите *культуру* (отправьте номер):"]
-            for i, c in enumerate(CROPS_KAMAZ, 1):
-                lines.append(f"{i}. {c}")
-            client.send_message(to=user_id, text="\n".join(lines) + "\n\n0. 🔙 Назад")
-            set_state(user_id, "work_kamaz_crop", state["data"], save_to_history=False)
-            return
-        if len(message_text.strip()) < 2:
-            client.send_message(to=user_id, text="❌ Введите название культуры (минимум 2 символа) или 0 для возврата.")
-            return
-        crop = message_text.strip()
-        work_data = state.get("data", {}).get("work", {})
-        work_data["crop"] = crop
-        work_data["work_type"] = "kamaz"
-        work_data["grp"] = GROUP_KAMAZ
-        state["data"]["work"] = work_data
-        set_state(user_id, "work_kamaz_trips", state["data"], save_to_history=False)
-        client.send_message(to=user_id, text="Введите *количество рейсов* (число):", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
+    crop = message_text
+    work_data = state.get("data", {}).get("work", {})
+    work_data["crop"] = crop
+    work_data["work_type"] = "kamaz"
+    work_data["grp"] = GROUP_KAMAZ
+    state["data"]["work"] = work_data
+    set_state(user_id, "work_kamaz_trips", state["data"], push_history=False)
+    client.send_message(to=user_id, text="Введите *количество рейсов* (число):", buttons=BACK_BUTTONS)
+
+def _state_work_manual_activity(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Ручная: выбор вида работы."""
+    if message_text == "0":
+        # Назад к выбору типа работы
+        buttons = [
+            Button(title="🚜 Трактор", callback_data="work:type:tractor"),
+            Button(title="🚛 КамАЗ", callback_data="work:type:kamaz"),
+            Button(title="✋ Ручная", callback_data="work:type:manual"),
+            BTN_BACK,
+        ]
+        client.send_message(to=user_id, text="Выберите *тип работы*:", buttons=buttons)
         return
-
-    if current_state == "work_manual_activity":
-        if message_text == "0":
-            # Назад к выбору типа работы
-            buttons = [
-                Button(title="🚜 Трактор", callback_data="work:type:tractor"),
-                Button(title="🚛 КамАЗ", callback_data="work:type:kamaz"),
-                Button(title="✋ Ручная", callback_data="work:type:manual"),
-                Button(title="🔙 Назад", callback_data="back:prev"),
-            ]
-            client.send_message(to=user_id, text="Выберите *тип работы*:", buttons=buttons)
-            return
-        if not message_text.isdigit():
-            client.send_message(to=user_id, text="❌ Введите номер вида работы или используйте кнопку Назад.", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            return
-        choice = int(message_text)
-        if not (1 <= choice <= len(ACTIVITIES_MANUAL)):
-            client.send_message(to=user_id, text="❌ Неверный номер. Введите номер из списка или нажмите Назад.", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
+    choice = _parse_uint(message_text)
+    if choice is None:
+        client.send_message(to=user_id, text="❌ Введите номер вида работы или используйте кнопку Назад.", buttons=BACK_BUTTONS)
+        return
+    if not (1 <= choice <= len(ACTIVITIES_MANUAL)):
+        client.send_message(to=user_id, text="❌ Неверный номер. Введите номер из списка или нажмите Назад.", buttons=BACK_BUTTONS)
+        return
+    if choice == len(ACTIVITIES_MANUAL) and ACTIVITIES_MANUAL[choice - 1].lower() == "прочее":
+        set_state(user_id, "work_manual_activity_custom", state["data"], push_history=True, back_callback="work:manual:activity")
+        client.send_message(to=user_id, text="📝 Введите *вид работы* текстом:", buttons=BACK_BUTTONS)
+        return
+    activity = ACTIVITIES_MANUAL[choice - 1]
+    work_data = state.get("data", {}).get("work", {})
+    work_data["activity_base"] = activity
+    work_data["grp"] = GROUP_HAND
+    work_data["work_type"] = "manual"
+    state["data"]["work"] = work_data
+    set_state(user_id, "work_manual_field", state["data"], push_history=True, back_callback="work:manual:activity")
+
+    locations = list_locations_with_id(GROUP_FIELDS)
+    state["data"]["locs"] = locations
+    lines = build_manual_location_lines(locations)
+    client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+
+def _state_work_manual_activity_custom(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Ручная: свой вариант работы."""
+    if message_text == "0":
+        # Назад к списку
+        lines = ["Выберите *вид работы* (отправьте номер):"]
+        for i, a in enumerate(ACTIVITIES_MANUAL, 1):
+            lines.append(f"{i}. {a}")
+        client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+        set_state(user_id, "work_manual_activity", state["data"], push_history=False)
+        return
+    if len(message_text) < 2:
+        client.send_message(to=user_id, text="❌ Введите название работы (минимум 2 символа) или нажмите Назад.", buttons=BACK_BUTTONS)
+        return
+    work_data = state.get("data", {}).get("work", {})
+    work_data["activity_base"] = message_text
+    work_data["grp"] = GROUP_HAND
+    work_data["work_type"] = "manual"
+    state["data"]["work"] = work_data
+    set_state(user_id, "work_manual_field", state["data"], push_history=True, back_callback="work:manual:activity")
+
+    locations = list_locations_with_id(GROUP_FIELDS)
+    state["data"]["locs"] = locations
+    lines = build_manual_location_lines(locations)
+    client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+
+def _state_work_manual_field(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Ручная: выбор локации."""
+    if message_text == "0":
+        # Назад к выбору вида работы
+        lines = ["Выберите *вид работы* (отправьте номер):"]
+        for i, a in enumerate(ACTIVITIES_MANUAL, 1):
+            lines.append(f"{i}. {a}")
+        client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+        set_state(user_id, "work_manual_activity", state["data"], push_history=False)
+        return
+    locs = state.get("data", {}).get("locs", [])
+    found_loc = None
+    chosen_loc_grp = GROUP_FIELDS
+    choice = _parse_uint(message_text)
+    if choice is not None:
+        if choice == 1:
+            found_loc = "Склад"
+            chosen_loc_grp = GROUP_WARE
+        elif choice == 2:
+            set_state(user_id, "work_manual_field_custom", state["data"], push_history=True, back_callback="work:manual:field")
+            client.send_message(to=user_id, text="Введите *локацию* текстом:", buttons=BACK_BUTTONS)
             return
-        if choice == len(ACTIVITIES_MANUAL) and ACTIVITIES_MANUAL[choice - 1].lower() == "прочее":
-            set_state(user_id, "work_manual_activity_custom", state["data"], save_to_history=True, back_callback="work:manual:activity")
-            client.send_message(to=user_id, text="📝 Введите *вид работы* текстом:", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
+        else:
+            idx = choice - 3
+            if 0 <= idx < len(locs):
+                found_loc = locs[idx][1]
+    if not found_loc:
+        for _, name in locs:
+            if name.lower() == message_text.lower():
+                found_loc = name
+                break
+        if message_text.lower() == "склад":
+            found_loc = "Склад"
+            chosen_loc_grp = GROUP_WARE
+        elif message_text.lower() == "прочее":
+            set_state(user_id, "work_manual_field_custom", state["data"], push_history=True, back_callback="work:manual:field")
+            client.send_message(to=user_id, text="Введите *локацию* текстом:", buttons=BACK_BUTTONS)
+            return
+    if not found_loc:
+        client.send_message(to=user_id, text="❌ Не найдено. Введите номер или точное название из списка, или 0.")
+        return
+    work_data = state.get("data", {}).get("work", {})
+    work_data["location"] = found_loc
+    work_data["loc_grp"] = chosen_loc_grp
+    state["data"]["work"] = work_data
+    set_state(user_id, "work_manual_crop", state["data"], push_history=True, back_callback="work:manual:field")
+
+    lines = ["Выберите *культуру* (отправьте номер):"]
+    for i, c in enumerate(CROPS, 1):
+        lines.append(f"{i}. {c}")
+    client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+
+def _state_work_manual_field_custom(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Ручная: своя локация."""
+    if message_text == "0":
+        if go_back(client, user_id):
             return
-        activity = ACTIVITIES_MANUAL[choice - 1]
-        work_data = state.get("data", {}).get("work", {})
-        work_data["activity_base"] = activity
-        work_data["grp"] = GROUP_HAND
-        work_data["work_type"] = "manual"
-        state["data"]["work"] = work_data
-        set_state(user_id, "work_manual_field", state["data"], save_to_history=True, back_callback="work:manual:activity")
-
-        locations = list_locations_with_id(GROUP_FIELDS)
-        state["data"]["locs"] = locations
+        locations = state.get("data", {}).get("locs", [])
         lines = build_manual_location_lines(locations)
-        client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
+        client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+        set_state(user_id, "work_manual_field", state["data"], push_history=False)
         return
-
-    if current_state == "work_manual_activity_custom":
-        if message_text == "0":
-            # Назад к списку
-            lines = ["Выберите *вид работы* (отправьте номер):"]
-            for i, a in enumerate(ACTIVITIES_MANUAL, 1):
-                lines.append(f"{i}. {a}")
-            client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            set_state(user_id, "work_manual_activity", state["data"], save_to_history=False)
-            return
-        if len(message_text.strip()) < 2:
-            client.send_message(to=user_id, text="❌ Введите название работы (минимум 2 символа) или нажмите Назад.", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            return
-        work_data = state.get("data", {}).get("work", {})
-        work_data["activity_base"] = message_text.strip()
-        work_data["grp"] = GROUP_HAND
-        work_data["work_type"] = "manual"
-        state["data"]["work"] = work_data
-        set_state(user_id, "work_manual_field", state["data"], save_to_history=True, back_callback="work:manual:activity")
-
-        locations = list_locations_with_id(GROUP_FIELDS)
-        state["data"]["locs"] = locations
+    if len(message_text) < 2:
+        client.send_message(to=user_id, text="❌ Введите название локации (минимум 2 символа) или 0 для возврата.")
+        return
+    work_data = state.get("data", {}).get("work", {})
+    work_data["location"] = message_text
+    work_data["loc_grp"] = GROUP_FIELDS
+    state["data"]["work"] = work_data
+    set_state(user_id, "work_manual_crop", state["data"], push_history=True, back_callback="work:manual:field")
+
+    lines = ["Выберите *культуру* (отправьте номер):"]
+    for i, c in enumerate(CROPS, 1):
+        lines.append(f"{i}. {c}")
+    client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+
+def _state_work_manual_crop(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Ручная: выбор культуры."""
+    if message_text == "0":
+        # Назад к выбору поля
+        locations = state.get("data", {}).get("locs", [])
         lines = build_manual_location_lines(locations)
-        client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
+        client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+        set_state(user_id, "work_manual_field", state["data"], push_history=False)
+        return
+    choice = int(message_text)
+    if not (1 <= choice <= len(CROPS)):
+        client.send_message(to=user_id, text="❌ Неверный номер. Введите номер из списка или 0.")
         return
+    selected_crop = CROPS[choice - 1]
+    if selected_crop.lower() == "прочее":
+        set_state(user_id, "work_manual_crop_custom", state["data"], push_history=False)
+        client.send_message(to=user_id, text="📝 Введите *культуру* текстом:", buttons=BACK_BUTTONS)
+        return
+    crop = selected_crop
+    work_data = state.get("data", {}).get("work", {})
+    work_data["crop"] = crop
+    activity_base = work_data.get("activity_base", "Работа")
+    work_data["activity"] = f"Ручная — {activity_base} — {crop}"
+    work_data["act_grp"] = GROUP_HAND
+    state["data"]["work"] = work_data
+    prefilled = state["data"].get("prefilled_hours")
+    if prefilled:
+        _build_worker_confirmation(client, user_id, state, prefilled)
+    else:
+        set_state(user_id, "waiting_hours", state["data"], push_history=True, back_callback="work:manual:crop")
 
-    if current_state == "work_manual_field":
-        if message_text == "0":
-            # Назад к выбору вида работы
-            lines = ["Выберите *вид работы* (отправьте номер):"]
-            for i, a in enumerate(ACTIVITIES_MANUAL, 1):
-                lines.append(f"{i}. {a}")
-            client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            set_state(user_id, "work_manual_activity", state["data"], save_to_history=False)
-            return
-        locs = state.get("data", {}).get("locs", [])
-        found_loc = None
-        chosen_loc_grp = GROUP_FIELDS
-        if message_text.isdigit():
-            choice = int(message_text)
-            if choice == 1:
-                found_loc = "Склад"
-                chosen_loc_grp = GROUP_WARE
-            elif choice == 2:
-                set_state(user_id, "work_manual_field_custom", state["data"], save_to_history=True, back_callback="work:manual:field")
-                client.send_message(to=user_id, text="Введите *локацию* текстом:", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-                return
-            else:
-                idx = choice - 3
-                if 0 <= idx < len(locs):
-                    found_loc = locs[idx][1]
-        if not found_loc:
-            for _, name in locs:
-                if name.lower() == message_text.lower():
-                    found_loc = name
-                    break
-            if message_text.lower() == "склад":
-                found_loc = "Склад"
-                chosen_loc_grp = GROUP_WARE
-            elif message_text.lower() == "прочее":
-                set_state(user_id, "work_manual_field_custom", state["data"], save_to_history=True, back_callback="work:manual:field")
-                client.send_message(to=user_id, text="Введите *локацию* текстом:", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-                return
-        if not found_loc:
-            client.send_message(to=user_id, text="❌ Не найдено. Введите номер или точное название из списка, или 0.")
-            return
-        work_data = state.get("data", {}).get("work", {})
-        work_data["location"] = found_loc
-        work_data["loc_grp"] = chosen_loc_grp
-        state["data"]["work"] = work_data
-        set_state(user_id, "work_manual_crop", state["data"], save_to_history=True, back_callback="work:manual:field")
+        work_date = work_data.get("date", date.today().isoformat())
+        current_sum = sum_hours_for_user_date(user_id, work_date)
+        d_str = _iso_to_ddmmyyyy(work_date)
+        text = (
+            f"📅 Дата: *{d_str}*\n"
+            f"✋ {activity_base}\n"
+            f"🌱 {crop}\n"
+            f"📍 {work_data.get('location','')}\n"
+            f"📊 Уже внесено: *{current_sum}* ч\n\n"
+            f"Введите *количество часов*:"
+        )
+        quick_replies = [{"id": "back_to_loc", "title": "🔙 Назад"}]
+        client.send_text_with_quick_replies(to=user_id, text=text, quick_replies=quick_replies)
 
+def _state_work_manual_crop_custom(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Ручная: своя культура."""
+    if message_text == "0":
+        # Назад к выбору культуры
         lines = ["Выберите *культуру* (отправьте номер):"]
         for i, c in enumerate(CROPS, 1):
             lines.append(f"{i}. {c}")
-        client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
+        client.send_message(to=user_id, text="\n".join(lines), buttons=BACK_BUTTONS)
+        set_state(user_id, "work_manual_crop", state["data"], push_history=False)
         return
+    if len(message_text) < 2:
+        client.send_message(to=user_id, text="❌ Введите название культуры (минимум 2 символа) или нажмите Назад.", buttons=BACK_BUTTONS)
+        return
+    crop = message_text
+    work_data = state.get("data", {}).get("work", {})
+    work_data["crop"] = crop
+    activity_base = work_data.get("activity_base", "Работа")
+    work_data["activity"] = f"Ручная — {activity_base} — {crop}"
+    work_data["act_grp"] = GROUP_HAND
+    state["data"]["work"] = work_data
+    prefilled = state["data"].get("prefilled_hours")
+    if prefilled:
+        _build_worker_confirmation(client, user_id, state, prefilled)
+    else:
+        set_state(user_id, "waiting_hours", state["data"], push_history=True, back_callback="work:manual:crop")
 
-    if current_state == "work_manual_field_custom":
-        if message_text == "0":
-            if go_back(client, user_id):
-                return
-            locations = state.get("data", {}).get("locs", [])
-            lines = build_manual_location_lines(locations)
-            client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            set_state(user_id, "work_manual_field", state["data"], save_to_history=False)
-            return
-        if len(message_text.strip()) < 2:
-            client.send_message(to=user_id, text="❌ Введите название локации (минимум 2 символа) или 0 для возврата.")
-            return
-        work_data = state.get("data", {}).get("work", {})
-        work_data["location"] = message_text.strip()
-        work_data["loc_grp"] = GROUP_FIELDS
-        state["data"]["work"] = work_data
-        set_state(user_id, "work_manual_crop", state["data"], save_to_history=True, back_callback="work:manual:field")
+        work_date = work_data.get("date", date.today().isoformat())
+        current_sum = sum_hours_for_user_date(user_id, work_date)
+        d_str = _iso_to_ddmmyyyy(work_date)
+        text = (
+            f"📅 Дата: *{d_str}*\n"
+            f"✋ {activity_base}\n"
+            f"🌱 {crop}\n"
+            f"📍 {work_data.get('location','')}\n"
+            f"📊 Уже внесено: *{current_sum}* ч\n\n"
+            f"Введите *количество часов*:"
+        )
+        quick_replies = [{"id": "back_to_loc", "title": "🔙 Назад"}]
+        client.send_text_with_quick_replies(to=user_id, text=text, quick_replies=quick_replies)
 
-        lines = ["Выберите *культуру* (отправьте номер):"]
-        for i, c in enumerate(CROPS, 1):
-            lines.append(f"{i}. {c}")
-        client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
+def _state_waiting_hours_prefill(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Ввод часов для star (IT)."""
+    data = state["data"]
+    if message_text == "0":
+        show_date_selection(client, user_id, prefix="work:date")
+        return
+    hours = int(message_text)
+    if not (1 <= hours <= 24):
+        client.send_message(to=user_id, text="❌ Часы должны быть от 1 до 24 (или 0 для возврата назад).")
         return
 
-    if current_state == "work_manual_crop":
-        if message_text == "0":
-            # Назад к выбору поля
-            locations = state.get("data", {}).get("locs", [])
-            lines = build_manual_location_lines(locations)
-            client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            set_state(user_id, "work_manual_field", state["data"], save_to_history=False)
-            return
-        if not message_text.isdigit():
-            client.send_message(to=user_id, text="❌ Введите номер культуры или 0 для возврата.")
-            return
-        choice = int(message_text)
-        if not (1 <= choice <= len(CROPS)):
-            client.send_message(to=user_id, text="❌ Неверный номер. Введите номер из списка или 0.")
-            return
-        selected_crop = CROPS[choice - 1]
-        if selected_crop.lower() == "прочее":
-            set_state(user_id, "work_manual_crop_custom", state["data"], save_to_history=False)
-            client.send_message(to=user_id, text="📝 Введите *культуру* текстом:", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            return
-        crop = selected_crop
-        work_data = state.get("data", {}).get("work", {})
-        work_data["crop"] = crop
-        activity_base = work_data.get("activity_base", "Работа")
-        work_data["activity"] = f"Ручная — {activity_base} — {crop}"
-        work_data["act_grp"] = GROUP_HAND
-        state["data"]["work"] = work_data
-        prefilled = state["data"].get("prefilled_hours")
-        if prefilled:
-            _build_worker_confirmation(client, user_id, state, prefilled)
-        else:
-            set_state(user_id, "waiting_hours", state["data"], save_to_history=True, back_callback="work:manual:crop")
-
-            work_date = work_data.get("date", date.today().isoformat())
-            current_sum = sum_hours_for_user_date(user_id, work_date)
-            d_str = date.fromisoformat(work_date).strftime("%d.%m.%Y")
-            text = (
-                f"📅 Дата: *{d_str}*\n"
-                f"✋ {activity_base}\n"
-                f"🌱 {crop}\n"
-                f"📍 {work_data.get('location','')}\n"
-                f"📊 Уже внесено: *{current_sum}* ч\n\n"
-                f"Введите *количество часов*:"
-            )
-            quick_replies = [{"id": "back_to_loc", "title": "🔙 Назад"}]
-            client.send_text_with_quick_replies(to=user_id, text=text, quick_replies=quick_replies)
+    work_date = data.get("date") or data.get("work", {}).get("date") or date.today().isoformat()
+    existing_hours = sum_hours_for_user_date(user_id, work_date)
+    if existing_hours + hours > 24:
+        client.send_message(
+            to=user_id,
+            text=(
+                f"❌ *Превышен лимит часов!*\n"
+                f"Можно добавить не более *{24 - existing_hours}* ч.\n"
+                f"Уже записано: *{existing_hours}* ч из 24\n"
+            ),
+        )
         return
 
-    if current_state == "work_manual_crop_custom":
-        if message_text == "0":
-            # Назад к выбору культуры
-            lines = ["Выберите *культуру* (отправьте номер):"]
-            for i, c in enumerate(CROPS, 1):
-                lines.append(f"{i}. {c}")
-            client.send_message(to=user_id, text="\n".join(lines), buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            set_state(user_id, "work_manual_crop", state["data"], save_to_history=False)
-            return
-        if len(message_text.strip()) < 2:
-            client.send_message(to=user_id, text="❌ Введите название культуры (минимум 2 символа) или нажмите Назад.", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            return
-        crop = message_text.strip()
-        work_data = state.get("data", {}).get("work", {})
-        work_data["crop"] = crop
-        activity_base = work_data.get("activity_base", "Работа")
-        work_data["activity"] = f"Ручная — {activity_base} — {crop}"
-        work_data["act_grp"] = GROUP_HAND
-        state["data"]["work"] = work_data
-        prefilled = state["data"].get("prefilled_hours")
-        if prefilled:
-            _build_worker_confirmation(client, user_id, state, prefilled)
-        else:
-            set_state(user_id, "waiting_hours", state["data"], save_to_history=True, back_callback="work:manual:crop")
+    work_data = data.get("work", {}) or {}
+    work_data["date"] = work_date
+    data["work"] = work_data
+    data["date"] = work_date
+    data["prefilled_hours"] = hours
 
-            work_date = work_data.get("date", date.today().isoformat())
-            current_sum = sum_hours_for_user_date(user_id, work_date)
-            d_str = date.fromisoformat(work_date).strftime("%d.%m.%Y")
-            text = (
-                f"📅 Дата: *{d_str}*\n"
-                f"✋ {activity_base}\n"
-                f"🌱 {crop}\n"
-                f"📍 {work_data.get('location','')}\n"
-                f"📊 Уже внесено: *{current_sum}* ч\n\n"
-                f"Введите *количество часов*:"
-            )
-            quick_replies = [{"id": "back_to_loc", "title": "🔙 Назад"}]
-            client.send_text_with_quick_replies(to=user_id, text=text, quick_replies=quick_replies)
-        return
-
-    if current_state == "waiting_activity_selection":
-        if message_text == "0":
-            buttons = [
-                Button(title="Техника", callback_data="work:grp:tech"),
-                Button(title="Ручная", callback_data="work:type:manual"),
-                Button(title="🔙 Назад", callback_data="back:prev"),
-            ]
-            client.send_message(to=user_id, text="Выберите *тип работы*:", buttons=buttons)
-            clear_state(user_id)
-            return
-
-        acts = state["data"].get("acts", [])
-        
-        # Проверяем, выбрал ли пользователь "Прочее"
-        if message_text.isdigit():
-            choice_num = int(message_text)
-            if choice_num == len(acts) + 1:
-                # Пользователь выбрал "Прочее"
-                set_state(user_id, "waiting_custom_activity_input", state["data"])
-                client.send_message(
-                    to=user_id, 
-                    text="📝 Введите *название работы* (от 3 до 50 символов):",
-                    buttons=[Button(title="🔙 Назад", callback_data="back:prev")]
-                )
-                return
-        
-        found = find_best_match(message_text, acts)
-        if not found:
-            client.send_message(to=user_id, text="❌ Не удалось распознать. Введите номер или название (или 0 для возврата).")
-            return
-        
-        act_id, act_name = found
-        
-        res = get_activity_name(act_id)
-        if not res:
-            client.send_message(to=user_id, text="❌ Ошибка базы данных.")
-            clear_state(user_id)
-            return
-            
-        activity_name, grp_name = res
-        
-        work_data = state["data"].get("work", {})
-        work_data["grp"] = grp_name
-        work_data["activity"] = activity_name
-        state["data"]["work"] = work_data
-        set_state(user_id, "pick_loc_group", state["data"])
-        
-        buttons = [
-            Button(title="Поля", callback_data="work:locgrp:fields"),
-            Button(title="Склад", callback_data="work:locgrp:ware"),
-            Button(title="🔙 Назад", callback_data="back:prev"),
-        ]
-        client.send_message(to=user_id, text=f"✅ Выбрано: *{activity_name}*\n\nТеперь выберите *локацию*:", buttons=buttons)
-        return
-
-    if current_state == "waiting_custom_activity_input":
-        if message_text == "0":
-            # Возврат к выбору работы
-            work_data = state["data"].get("work", {})
-            grp_name = work_data.get("grp", GROUP_TECH)
-            
-            activities = list_activities_with_id(grp_name)
-            state["data"]["acts"] = activities
-            set_state(user_id, "waiting_activity_selection", state["data"])
-            
-            lines = ["Выберите *вид работы* (отправьте номер или название):"]
-            for i, (aid, name) in enumerate(activities, 1):
-                lines.append(f"{i}. {name}")
-            lines.append(f"{len(activities) + 1}. 📝 Прочее")
-            
-            text = "\n".join(lines)
-            client.send_message(to=user_id, text=text, buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            return
-        
-        # Валидация пользовательского ввода
-        custom_activity = message_text.strip()
-        if len(custom_activity) < 3:
-            client.send_message(to=user_id, text="❌ Слишком короткое название. Минимум 3 символа.", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            return
-        
-        if len(custom_activity) > 50:
-            client.send_message(to=user_id, text="❌ Слишком длинное название. Максимум 50 символов.", buttons=[Button(title="🔙 Назад", callback_data="back:prev")])
-            return
-        
-        # Сохраняем пользовательский ввод
-        work_data = state["data"].get("work", {})
-        grp_name = work_data.get("grp", GROUP_TECH)
-        work_data["activity"] = custom_activity
-        work_data["grp"] = grp_name
-        state["data"]["work"] = work_data
-        set_state(user_id, "pick_loc_group", state["data"])
-        
-        buttons = [
-            Button(title="Поля", callback_data="work:locgrp:fields"),
-            Button(title="Склад", callback_data="work:locgrp:ware"),
-            Button(title="🔙 Назад", callback_data="back:prev"),
-        ]
-        client.send_message(to=user_id, text=f"✅ Выбрано: *{custom_activity}*\n\nТеперь выберите *локацию*:", buttons=buttons)
-        return
-
-    if current_state == "waiting_location_selection":
-        if message_text == "0":
-            buttons = [
-                Button(title="Поля", callback_data="work:locgrp:fields"),
-                Button(title="Склад", callback_data="work:locgrp:ware"),
-                Button(title="🔙 Назад", callback_data="back:prev"),
-            ]
-            client.send_message(to=user_id, text="Выберите *локацию*:", buttons=buttons)
-            return
-
-        locs = state["data"].get("locs", [])
-        found = find_best_match(message_text, locs)
-        if not found:
-            client.send_message(to=user_id, text="❌ Не удалось распознать. Введите номер или название (или 0 для возврата).")
-            return
-            
-        loc_id, loc_name = found
-        
-        res = get_location_name(loc_id)
-        if not res:
-            client.send_message(to=user_id, text="❌ Ошибка базы данных.")
-            clear_state(user_id)
-            return
-            
-        location_name, grp = res
-        
-        work_data = state["data"].get("work", {})
-        work_data["loc_grp"] = grp
-        work_data["location"] = location_name
-        state["data"]["work"] = work_data
-        
-        # New flow: Date is already selected, go to hours (or сразу к подтверждению, если часы были введены)
-        prefilled = state["data"].get("prefilled_hours")
-        if prefilled:
-            _build_worker_confirmation(client, user_id, state, prefilled)
-        else:
-            acts_kind = state["data"].get("acts_kind", "tech")
-            save_to_history(user_id, f"work:grp:{acts_kind}")
-            set_state(user_id, "waiting_hours", state["data"], save_to_history=False)
-            
-            work_date = state["data"].get("work", {}).get("date", date.today().isoformat())
-            current_sum = sum_hours_for_user_date(user_id, work_date)
-            d_str = date.fromisoformat(work_date).strftime("%d.%m.%Y")
-            
-            text = (
-                f"📅 Дата: *{d_str}*\n"
-                f"📊 Уже внесено: *{current_sum}* ч\n\n"
-                f"Введите *количество часов*:"
-            )
-            quick_replies = [{"id": "back_to_loc", "title": "🔙 Назад"}]
-            client.send_text_with_quick_replies(to=user_id, text=text, quick_replies=quick_replies)
-        return
-
-    if current_state == "waiting_date_selection_universal":
-        if message_text == "0":
-            # Back button logic depends on where we came from
-            # For now, just go to root menu
-            clear_state(user_id)
-            u = get_user(user_id)
-            show_main_menu(client, user_id, u)
-            return
-
-        dates = state["data"].get("dates_list", [])
-        if not message_text.isdigit():
-            client.send_message(to=user_id, text="❌ Введите номер даты из списка или 0.")
-            return
-        
-        idx = int(message_text) - 1
-        if not (0 <= idx < len(dates)):
-            client.send_message(to=user_id, text="❌ Неверный номер.")
-            return
-            
-        selected_date = dates[idx]
-        next_prefix = state["data"].get("next_prefix")
-        
-        if next_prefix == "work:date":
-            # Worker flow: Date selected -> immediately ask for hours
-            current_sum = sum_hours_for_user_date(user_id, selected_date)
-            d_str = date.fromisoformat(selected_date).strftime("%d.%m.%Y")
-            text = (
-                f"📅 Дата: *{d_str}*\n"
-                f"📊 Уже внесено: *{current_sum}* ч\n\n"
-                f"Введите *количество часов*:\n\n0. 🔙 Назад"
-            )
-            set_state(user_id, "waiting_hours_prefill", {"date": selected_date, "work": {"date": selected_date}}, save_to_history=False)
-            client.send_message(to=user_id, text=text)
-            
-        elif next_prefix == "brig:date":
-            # Brigadier flow: Date selected -> Choose Shift
-            set_state(user_id, "brig_pick_shift", {"date": selected_date})
-            
-            buttons = [
-                Button(title="☀️ Утренняя", callback_data="brig:shift:morning"),
-                Button(title="🌙 Вечерняя", callback_data="brig:shift:evening"),
-                Button(title="🔙 Назад", callback_data="menu:brigadier")
-            ]
-            d_str = date.fromisoformat(selected_date).strftime("%d.%m.%Y")
-            client.send_message(to=user_id, text=f"📅 Дата: *{d_str}*\n\nВыберите *смену*:", buttons=buttons)
-            
-        elif next_prefix == "it:date":
-            # IT flow: Date selected, now ask for hours
-            # Calculate current IT hours for today
-            current_sum = sum_hours_for_user_date(user_id, selected_date, include_it=True)
-            
-            d_str = date.fromisoformat(selected_date).strftime("%d.%m.%Y")
-            text = (
-                f"📅 Дата: *{d_str}*\n"
-                f"📊 Уже внесено: *{current_sum}* ч\n\n"
-                f"Введите *количество часов*:"
-            )
-            
-            # IMPORTANT: We must pass the selected date in the data
-            set_state(user_id, "it_waiting_hours", {"date": selected_date}, save_to_history=False)
-            quick_replies = [{"id": "back_to_date", "title": "🔙 Back"}]
-            client.send_text_with_quick_replies(to=user_id, text=text, quick_replies=quick_replies)
-            
-        elif next_prefix == "tim:date":
-            # TIM Date selected -> Free input Activity
-            set_state(user_id, "tim_wait_activity", {"date": selected_date}, save_to_history=False)
-            client.send_message(to=user_id, text="🇨🇳 Введите *вид работы*:\n\n0. 🔙 Назад")
-            
-        return
-
-    # Обработка состояния для IT роли - ввод часов для star
-    if current_state == "it_waiting_hours":
-        if not is_it(user_id):
-            client.send_message(to=user_id, text="❌ Нет прав")
-            clear_state(user_id)
-            return
-        
-        # Обработка кнопки "Назад" (0) или Quick Reply "Back"
-        if message_text == "0" or message_text.lower() == "back" or message_text == "back_to_date" or message_text == "🔙 Back":
-            # Return to date selection
-            show_date_selection(client, user_id, prefix="it:date")
-            return
-        
-        if message_text == "back:prev": # Generic back
-             if go_back(client, user_id):
-                return
-             else:
-                clear_state(user_id)
-                u = get_user(user_id)
-                show_main_menu(client, user_id, u)
-                return
-        
-        if not message_text.isdigit():
-            client.send_message(to=user_id, text="❌ Введите число (1-24) или 0 для возврата назад.")
-            return
-        
-        hours = int(message_text)
-        if not (1 <= hours <= 24):
-            client.send_message(to=user_id, text="❌ Часы должны быть от 1 до 24 (или 0 для возврата назад).")
-            return
-        
-        # Автоматически заполняем данные для IT отчета
-        work_date = state["data"].get("date", date.today().isoformat())
-        
-        # Проверка суммы часов за день (IT отчеты не учитываются в общей статистике, но проверяем их отдельно)
-        # Для IT роли проверяем только IT отчеты
-        with connect() as con, closing(con.cursor()) as c:
-            existing_it_hours = c.execute("""
-                SELECT COALESCE(SUM(hours), 0) 
-                FROM reports 
-                WHERE user_id=? AND work_date=? AND (location_grp='it' OR activity_grp='it')
-            """, (user_id, work_date)).fetchone()
-            existing_it_hours = int(existing_it_hours[0] or 0)
-        
-        if existing_it_hours + hours > 24:
-            # Получаем список существующих IT записей за день
-            with connect() as con, closing(con.cursor()) as c:
-                existing_reports = c.execute("""
-                    SELECT activity, location, hours 
-                    FROM reports 
-                    WHERE user_id=? AND work_date=? AND (location_grp='it' OR activity_grp='it')
-                    ORDER BY created_at
-                """, (user_id, work_date)).fetchall()
-            
-            # Формируем сообщение об ошибке
-            max_can_add = 24 - existing_it_hours
-            error_parts = [
-                f"❌ *Превышен лимит часов!*\n",
-                f"Можно добавить не более *{max_can_add}* ч.\n",
-                f"Уже записано: *{existing_it_hours}* ч из 24\n"
-            ]
-            
-            if existing_reports:
-                error_parts.append("\n*Существующие записи за этот день:*")
-                for act, loc, h in existing_reports:
-                    error_parts.append(f"• {act} ({loc}): *{h}* ч")
-            
-            error_parts.append(f"\n\nТекущая запись:")
-            error_parts.append(f"• Автоматизация учета (Манхэттен): *{hours}* ч")
-            error_parts.append(f"\nИтого будет: *{existing_it_hours + hours}* ч (максимум 24)")
-            
-            client.send_message(to=user_id, text="\n".join(error_parts))
-            return
-        
-        temp_report = {
-            "location": "Манхэттен",
-            "loc_grp": "it",  # Специальная группа для IT
-            "activity": "Автоматизация учета",
-            "act_grp": "it",  # Специальная группа для IT
-            "work_date": work_date,
-            "hours": hours
-        }
-        
-        # Сохраняем временный отчет в состояние
-        state["data"]["temp_report"] = temp_report
-        set_state(user_id, "waiting_confirmation_it", state["data"], save_to_history=False)
-        
-        # Показываем подтверждение (такое же как у всех)
-        d_str = date.fromisoformat(work_date).strftime("%d.%m.%Y")
-        text = (
-            f"📋 *Подтверждение отчета*\n\n"
-            f"📅 Дата: *{d_str}*\n"
-            f"Работа: *{temp_report['activity']}*\n"
-            f"Место: *{temp_report['location']}*\n"
-            f"Часы: *{hours}*\n\n"
-            f"Всё верно?"
-        )
-        
-        buttons = [
-            Button(title="✅ Подтвердить", callback_data="confirm:it"),
-            Button(title="✏️ Изменить", callback_data="edit:it"),
-        ]
-        client.send_message(to=user_id, text=text, buttons=buttons)
-        return
-
-    if current_state == "waiting_hours_prefill":
-        if message_text == "0":
-            show_date_selection(client, user_id, prefix="work:date")
-            return
-        if not message_text.isdigit():
-            client.send_message(to=user_id, text="❌ Введите число (1-24) или 0 для возврата назад.")
-            return
-        hours = int(message_text)
-        if not (1 <= hours <= 24):
-            client.send_message(to=user_id, text="❌ Часы должны быть от 1 до 24 (или 0 для возврата назад).")
-            return
-
-        work_date = state["data"].get("date") or state["data"].get("work", {}).get("date") or date.today().isoformat()
-        existing_hours = sum_hours_for_user_date(user_id, work_date)
-        if existing_hours + hours > 24:
-            max_can_add = 24 - existing_hours
-            error_parts = [
-                f"❌ *Превышен лимит часов!*\n",
-                f"Можно добавить не более *{max_can_add}* ч.\n",
-                f"Уже записано: *{existing_hours}* ч из 24\n",
-            ]
-            client.send_message(to=user_id, text="".join(error_parts))
-            return
-
-        work_data = state["data"].get("work", {}) or {}
-        work_data["date"] = work_date
-        state["data"]["work"] = work_data
-        state["data"]["date"] = work_date
-        state["data"]["prefilled_hours"] = hours
-
-        buttons = [
-            Button(title="🚜 Техника", callback_data="work:grp:tech"),
-            Button(title="✋ Ручная", callback_data="work:type:manual"),
-            Button(title="🔙 Назад", callback_data="back:prev"),
-        ]
-        d_str = date.fromisoformat(work_date).strftime("%d.%m.%Y")
-        client.send_message(to=user_id, text=f"📅 Дата: *{d_str}*\n\nВыберите *тип работы*:", buttons=buttons)
-        set_state(user_id, "pick_work_group", state["data"], save_to_history=False)
+    buttons = [
+        Button(title="🚜 Техника", callback_data="work:grp:tech"),
+        Button(title="✋ Ручная", callback_data="work:type:manual"),
+        BTN_BACK,
+    ]
+    d_str = _iso_to_ddmmyyyy(work_date)
+    client.send_message(to=user_id, text=f"📅 Дата: *{d_str}*\n\nВыберите *тип работы*:", buttons=buttons)
+    set_state(user_id, "pick_work_group", data, push_history=False)
+
+def _state_waiting_del_selection(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Выбор записей для удаления."""
+    if message_text == "0":
+        client.send_message(to=user_id, text="🔄 Отмена удаления")
+        back_to_main_menu(client, user_id)
         return
 
-    if current_state == "waiting_hours":
-        state = get_state(user_id)
-        # Обработка кнопки "Назад" (0) или Quick Reply
-        if message_text == "0" or message_text == "back_to_loc":
-            # Fallback: возврат к выбору локации
-            work_data = state["data"].get("work", {})
-            activity_name = work_data.get("activity", "работа")
-            
-            # Check if we came from warehouse (skip loc selection) or fields
-            loc_grp = work_data.get("loc_grp")
-            
-            if loc_grp == GROUP_WARE:
-                 # If warehouse, we skipped location selection, so back should go to loc group selection
-                 # But in handle_callback we saved history before waiting_hours.
-                 # Let's try go_back first.
-                 if go_back(client, user_id):
-                     return
-                 else:
-                     # Fallback
-                     buttons = [
-                        Button(title="Поля", callback_data="work:locgrp:fields"),
-                        Button(title="Склад", callback_data="work:locgrp:ware"),
-                        Button(title="🔙 Назад", callback_data="back:prev"),
-                    ]
-                     client.send_message(to=user_id, text=f"✅ Выбрано: *{activity_name}*\n\nТеперь выберите *локацию*:", buttons=buttons)
-                     return
-            else:
-                # Fields - go back to location selection
-                # We can try go_back, but if we want to show the list again explicitly:
-                locations = list_locations_with_id(GROUP_FIELDS)
-                state["data"]["locs"] = locations
-                set_state(user_id, "waiting_location_selection", state["data"], save_to_history=False)
-                
-                lines = ["Выберите *место* (отправьте номер или название):"]
-                for i, (lid, name) in enumerate(locations, 1):
-                    lines.append(f"{i}. {name}")
-                
-                text = "\n".join(lines)
-                quick_replies = [{"id": "cancel_location", "title": "🔙 Назад"}]
-                client.send_text_with_quick_replies(to=user_id, text=text, quick_replies=quick_replies)
-                return
-        
-        if not message_text.isdigit():
-            client.send_message(to=user_id, text="❌ Введите число (1-24) или 0 для возврата назад.")
-            return
-        
-        hours = int(message_text)
-        if not (1 <= hours <= 24):
-            client.send_message(to=user_id, text="❌ Часы должны быть от 1 до 24 (или 0 для возврата назад).")
-            return
-            
-        work_data = state["data"].get("work", {})
-        work_date = work_data.get("date")
-        
-        # Проверка суммы часов за день
-        existing_hours = sum_hours_for_user_date(user_id, work_date)
-        if existing_hours + hours > 24:
-            # Получаем список существующих записей за день
-            with connect() as con, closing(con.cursor()) as c:
-                existing_reports = c.execute("""
-                    SELECT activity, location, hours 
-                    FROM reports 
-                    WHERE user_id=? AND work_date=? AND location_grp != 'it' AND activity_grp != 'it'
-                    ORDER BY created_at
-                """, (user_id, work_date)).fetchall()
-            
-            # Формируем сообщение об ошибке
-            max_can_add = 24 - existing_hours
-            error_parts = [
-                f"❌ *Превышен лимит часов!*\n",
-                f"Можно добавить не более *{max_can_add}* ч.\n",
-                f"Уже записано: *{existing_hours}* ч из 24\n"
-            ]
-            
-            if existing_reports:
-                error_parts.append("\n*Существующие записи за этот день:*")
-                for act, loc, h in existing_reports:
-                    error_parts.append(f"• {act} ({loc}): *{h}* ч")
-            
-            error_parts.append(f"\n\nТекущая запись:")
-            error_parts.append(f"• {work_data.get('activity', 'работа')} ({work_data.get('location', 'место')}): *{hours}* ч")
-            error_parts.append(f"\nИтого будет: *{existing_hours + hours}* ч (максимум 24)")
+    # Parse multiple IDs
+    ids_to_delete = []
+    invalid_inputs = []
+    
+    # Split by comma or space
+    parts = message_text.replace(",", " ").split()
+    records = state["data"].get("del_records", [])
+    
+    for part in parts:
+        if not part.isdigit():
+            invalid_inputs.append(part)
+            continue
             
-            client.send_message(to=user_id, text="\n".join(error_parts))
-            return
-        
-        _build_worker_confirmation(client, user_id, state, hours)
-        return
-
-    if current_state == "waiting_record_selection":
-        if message_text == "0":
-            client.send_message(to=user_id, text="🔄 Отмена редактирования")
-            clear_state(user_id)
-            u = get_user(user_id)
-            show_main_menu(client, user_id, u)
-            return
-
-        if not message_text.isdigit():
-            client.send_message(to=user_id, text="❌ Введите номер записи из списка или 0.")
-            return
-        
-        idx = int(message_text) - 1
-        records = state["data"].get("edit_records", [])
-        
+        idx = int(part) - 1
         if not (0 <= idx < len(records)):
-            client.send_message(to=user_id, text="❌ Неверный номер.")
-            return
+            invalid_inputs.append(part)
+            continue
             
-        r = records[idx]
-        rid, wdate, act, loc, h, _ = r
+        # Get report ID (first element in record tuple)
+        ids_to_delete.append(records[idx][0])
         
-        text = (
-            f"📝 *Запись #{rid}*\n"
-            f"Дата: {wdate}\n"
-            f"Место: {loc}\n"
-            f"Работа: {act}\n"
-            f"Часы: *{h}*\n\n"
-            f"Введите новое количество часов:"
-        )
-        
-        state["data"]["edit_id"] = rid
-        state["data"]["edit_date"] = wdate
-        state["data"]["edit_old_hours"] = h
-        state["data"]["edit_activity"] = act
-        state["data"]["edit_location"] = loc
-        set_state(user_id, "waiting_edit_hours", state["data"])
-        buttons = [Button(title="🔙 Назад", callback_data="back:prev")]
-        client.send_message(to=user_id, text=text, buttons=buttons)
+    if invalid_inputs:
+        client.send_message(to=user_id, text=f"❌ Некорректные номера: {', '.join(invalid_inputs)}. Введите номера из списка через запятую или пробел.")
         return
-
-    if current_state == "waiting_del_selection":
-        if message_text == "0":
-            client.send_message(to=user_id, text="🔄 Отмена удаления")
-            clear_state(user_id)
-            u = get_user(user_id)
-            show_main_menu(client, user_id, u)
-            return
-
-        # Parse multiple IDs
-        ids_to_delete = []
-        invalid_inputs = []
         
-        # Split by comma or space
-        parts = message_text.replace(",", " ").split()
-        records = state["data"].get("del_records", [])
-        
-        for part in parts:
-            if not part.isdigit():
-                invalid_inputs.append(part)
-                continue
-                
-            idx = int(part) - 1
-            if not (0 <= idx < len(records)):
-                invalid_inputs.append(part)
-                continue
-                
-            # Get report ID (first element in record tuple)
-            ids_to_delete.append(records[idx][0])
-            
-        if invalid_inputs:
-            client.send_message(to=user_id, text=f"❌ Некорректные номера: {', '.join(invalid_inputs)}. Введите номера из списка через запятую или пробел.")
-            return
-            
-        if not ids_to_delete:
-            client.send_message(to=user_id, text="❌ Не выбрано ни одной записи.")
-            return
-            
-        # Delete records
-        success_count = 0
-        fail_count = 0
-        
-        for rid in ids_to_delete:
-            if delete_report(rid, user_id):
-                success_count += 1
-            else:
-                fail_count += 1
-                
-        msg = f"✅ Удалено записей: {success_count}"
-        if fail_count > 0:
-            msg += f"\n❌ Ошибок удаления: {fail_count}"
-            
-        client.send_message(to=user_id, text=msg)
-        clear_state(user_id)
-        u = get_user(user_id)
-        show_main_menu(client, user_id, u)
+    if not ids_to_delete:
+        client.send_message(to=user_id, text="❌ Не выбрано ни одной записи.")
         return
-
-    if current_state == "waiting_edit_selection_multi":
-        if message_text == "0":
-            client.send_message(to=user_id, text="🔄 Отмена редактирования")
-            clear_state(user_id)
-            u = get_user(user_id)
-            show_main_menu(client, user_id, u)
-            return
-
-        # Parse multiple IDs
-        ids_to_edit = []
-        invalid_inputs = []
-        
-        parts = message_text.replace(",", " ").split()
-        records = state["data"].get("edit_records", [])
-        
-        for part in parts:
-            if not part.isdigit():
-                invalid_inputs.append(part)
-                continue
-                
-            idx = int(part) - 1
-            if not (0 <= idx < len(records)):
-                invalid_inputs.append(part)
-                continue
-                
-            ids_to_edit.append(records[idx]) # Store full record
-            
-        if invalid_inputs:
-            client.send_message(to=user_id, text=f"❌ Некорректные номера: {', '.join(invalid_inputs)}")
-            return
-            
-        if not ids_to_edit:
-            client.send_message(to=user_id, text="❌ Не выбрано ни одной записи.")
-            return
-            
-        # Start editing queue
-        state["data"]["edit_queue"] = ids_to_edit
-        state["data"]["current_edit_idx"] = 0
         
-        # Start first edit
-        process_edit_queue(client, user_id, state["data"])
-        return
-
-    if current_state == "waiting_edit_queue_hours":
-        # ... (Logic to handle hours for current edit item and move to next)
-        if message_text == "0":
-             # Abort all
-             client.send_message(to=user_id, text="🔄 Отмена редактирования")
-             clear_state(user_id)
-             u = get_user(user_id)
-             show_main_menu(client, user_id, u)
-             return
-
-        if not message_text.isdigit():
-            client.send_message(to=user_id, text="❌ Введите число.")
-            return
-            
-        new_h = int(message_text)
-        if not (1 <= new_h <= 24):
-            client.send_message(to=user_id, text="❌ Часы от 1 до 24.")
-            return
-            
-        # Save change
-        current_item = state["data"]["edit_queue"][state["data"]["current_edit_idx"]]
-        rid = current_item[0]
-        
-        if update_report_hours(rid, user_id, new_h):
-            client.send_message(to=user_id, text=f"✅ Запись #{rid} обновлена.")
+    # Delete records
+    success_count = 0
+    fail_count = 0
+    
+    for rid in ids_to_delete:
+        if delete_report(rid, user_id):
+            success_count += 1
         else:
-            client.send_message(to=user_id, text=f"❌ Ошибка обновления записи #{rid}.")
+            fail_count += 1
             
-        # Move to next
-        state["data"]["current_edit_idx"] += 1
-        process_edit_queue(client, user_id, state["data"])
-        return
-    if current_state == "wait_del_brig_select":
-        if message_text == "0":
-            client.send_message(to=user_id, text="🔄 Отмена")
-            clear_state(user_id)
-            u = get_user(user_id)
-            show_main_menu(client, user_id, u)
-            return
-            
-        ids_to_delete = []
-        invalid_inputs = []
-        
-        parts = message_text.replace(",", " ").split()
-        records = state["data"].get("del_list_brig", [])
-        
-        for part in parts:
-            if not part.isdigit():
-                invalid_inputs.append(part)
-                continue
-                
-            idx = int(part) - 1
-            if not (0 <= idx < len(records)):
-                invalid_inputs.append(part)
-                continue
-                
-            ids_to_delete.append(records[idx][0])
-            
-        if invalid_inputs:
-            client.send_message(to=user_id, text=f"❌ Некорректные номера: {', '.join(invalid_inputs)}")
-            return
-            
-        if not ids_to_delete:
-            client.send_message(to=user_id, text="❌ Не выбрано ни одной записи.")
-            return
-            
-        with connect() as con, closing(con.cursor()) as c:
-            placeholders = ",".join("?" * len(ids_to_delete))
-            c.execute(f"DELETE FROM brigadier_reports WHERE id IN ({placeholders})", ids_to_delete)
-            con.commit()
-        
-        client.send_message(to=user_id, text=f"✅ Удалено записей: {len(ids_to_delete)}")
-        
-        clear_state(user_id)
-        u = get_user(user_id)
-        show_main_menu(client, user_id, u)
+    msg = f"✅ Удалено записей: {success_count}"
+    if fail_count > 0:
+        msg += f"\n❌ Ошибок удаления: {fail_count}"
+        
+    client.send_message(to=user_id, text=msg)
+    back_to_main_menu(client, user_id)
+
+def _state_waiting_edit_selection_multi(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Выбор записей для редактирования."""
+    data = state["data"]
+    if message_text == "0":
+        client.send_message(to=user_id, text="🔄 Отмена редактирования")
+        back_to_main_menu(client, user_id)
         return
 
-    if current_state == "wait_edit_brig_select":
-        if message_text == "0":
-            client.send_message(to=user_id, text="🔄 Отмена")
-            clear_state(user_id)
-            u = get_user(user_id)
-            show_main_menu(client, user_id, u)
-            return
+    # Parse multiple IDs
+    ids_to_edit = []
+    invalid_inputs = []
+    
+    parts = message_text.replace(",", " ").split()
+    records = data.get("edit_records", [])
+    
+    for part in parts:
+        if not part.isdigit():
+            invalid_inputs.append(part)
+            continue
             
-        idx = int(message_text) - 1
-        records = state["data"].get("edit_list_brig", [])
+        idx = int(part) - 1
         if not (0 <= idx < len(records)):
-            client.send_message(to=user_id, text="❌ Неверный номер.")
-            return
-            
-        rid = records[idx][0]
-        state["data"]["edit_brig_id"] = rid
-        set_state(user_id, "wait_edit_brig_rows", state["data"])
-        client.send_message(to=user_id, text="Введите новое количество *рядов*:")
-        return
-
-    if current_state == "wait_edit_brig_rows":
-        if not message_text.isdigit():
-            client.send_message(to=user_id, text="❌ Введите число.")
-            return
-        
-        new_rows = int(message_text)
-        rid = state["data"].get("edit_brig_id")
-        
-        with connect() as con, closing(con.cursor()) as c:
-            c.execute("UPDATE brigadier_reports SET rows=? WHERE id=?", (new_rows, rid))
-            con.commit()
+            invalid_inputs.append(part)
+            continue
             
-        client.send_message(to=user_id, text="✅ Количество рядов обновлено.")
-        clear_state(user_id)
-        u = get_user(user_id)
-        show_main_menu(client, user_id, u)
-        return
-
-    if current_state == "waiting_edit_hours":
-        if message_text == "0":
-            if go_back(client, user_id):
-                return
-            clear_state(user_id)
-            u = get_user(user_id)
-            show_main_menu(client, user_id, u)
-            return
-        
-        if not message_text.isdigit():
-            client.send_message(to=user_id, text="❌ Введите число (1-24) или 0 для возврата.")
-            return
-        
-        new_h = int(message_text)
-        if not (1 <= new_h <= 24):
-            client.send_message(to=user_id, text="❌ Часы должны быть от 1 до 24.")
-            return
-        
-        try:
-            rid = int(state["data"].get("edit_id"))
-            work_d = state["data"].get("edit_date")
-        except Exception:
-            client.send_message(to=user_id, text="❌ Данные сессии устарели.")
-            return
+        ids_to_edit.append(records[idx]) # Store full record
         
-        already = sum_hours_for_user_date(user_id, work_d, exclude_report_id=rid)
-        if already + new_h > 24:
-            max_can_add = 24 - already
-            error_msg = (
-                f"❗ *Превышен лимит часов*\n\n"
-                f"Сейчас учтено (без этой записи): *{already}* ч\n"
-                f"Попытка установить: *{new_h}* ч\n"
-                f"Максимум в сутки: *24* ч\n\n"
-                f"Вы можете установить не более *{max_can_add}* ч."
-            )
-            client.send_message(to=user_id, text=error_msg)
-            return
+    if invalid_inputs:
+        client.send_message(to=user_id, text=f"❌ Некорректные номера: {', '.join(invalid_inputs)}")
+        return
         
-        ok = update_report_hours(rid, user_id, new_h)
-        if ok:
-            old_hours = state["data"].get("edit_old_hours", "?")
-            activity = state["data"].get("edit_activity", "работа")
-            location = state["data"].get("edit_location", "место")
-            edit_text = (
-                f"📝 Запись #{rid}\n"
-                f"Дата: {work_d}\n"
-                f"Место: {location}\n"
-                f"Работа: {activity}\n"
-                f"Часы: {old_hours} → *{new_h}*"
-            )
-            u = get_user(user_id)
-            user_name = (u or {}).get("full_name") or user_id
-            send_report_to_relay(original_from=user_id, original_text=edit_text, user_name=user_name, is_edit=True)
-            
-            clear_state(user_id)
-            client.send_message(to=user_id, text="✅ Обновлено")
-            show_main_menu(client, user_id, u)
-        else:
-            client.send_message(to=user_id, text="❌ Не получилось обновить")
+    if not ids_to_edit:
+        client.send_message(to=user_id, text="❌ Не выбрано ни одной записи.")
         return
-
-    if current_state == "adm_wait_act_add":
-        grp = state["data"].get("act_grp", GROUP_TECH)
-        if add_activity(grp, message_text):
-            client.send_message(to=user_id, text=f"✅ Вид работы '{message_text}' добавлен.")
-        else:
-            client.send_message(to=user_id, text="❌ Ошибка или такой вид работ уже есть.")
-        clear_state(user_id)
-        u = get_user(user_id)
-        show_main_menu(client, user_id, u)
+        
+    # Start editing queue
+    data["edit_queue"] = ids_to_edit
+    data["current_edit_idx"] = 0
+    
+    # Start first edit
+    process_edit_queue(client, user_id, data)
+
+def _state_waiting_edit_queue_hours(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Новые часы для записи из очереди редактирования."""
+    data = state["data"]
+    # ... (Logic to handle hours for current edit item and move to next)
+    if message_text == "0":
+         # Abort all
+         client.send_message(to=user_id, text="🔄 Отмена редактирования")
+         back_to_main_menu(client, user_id)
+         return
+
+    new_h = int(message_text)
+    if not (1 <= new_h <= 24):
+        client.send_message(to=user_id, text="❌ Часы от 1 до 24.")
         return
+        
+    # Save change
+    current_item = data["edit_queue"][data["current_edit_idx"]]
+    rid = current_item[0]
+    
+    if update_report_hours(rid, user_id, new_h):
+        client.send_message(to=user_id, text=f"✅ Запись #{rid} обновлена.")
+    else:
+        client.send_message(to=user_id, text=f"❌ Ошибка обновления записи #{rid}.")
+        
+    # Move to next
+    data["current_edit_idx"] += 1
+    process_edit_queue(client, user_id, data)
 
-    if current_state == "adm_wait_act_del":
-        if message_text == "0":
-            buttons = [
-                Button(title="🚜 Техника", callback_data="adm:del:act:tech"),
-                Button(title="✋ Ручная", callback_data="adm:del:act:hand"),
-                Button(title="🔙 Назад", callback_data="back:prev"),
-            ]
-            client.send_message(to=user_id, text="Выберите *группу работы*:", buttons=buttons)
-            clear_state(user_id)
-            return
+def _state_wait_del_brig_select(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Выбор отчетов бригадира для удаления."""
+    if message_text == "0":
+        client.send_message(to=user_id, text="🔄 Отмена")
+        back_to_main_menu(client, user_id)
+        return
         
-        acts = state["data"].get("acts_del", [])
-        found = find_best_match(message_text, acts)
-        if not found:
-            client.send_message(to=user_id, text="❌ Не удалось распознать. Введите номер или название (или 0 для возврата).")
-            return
+    ids_to_delete = []
+    invalid_inputs = []
+    
+    parts = message_text.replace(",", " ").split()
+    records = state["data"].get("del_list_brig", [])
+    
+    for part in parts:
+        if not part.isdigit():
+            invalid_inputs.append(part)
+            continue
+            
+        idx = int(part) - 1
+        if not (0 <= idx < len(records)):
+            invalid_inputs.append(part)
+            continue
+            
+        ids_to_delete.append(records[idx][0])
         
-        _, act_name = found
-        if remove_activity(act_name):
-            client.send_message(to=user_id, text=f"✅ Вид работы '{act_name}' удален.")
-        else:
-            client.send_message(to=user_id, text="❌ Не найдено.")
-        clear_state(user_id)
-        u = get_user(user_id)
-        show_main_menu(client, user_id, u)
+    if invalid_inputs:
+        client.send_message(to=user_id, text=f"❌ Некорректные номера: {', '.join(invalid_inputs)}")
         return
-
-    if current_state == "adm_wait_loc_add":
-        if add_location(GROUP_FIELDS, message_text):
-            client.send_message(to=user_id, text=f"✅ Локация '{message_text}' добавлена.")
-        else:
-            client.send_message(to=user_id, text="❌ Ошибка или такая локация уже есть.")
-        clear_state(user_id)
-        u = get_user(user_id)
-        show_main_menu(client, user_id, u)
+        
+    if not ids_to_delete:
+        client.send_message(to=user_id, text="❌ Не выбрано ни одной записи.")
         return
-
-    if current_state == "adm_wait_loc_del":
-        if message_text == "0":
-            buttons = [
-                Button(title="➕ Добавить локацию", callback_data="adm:add:loc"),
-                Button(title="➖ Удалить локацию", callback_data="adm:del:loc"),
-                Button(title="🔙 Назад", callback_data="back:prev"),
-            ]
-            client.send_message(to=user_id, text="⚙️ *Управление локациями*:", buttons=buttons)
-            clear_state(user_id)
-            return
         
-        locs = state["data"].get("locs_del", [])
-        found = find_best_match(message_text, locs)
-        if not found:
-            client.send_message(to=user_id, text="❌ Не удалось распознать. Введите номер или название (или 0 для возврата).")
-            return
+    exec_dml_many("DELETE FROM brigadier_reports WHERE id=?", [(rid,) for rid in ids_to_delete])
+    _clear_filled_cache()
+    
+    client.send_message(to=user_id, text=f"✅ Удалено записей: {len(ids_to_delete)}")
+    
+    back_to_main_menu(client, user_id)
+
+def _state_wait_edit_brig_select(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Выбор отчета бригадира для редактирования."""
+    data = state["data"]
+    if message_text == "0":
+        client.send_message(to=user_id, text="🔄 Отмена")
+        back_to_main_menu(client, user_id)
+        return
         
-        _, loc_name = found
-        if remove_location(loc_name):
-            client.send_message(to=user_id, text=f"✅ Локация '{loc_name}' удалена.")
-        else:
-            client.send_message(to=user_id, text="❌ Не найдено.")
-        clear_state(user_id)
-        u = get_user(user_id)
-        show_main_menu(client, user_id, u)
+    idx = int(message_text) - 1
+    records = data.get("edit_list_brig", [])
+    if not (0 <= idx < len(records)):
+        client.send_message(to=user_id, text="❌ Неверный номер.")
         return
+        
+    rid = records[idx][0]
+    data["edit_brig_id"] = rid
+    set_state(user_id, "wait_edit_brig_rows", data)
+    client.send_message(to=user_id, text="Введите новое количество *рядов*:")
+
+def _state_wait_edit_brig_rows(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Новое количество рядов в отчете бригадира."""
+    new_rows = int(message_text)
+    rid = state["data"].get("edit_brig_id")
     
-    # -----------------------------
-    # Обработчики для бригадиров
-    # -----------------------------
+    exec_dml("UPDATE brigadier_reports SET rows=? WHERE id=?", (new_rows, rid))
     
-    if norm_text in {"бриг", "/бриг"}:
-        if is_admin(user_id):
-            buttons = [
-                Button(title="➕ Добавить бригадира", callback_data="adm:add:brigadier"),
-                Button(title="➖ Удалить бригадира", callback_data="adm:del:brigadier"),
-                Button(title="📋 Список бригадиров", callback_data="adm:list:brigadiers"),
-            ]
-            client.send_message(to=user_id, text="👷 *Управление бригадирами*:", buttons=buttons)
-            return
-        if is_it(user_id) or is_brigadier(user_id):
-            btn_obj = type('obj', (object,), {'from_user': msg.from_user, 'data': 'menu:brigadier'})()
-            handle_callback(client, btn_obj)
+    client.send_message(to=user_id, text="✅ Количество рядов обновлено.")
+    back_to_main_menu(client, user_id)
+
+def _state_waiting_edit_hours(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Новые часы для редактируемой записи."""
+    data = state["data"]
+    if message_text == "0":
+        if go_back(client, user_id):
             return
-        client.send_message(to=user_id, text="❌ Нет прав для доступа к меню бригадира.")
+        back_to_main_menu(client, user_id)
         return
     
-    if current_state and current_state.startswith("brig_"):
-        logging.info(f"[BRIG] state_entry user={user_id} state={current_state} text='{message_text.strip()}' data={state.get('data', {})}")
+    new_h = int(message_text)
+    if not (1 <= new_h <= 24):
+        client.send_message(to=user_id, text="❌ Часы должны быть от 1 до 24.")
+        return
     
-    if current_state == "brig_zucchini_rows":
-        logging.info(f"[BRIG] state=brig_zucchini_rows enter handler user={user_id} data={state.get('data', {})}")
-        try:
-            txt = message_text.strip()
-            logging.info(f"[BRIG] enter zucchini_rows user={user_id} text='{txt}' state={state.get('data', {})}")
-            if txt == "0":
-                if go_back(client, user_id):
-                    return
-            if not txt.isdigit():
-                buttons = [Button(title="🔙 Назад", callback_data="back:prev")]
-                client.send_message(to=user_id, text="❌ Введите число (количество рядов):", buttons=buttons)
-                return
-            rows = int(txt)
-            state["data"] = state.get("data", {}) or {}
-            if "work_type" not in state["data"]:
-                state["data"]["work_type"] = "Кабачок"
-            if "date" not in state["data"]:
-                state["data"]["date"] = date.today().isoformat()
-            work_date = state["data"]["date"]
-            state["data"]["rows"] = rows
-            state["data"]["brig_stage"] = "brig_zucchini_rows"
-            logging.info(f"[BRIG] {user_id} zucchini rows set -> {rows}, data={state['data']}")
-            back_cb = f"brig:report:date:{work_date}"
-            set_state(user_id, "brig_zucchini_field", state["data"], save_to_history=True, back_callback=back_cb)
-            buttons = [Button(title="🔙 Назад", callback_data="back:prev")]
-            client.send_message(to=user_id, text="Введите *название поля*:", buttons=buttons)
-            logging.info(f"[BRIG] prompt field sent to {user_id}")
-        except Exception as e:
-            logging.exception(f"[BRIG] error in zucchini_rows for user {user_id}: {e}")
-            buttons = [Button(title="🔙 Назад", callback_data="back:prev")]
-            client.send_message(to=user_id, text="❌ Ошибка при обработке рядов, попробуйте еще раз.", buttons=buttons)
-            logging.info(f"[BRIG] prompt error sent to {user_id}")
+    try:
+        rid = int(data.get("edit_id"))
+        work_d = data.get("edit_date")
+    except Exception:
+        client.send_message(to=user_id, text="❌ Данные сессии устарели.")
         return
     
-    if current_state == "brig_zucchini_field":
-        txt = message_text.strip()
-        if txt == "0":
-            if go_back(client, user_id):
-                return
-        state["data"] = state.get("data", {}) or {}
-        state["data"]["field"] = txt
-        logging.info(f"[BRIG] {user_id} zucchini field set -> {txt}")
-        set_state(user_id, "brig_zucchini_workers", state["data"], save_to_history=True, back_callback="back:prev")
-        buttons = [Button(title="🔙 Назад", callback_data="back:prev")]
-        client.send_message(to=user_id, text="Введите *количество людей*:", buttons=buttons)
+    already = sum_hours_for_user_date(user_id, work_d, exclude_report_id=rid)
+    if already + new_h > 24:
+        max_can_add = 24 - already
+        error_msg = (
+            f"❗ *Превышен лимит часов*\n\n"
+            f"Сейчас учтено (без этой записи): *{already}* ч\n"
+            f"Попытка установить: *{new_h}* ч\n"
+            f"Максимум в сутки: *24* ч\n\n"
+            f"Вы можете установить не более *{max_can_add}* ч."
+        )
+        client.send_message(to=user_id, text=error_msg)
         return
     
-    if current_state == "brig_zucchini_workers":
-        txt = message_text.strip()
-        if txt == "0":
-            if go_back(client, user_id):
-                return
-        if not txt.isdigit():
-            buttons = [Button(title="🔙 Назад", callback_data="back:prev")]
-            client.send_message(to=user_id, text="❌ Введите число (количество людей):", buttons=buttons)
-            return
-        workers = int(txt)
-        state["data"] = state.get("data", {}) or {}
-        work_date = state["data"].get("date", date.today().isoformat())
-        temp_report = {
-            "work_type": state["data"].get("work_type", "Кабачок"),
-            "rows": state["data"].get("rows", 0),
-            "field": state["data"].get("field", ""),
-            "bags": 0,
-            "workers": workers,
-            "work_date": work_date
-        }
-        state["data"]["temp_report"] = temp_report
-        logging.info(f"[BRIG] {user_id} zucchini workers set -> {workers}, report={temp_report}")
-        set_state(user_id, "waiting_confirmation_brigadier", state["data"], save_to_history=True, back_callback="back:prev")
-        d_str = date.fromisoformat(work_date).strftime("%d.%m.%Y")
-        text = (
-            f"📋 *Проверьте данные*\n\n"
-            f"📅 Дата: *{d_str}*\n"
-            f"Тип: *{temp_report['work_type']}*\n"
-            f"Рядов: *{temp_report['rows']}*\n"
-            f"Поле: *{temp_report['field']}*\n"
-            f"Людей: *{workers}*\n\n"
-            f"Все верно?"
+    ok = update_report_hours(rid, user_id, new_h)
+    if ok:
+        old_hours = data.get("edit_old_hours", "?")
+        activity = data.get("edit_activity", "работа")
+        location = data.get("edit_location", "место")
+        edit_text = (
+            f"📝 Запись #{rid}\n"
+            f"Дата: {work_d}\n"
+            f"Место: {location}\n"
+            f"Работа: {activity}\n"
+            f"Часы: {old_hours} → *{new_h}*"
         )
-        buttons = [
-            Button(title="✅ Подтвердить", callback_data="confirm:brig"),
-            Button(title="✏️ Изменить", callback_data="edit:brig")
-        ]
-        client.send_message(to=user_id, text=text, buttons=buttons)
+        u = get_user(user_id)
+        user_name = (u or {}).get("full_name") or user_id
+        send_report_to_relay(original_from=user_id, original_text=edit_text, user_name=user_name, is_edit=True)
+        
+        clear_state(user_id)
+        client.send_message(to=user_id, text="✅ Обновлено")
+        show_main_menu(client, user_id, u)
+    else:
+        client.send_message(to=user_id, text="❌ Не получилось обновить")
+
+def _state_adm_wait_act_add(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Админ: добавление вида работы."""
+    grp = state["data"].get("act_grp", GROUP_TECH)
+    if add_activity(grp, message_text):
+        client.send_message(to=user_id, text=f"✅ Вид работы '{message_text}' добавлен.")
+    else:
+        client.send_message(to=user_id, text="❌ Ошибка или такой вид работ уже есть.")
+    back_to_main_menu(client, user_id)
+
+def _state_adm_wait_act_del(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Админ: удаление вида работы."""
+    if message_text == "0":
+        client.send_message(to=user_id, text="Выберите *группу работы*:", buttons=_ACT_ADMIN_MENU)
+        clear_state(user_id)
         return
     
-    if current_state == "brig_potato_rows":
-        txt = message_text.strip()
-        if txt == "0":
-            if go_back(client, user_id):
-                return
-        if not txt.isdigit():
-            buttons = [Button(title="🔙 Назад", callback_data="back:prev")]
-            client.send_message(to=user_id, text="❌ Введите число (количество выкопанных рядов):", buttons=buttons)
-            return
-        rows = int(txt)
-        state["data"] = state.get("data", {}) or {}
-        state["data"]["rows"] = rows
-        state["data"]["brig_stage"] = "brig_potato_rows"
-        logging.info(f"[BRIG] {user_id} potato rows set -> {rows}, data={state['data']}")
-        back_cb = f"brig:report:date:{state['data']['date']}" if state["data"].get("date") else "menu:brigadier"
-        set_state(user_id, "brig_potato_field", state["data"], save_to_history=True, back_callback=back_cb)
-        buttons = [Button(title="🔙 Назад", callback_data="back:prev")]
-        client.send_message(to=user_id, text="Введите *название поля*:", buttons=buttons)
+    acts = state["data"].get("acts_del", [])
+    found = find_best_match(message_text, acts)
+    if not found:
+        client.send_message(to=user_id, text="❌ Не удалось распознать. Введите номер или название (или 0 для возврата).")
         return
+    
+    _, act_name = found
+    if remove_activity(act_name):
+        client.send_message(to=user_id, text=f"✅ Вид работы '{act_name}' удален.")
+    else:
+        client.send_message(to=user_id, text="❌ Не найдено.")
+    back_to_main_menu(client, user_id)
 
-    if current_state == "brig_potato_field":
-        txt = message_text.strip()
-        if txt == "0":
-            if go_back(client, user_id):
-                return
-        state["data"] = state.get("data", {}) or {}
-        state["data"]["field"] = txt
-        logging.info(f"[BRIG] {user_id} potato field set -> {txt}")
-        set_state(user_id, "brig_potato_bags", state["data"], save_to_history=True, back_callback="back:prev")
-        buttons = [Button(title="🔙 Назад", callback_data="back:prev")]
-        client.send_message(to=user_id, text="Введите *количество сеток*:", buttons=buttons)
+def _state_adm_wait_loc_add(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Админ: добавление локации."""
+    if add_location(GROUP_FIELDS, message_text):
+        client.send_message(to=user_id, text=f"✅ Локация '{message_text}' добавлена.")
+    else:
+        client.send_message(to=user_id, text="❌ Ошибка или такая локация уже есть.")
+    back_to_main_menu(client, user_id)
+
+def _state_adm_wait_loc_del(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Админ: удаление локации."""
+    if message_text == "0":
+        client.send_message(to=user_id, text="⚙️ *Управление локациями*:", buttons=_LOC_ADMIN_MENU)
+        clear_state(user_id)
         return
     
-    if current_state == "brig_potato_bags":
-        txt = message_text.strip()
-        if txt == "0":
-            if go_back(client, user_id):
-                return
-        if not txt.isdigit():
-            buttons = [Button(title="🔙 Назад", callback_data="back:prev")]
-            client.send_message(to=user_id, text="❌ Введите число (количество сеток):", buttons=buttons)
-            return
-        bags = int(txt)
-        state["data"] = state.get("data", {}) or {}
-        state["data"]["bags"] = bags
-        logging.info(f"[BRIG] {user_id} potato bags set -> {bags}, data={state['data']}")
-        set_state(user_id, "brig_potato_workers", state["data"], save_to_history=True, back_callback="back:prev")
-        buttons = [Button(title="🔙 Назад", callback_data="back:prev")]
-        client.send_message(to=user_id, text="Введите *количество людей*:", buttons=buttons)
+    locs = state["data"].get("locs_del", [])
+    found = find_best_match(message_text, locs)
+    if not found:
+        client.send_message(to=user_id, text="❌ Не удалось распознать. Введите номер или название (или 0 для возврата).")
         return
     
-    if current_state == "brig_potato_workers":
-        txt = message_text.strip()
+    _, loc_name = found
+    if remove_location(loc_name):
+        client.send_message(to=user_id, text=f"✅ Локация '{loc_name}' удалена.")
+    else:
+        client.send_message(to=user_id, text="❌ Не найдено.")
+    back_to_main_menu(client, user_id)
+
+# -----------------------------
+# Обработчики для бригадиров
+# -----------------------------
+
+# Тексты подтверждения отчета бригадира (ключи temp_report + d_str)
+_CONFIRM_ZUCCHINI = (
+    "📋 *Проверьте данные*\n\n"
+    "📅 Дата: *{d_str}*\n"
+    "Тип: *{work_type}*\n"
+    "Рядов: *{rows}*\n"
+    "Поле: *{field}*\n"
+    "Людей: *{workers}*\n\n"
+    "Все верно?"
+)
+_CONFIRM_POTATO = (
+    "📋 *Проверьте данные*\n\n"
+    "📅 Дата: *{d_str}*\n"
+    "Тип: *{work_type}*\n"
+    "Рядов: *{rows}*\n"
+    "Сеток: *{bags}*\n"
+    "Поле: *{field}*\n"
+    "Людей: *{workers}*\n\n"
+    "Все верно?"
+)
+
+def _state_brig_zucchini_rows(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Бригадир, кабачок: количество рядов."""
+    logging.info(f"[BRIG] state=brig_zucchini_rows enter handler user={user_id} data={state.get('data', {})}")
+    try:
+        txt = message_text
+        logging.info(f"[BRIG] enter zucchini_rows user={user_id} text='{txt}' state={state.get('data', {})}")
         if txt == "0":
             if go_back(client, user_id):
                 return
-        if not txt.isdigit():
-            buttons = [Button(title="🔙 Назад", callback_data="back:prev")]
-            client.send_message(to=user_id, text="❌ Введите число (количество людей):", buttons=buttons)
+        rows = _parse_uint(txt)
+        if rows is None:
+            buttons = BACK_BUTTONS
+            client.send_message(to=user_id, text="❌ Введите число (количество рядов):", buttons=buttons)
+            return
+        data = state["data"] = state.get("data", {}) or {}
+        if "work_type" not in data:
+            data["work_type"] = "Кабачок"
+        if "date" not in data:
+            data["date"] = date.today().isoformat()
+        work_date = data["date"]
+        data["rows"] = rows
+        data["brig_stage"] = "brig_zucchini_rows"
+        logging.info(f"[BRIG] {user_id} zucchini rows set -> {rows}, data={data}")
+        back_cb = f"brig:report:date:{work_date}"
+        set_state(user_id, "brig_zucchini_field", data, push_history=True, back_callback=back_cb)
+        buttons = BACK_BUTTONS
+        client.send_message(to=user_id, text="Введите *название поля*:", buttons=buttons)
+        logging.info(f"[BRIG] prompt field sent to {user_id}")
+    except Exception as e:
+        logging.exception(f"[BRIG] error in zucchini_rows for user {user_id}: {e}")
+        buttons = BACK_BUTTONS
+        client.send_message(to=user_id, text="❌ Ошибка при обработке рядов, попробуйте еще раз.", buttons=buttons)
+        logging.info(f"[BRIG] prompt error sent to {user_id}")
+
+def _state_brig_zucchini_field(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Бригадир, кабачок: название поля."""
+    txt = message_text
+    if txt == "0":
+        if go_back(client, user_id):
             return
-        workers = int(txt)
-        logging.info(f"[BRIG] {user_id} potato workers set -> {workers}")
-        work_date = state["data"].get("date", date.today().isoformat())
-        temp_report = {
-            "work_type": state["data"]["work_type"],
-            "rows": state["data"]["rows"],
-            "field": state["data"]["field"],
-            "bags": state["data"]["bags"],
-            "workers": workers,
-            "work_date": work_date
-        }
-        
-        state["data"]["temp_report"] = temp_report
-        set_state(user_id, "waiting_confirmation_brigadier", state["data"])
-        
-        d_str = date.fromisoformat(work_date).strftime("%d.%m.%Y")
-        
-        text = (
-            f"📋 *Проверьте данные*\n\n"
-            f"📅 Дата: *{d_str}*\n"
-            f"Тип: *{temp_report['work_type']}*\n"
-            f"Рядов: *{temp_report['rows']}*\n"
-            f"Сеток: *{temp_report['bags']}*\n"
-            f"Поле: *{temp_report['field']}*\n"
-            f"Людей: *{workers}*\n\n"
-            f"Все верно?"
-        )
-        
-        buttons = [
-            Button(title="✅ Подтвердить", callback_data="confirm:brig"),
-            Button(title="✏️ Изменить", callback_data="edit:brig")
-        ]
-        
-        client.send_message(to=user_id, text=text, buttons=buttons)
-        return
-    
-    if current_state == "adm_wait_brigadier_add":
-        phone = message_text.strip()
-        parts = phone.split(maxsplit=1)
-        if len(parts) == 2 and parts[0].isdigit():
-            phone = parts[0]
-            name = parts[1]
-            target_user = get_user(phone)
-            if not target_user:
-                upsert_user(phone, name, TZ)
-            else:
-                upsert_user(phone, name, TZ)
-                
-            if add_brigadier(phone, name, name, user_id):
-                client.send_message(to=user_id, text=f"✅ Бригадир *{name}* ({phone}) добавлен.")
-            else:
-                client.send_message(to=user_id, text="❌ Этот пользователь уже является бригадиром.")
-            
-            clear_state(user_id)
-            u = get_user(user_id)
-            show_main_menu(client, user_id, u)
+    state["data"] = state.get("data", {}) or {}
+    state["data"]["field"] = txt
+    logging.info(f"[BRIG] {user_id} zucchini field set -> {txt}")
+    set_state(user_id, "brig_zucchini_workers", state["data"], push_history=True, back_callback="back:prev")
+    buttons = BACK_BUTTONS
+    client.send_message(to=user_id, text="Введите *количество людей*:", buttons=buttons)
+
+def _state_brig_zucchini_workers(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Бригадир, кабачок: количество людей и подтверждение."""
+    txt = message_text
+    if txt == "0":
+        if go_back(client, user_id):
             return
+    workers = _parse_uint(txt)
+    if workers is None:
+        buttons = BACK_BUTTONS
+        client.send_message(to=user_id, text="❌ Введите число (количество людей):", buttons=buttons)
+        return
+    data = state["data"] = state.get("data", {}) or {}
+    work_date = data.get("date", date.today().isoformat())
+    temp_report = {
+        "work_type": data.get("work_type", "Кабачок"),
+        "rows": data.get("rows", 0),
+        "field": data.get("field", ""),
+        "bags": 0,
+        "workers": workers,
+        "work_date": work_date
+    }
+    data["temp_report"] = temp_report
+    logging.info(f"[BRIG] {user_id} zucchini workers set -> {workers}, report={temp_report}")
+    set_state(user_id, "waiting_confirmation_brigadier", data, push_history=True, back_callback="back:prev")
+    d_str = _iso_to_ddmmyyyy(work_date)
+    text = _CONFIRM_ZUCCHINI.format_map({**temp_report, "d_str": d_str})
+    buttons = CONFIRM_BRIG_BUTTONS
+    client.send_message(to=user_id, text=text, buttons=buttons)
 
-        if not phone.isdigit() or len(phone) < 10:
-            client.send_message(to=user_id, text="❌ Введите корректный номер телефона (например: 79001234567) или 'Номер Имя':")
+def _state_brig_potato_rows(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Бригадир, картошка: количество рядов."""
+    txt = message_text
+    if txt == "0":
+        if go_back(client, user_id):
             return
-        
-        state["data"]["brig_phone"] = phone
-        set_state(user_id, "adm_wait_brigadier_name", state["data"])
-        client.send_message(to=user_id, text="✏️ Введите *Имя бригадира*:")
+    rows = _parse_uint(txt)
+    if rows is None:
+        buttons = BACK_BUTTONS
+        client.send_message(to=user_id, text="❌ Введите число (количество выкопанных рядов):", buttons=buttons)
         return
-
-    if current_state == "adm_wait_brigadier_name":
-        name = message_text.strip()
-        if len(name) < 2:
-            client.send_message(to=user_id, text="❌ Слишком короткое имя. Попробуйте еще раз:")
+    data = state["data"] = state.get("data", {}) or {}
+    data["rows"] = rows
+    data["brig_stage"] = "brig_potato_rows"
+    logging.info(f"[BRIG] {user_id} potato rows set -> {rows}, data={data}")
+    back_cb = f"brig:report:date:{state['data']['date']}" if data.get("date") else "menu:brigadier"
+    set_state(user_id, "brig_potato_field", data, push_history=True, back_callback=back_cb)
+    buttons = BACK_BUTTONS
+    client.send_message(to=user_id, text="Введите *название поля*:", buttons=buttons)
+
+def _state_brig_potato_field(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Бригадир, картошка: название поля."""
+    txt = message_text
+    if txt == "0":
+        if go_back(client, user_id):
             return
-            
-        phone = state["data"].get("brig_phone")
-        if not phone:
-            client.send_message(to=user_id, text="❌ Ошибка состояния. Начните заново.")
-            clear_state(user_id)
+    state["data"] = state.get("data", {}) or {}
+    state["data"]["field"] = txt
+    logging.info(f"[BRIG] {user_id} potato field set -> {txt}")
+    set_state(user_id, "brig_potato_bags", state["data"], push_history=True, back_callback="back:prev")
+    buttons = BACK_BUTTONS
+    client.send_message(to=user_id, text="Введите *количество сеток*:", buttons=buttons)
+
+def _state_brig_potato_bags(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Бригадир, картошка: количество сеток."""
+    txt = message_text
+    if txt == "0":
+        if go_back(client, user_id):
+            return
+    bags = _parse_uint(txt)
+    if bags is None:
+        buttons = BACK_BUTTONS
+        client.send_message(to=user_id, text="❌ Введите число (количество сеток):", buttons=buttons)
+        return
+    state["data"] = state.get("data", {}) or {}
+    state["data"]["bags"] = bags
+    logging.info(f"[BRIG] {user_id} potato bags set -> {bags}, data={state['data']}")
+    set_state(user_id, "brig_potato_workers", state["data"], push_history=True, back_callback="back:prev")
+    buttons = BACK_BUTTONS
+    client.send_message(to=user_id, text="Введите *количество людей*:", buttons=buttons)
+
+def _state_brig_potato_workers(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Бригадир, картошка: количество людей и подтверждение."""
+    data = state["data"]
+    txt = message_text
+    if txt == "0":
+        if go_back(client, user_id):
             return
+    workers = _parse_uint(txt)
+    if workers is None:
+        buttons = BACK_BUTTONS
+        client.send_message(to=user_id, text="❌ Введите число (количество людей):", buttons=buttons)
+        return
+    logging.info(f"[BRIG] {user_id} potato workers set -> {workers}")
+    work_date = data.get("date", date.today().isoformat())
+    temp_report = {
+        "work_type": data["work_type"],
+        "rows": data["rows"],
+        "field": data["field"],
+        "bags": data["bags"],
+        "workers": workers,
+        "work_date": work_date
+    }
+    
+    data["temp_report"] = temp_report
+    set_state(user_id, "waiting_confirmation_brigadier", data)
+    
+    d_str = _iso_to_ddmmyyyy(work_date)
+    
+    text = _CONFIRM_POTATO.format_map({**temp_report, "d_str": d_str})
+    
+    buttons = CONFIRM_BRIG_BUTTONS
+    
+    client.send_message(to=user_id, text=text, buttons=buttons)
+
+def _state_adm_wait_brigadier_add(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Админ: номер нового бригадира."""
+    phone = message_text
+    parts = phone.split(maxsplit=1)
+    if len(parts) == 2 and parts[0].isdigit():
+        phone = parts[0]
+        name = parts[1]
+        target_user = get_user(phone)
+        if not target_user:
+            upsert_user(phone, name, TZ)
+        else:
+            upsert_user(phone, name, TZ)
             
-        upsert_user(phone, name, TZ)
-        
         if add_brigadier(phone, name, name, user_id):
             client.send_message(to=user_id, text=f"✅ Бригадир *{name}* ({phone}) добавлен.")
         else:
             client.send_message(to=user_id, text="❌ Этот пользователь уже является бригадиром.")
         
+        back_to_main_menu(client, user_id)
+        return
+
+    if not phone.isdigit() or len(phone) < 10:
+        client.send_message(to=user_id, text="❌ Введите корректный номер телефона (например: 79001234567) или 'Номер Имя':")
+        return
+    
+    state["data"]["brig_phone"] = phone
+    set_state(user_id, "adm_wait_brigadier_name", state["data"])
+    client.send_message(to=user_id, text="✏️ Введите *Имя бригадира*:")
+
+def _state_adm_wait_brigadier_name(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Админ: имя нового бригадира."""
+    name = message_text
+    if len(name) < 2:
+        client.send_message(to=user_id, text="❌ Слишком короткое имя. Попробуйте еще раз:")
+        return
+        
+    phone = state["data"].get("brig_phone")
+    if not phone:
+        client.send_message(to=user_id, text="❌ Ошибка состояния. Начните заново.")
         clear_state(user_id)
-        u = get_user(user_id)
-        show_main_menu(client, user_id, u)
         return
+        
+    upsert_user(phone, name, TZ)
     
-    if current_state == "adm_wait_brigadier_del":
-        if message_text == "0":
-            buttons = [
-                Button(title="➕ Добавить бригадира", callback_data="adm:add:brigadier"),
-                Button(title="➖ Удалить бригадира", callback_data="adm:del:brigadier"),
-                Button(title="📋 Список бригадиров", callback_data="adm:list:brigadiers"),
-            ]
-            client.send_message(to=user_id, text="👷 *Управление бригадирами*:", buttons=buttons)
-            clear_state(user_id)
+    if add_brigadier(phone, name, name, user_id):
+        client.send_message(to=user_id, text=f"✅ Бригадир *{name}* ({phone}) добавлен.")
+    else:
+        client.send_message(to=user_id, text="❌ Этот пользователь уже является бригадиром.")
+    
+    back_to_main_menu(client, user_id)
+
+def _state_adm_wait_brigadier_del(client: WhatsApp360Client, user_id: str, state: dict, message_text: str):
+    """Админ: удаление бригадира."""
+    if message_text == "0":
+        client.send_message(to=user_id, text="👷 *Управление бригадирами*:", buttons=_BRIG_ADMIN_MENU)
+        clear_state(user_id)
+        return
+    
+    brigadiers = (state.get("data") or {}).get("brigadiers_list") or get_all_brigadiers()
+    if not brigadiers:
+        client.send_message(to=user_id, text="❌ Нет сохраненного списка бригадиров. Попробуйте снова через меню.")
+        clear_state(user_id)
+        return
+
+    user_input = message_text
+    brig = None
+
+    num = _parse_uint(user_input)
+    if num is not None:
+        idx = num - 1
+        if 0 <= idx < len(brigadiers):
+            brig = brigadiers[idx]
+        else:
+            client.send_message(to=user_id, text="❌ Неверный номер. Введите номер из списка или телефон бригадира.")
             return
-        
-        brigadiers = (state.get("data") or {}).get("brigadiers_list") or get_all_brigadiers()
-        if not brigadiers:
-            client.send_message(to=user_id, text="❌ Нет сохраненного списка бригадиров. Попробуйте снова через меню.")
-            clear_state(user_id)
+    else:
+        normalized_input = _normalize_phone(user_input)
+        for b in brigadiers:
+            brig_uid = b[0]
+            if _normalize_phone(brig_uid) == normalized_input:
+                brig = b
+                break
+        if not brig:
+            client.send_message(to=user_id, text="❌ Не найден бригадир. Введите номер из списка или телефон/ID бригадира.")
             return
 
-        user_input = message_text.strip()
-        brig = None
-
-        if user_input.isdigit():
-            idx = int(user_input) - 1
-            if 0 <= idx < len(brigadiers):
-                brig = brigadiers[idx]
-            else:
-                client.send_message(to=user_id, text="❌ Неверный номер. Введите номер из списка или телефон бригадира.")
-                return
+    brig_id, brig_uname, brig_fname = brig[:3]
+    
+    try:
+        if remove_brigadier(brig_id):
+            client.send_message(to=user_id, text=f"✅ Бригадир *{brig_fname or brig_uname}* удален.")
         else:
-            normalized_input = _normalize_phone(user_input)
-            for b in brigadiers:
-                brig_uid = b[0]
-                if _normalize_phone(brig_uid) == normalized_input:
-                    brig = b
-                    break
-            if not brig:
-                client.send_message(to=user_id, text="❌ Не найден бригадир. Введите номер из списка или телефон/ID бригадира.")
-                return
+            client.send_message(to=user_id, text="❌ Не удалось удалить.")
+    except Exception as e:
+        logging.error(f"adm_wait_brigadier_del remove error for {brig_id}: {e}")
+        client.send_message(to=user_id, text="❌ Ошибка при удалении. Попробуйте позже.")
+    
+    back_to_main_menu(client, user_id)
+
+
+STATE_HANDLERS: Dict[str, Callable[[WhatsApp360Client, str, dict, str], None]] = {
+    "waiting_name": _state_waiting_name,
+    "waiting_activity_selection": _state_waiting_activity_selection,
+    "waiting_custom_activity_input": _state_waiting_custom_activity_input,
+    "waiting_location_selection": _state_waiting_location_selection,
+    "waiting_date_selection_universal": _state_waiting_date_selection_universal,
+    "it_waiting_hours": _state_it_waiting_hours,
+    "waiting_hours": _state_waiting_hours,
+    "waiting_record_selection": _state_waiting_record_selection,
+    "tim_wait_activity": _state_tim_wait_activity,
+    "tim_wait_location": _state_tim_wait_location,
+    "tim_wait_hours": _state_tim_wait_hours,
+    "work_tractor_activity_custom": _state_work_tractor_activity_custom,
+    "work_tractor_machinery": _state_work_tractor_machinery,
+    "work_tractor_machinery_custom": _state_work_tractor_machinery_custom,
+    "work_tractor_activity": _state_work_tractor_activity,
+    "work_tractor_field": _state_work_tractor_field,
+    "work_tractor_crop": _state_work_tractor_crop,
+    "work_tractor_crop_custom": _state_work_tractor_crop_custom,
+    "work_kamaz_crop": _state_work_kamaz_crop,
+    "work_kamaz_trips": _state_work_kamaz_trips,
+    "work_kamaz_loading": _state_work_kamaz_loading,
+    "work_kamaz_loading_custom": _state_work_kamaz_loading_custom,
+    "work_kamaz_crop_custom": _state_work_kamaz_crop_custom,
+    "work_manual_activity": _state_work_manual_activity,
+    "work_manual_activity_custom": _state_work_manual_activity_custom,
+    "work_manual_field": _state_work_manual_field,
+    "work_manual_field_custom": _state_work_manual_field_custom,
+    "work_manual_crop": _state_work_manual_crop,
+    "work_manual_crop_custom": _state_work_manual_crop_custom,
+    "waiting_hours_prefill": _state_waiting_hours_prefill,
+    "waiting_del_selection": _state_waiting_del_selection,
+    "waiting_edit_selection_multi": _state_waiting_edit_selection_multi,
+    "waiting_edit_queue_hours": _state_waiting_edit_queue_hours,
+    "wait_del_brig_select": _state_wait_del_brig_select,
+    "wait_edit_brig_select": _state_wait_edit_brig_select,
+    "wait_edit_brig_rows": _state_wait_edit_brig_rows,
+    "waiting_edit_hours": _state_waiting_edit_hours,
+    "adm_wait_act_add": _state_adm_wait_act_add,
+    "adm_wait_act_del": _state_adm_wait_act_del,
+    "adm_wait_loc_add": _state_adm_wait_loc_add,
+    "adm_wait_loc_del": _state_adm_wait_loc_del,
+    "brig_zucchini_rows": _state_brig_zucchini_rows,
+    "brig_zucchini_field": _state_brig_zucchini_field,
+    "brig_zucchini_workers": _state_brig_zucchini_workers,
+    "brig_potato_rows": _state_brig_potato_rows,
+    "brig_potato_field": _state_brig_potato_field,
+    "brig_potato_bags": _state_brig_potato_bags,
+    "brig_potato_workers": _state_brig_potato_workers,
+    "adm_wait_brigadier_add": _state_adm_wait_brigadier_add,
+    "adm_wait_brigadier_name": _state_adm_wait_brigadier_name,
+    "adm_wait_brigadier_del": _state_adm_wait_brigadier_del,
+}
+
+# Состояния, ожидающие только число: нецифровой ввод отсекается один раз до вызова
+# обработчика ("0" — тоже цифра, поэтому кнопка возврата доходит до обработчика)
+NUMERIC_STATE_ERRORS: Dict[str, str] = {
+    "waiting_date_selection_universal": "❌ Введите номер даты из списка или 0.",
+    "waiting_record_selection": "❌ Введите номер записи из списка или 0.",
+    "tim_wait_hours": "❌ Введите число.",
+    "work_tractor_crop": "❌ Введите номер культуры или 0 для возврата.",
+    "work_kamaz_trips": "❌ Введите число рейсов или 0 для возврата.",
+    "work_manual_crop": "❌ Введите номер культуры или 0 для возврата.",
+    "waiting_hours_prefill": "❌ Введите число (1-24) или 0 для возврата назад.",
+    "waiting_edit_queue_hours": "❌ Введите число.",
+    "wait_edit_brig_select": "❌ Неверный номер.",
+    "wait_edit_brig_rows": "❌ Введите число.",
+    "waiting_edit_hours": "❌ Введите число (1-24) или 0 для возврата.",
+}
 
-        brig_id, brig_uname, brig_fname, _, _ = brig
-        
-        try:
-            if remove_brigadier(brig_id):
-                client.send_message(to=user_id, text=f"✅ Бригадир *{brig_fname or brig_uname}* удален.")
-            else:
-                client.send_message(to=user_id, text="❌ Не удалось удалить.")
-        except Exception as e:
-            logging.error(f"adm_wait_brigadier_del remove error for {brig_id}: {e}")
-            client.send_message(to=user_id, text="❌ Ошибка при удалении. Попробуйте позже.")
-        
-        clear_state(user_id)
-        u = get_user(user_id)
-        show_main_menu(client, user_id, u)
+# -----------------------------
+# Обработка текстовых сообщений
+# -----------------------------
+
+@wa.on_message
+def handle_text(client: WhatsApp360Client, msg: MessageObject):
+    if not msg.from_user or not msg.from_user.wa_id:
+        return
+
+    user_id = msg.from_user.wa_id
+    message_text = (msg.text or "").strip()
+    if not message_text:
+        # Пустой текст (медиа, пробелы) — ни команд, ни шагов FSM не трогаем
+        logging.debug("[TEXT] empty from %s", user_id)
+        return
+    logging.info("[TEXT] %s: %s", user_id, message_text)
+
+    # 1. Обработка команд
+    # Глобальный сброс
+    if message_text == "00":
+        client.send_message(to=user_id, text="🔄 Сброс в главное меню")
+        back_to_main_menu(client, user_id)
+        return
+
+    norm_text = message_text.lower()
+
+    # Команды: один поиск по словарю вместо цепочки сравнений
+    handler = TEXT_COMMANDS.get(norm_text)
+    if handler is not None and handler(client, msg, user_id):
+        return
+
+    # 2. Обработка состояний (FSM)
+    state = get_state(user_id)
+    current_state = state.get("state")
+    
+    logging.info("📩 Message from %s: '%s' | State: %s", user_id, message_text, current_state)
+
+    # Восстановление шага бригадира, если состояние потерялось, но данные остались
+    brig_stage = state.get("data", {}).get("brig_stage")
+    if not current_state and brig_stage in BRIG_RESTORABLE_STATES:
+        set_state(user_id, brig_stage, state.get("data", {}), push_history=False)
+        current_state = brig_stage
+        state = get_state(user_id)
+
+    if current_state and current_state.startswith("brig_"):
+        logging.info("[BRIG] state_entry user=%s state=%s text='%s' data=%s", user_id, current_state, message_text, state.get("data", {}))
+
+    numeric_error = NUMERIC_STATE_ERRORS.get(current_state)
+    if numeric_error is not None and _parse_uint(message_text) is None:
+        client.send_message(to=user_id, text=numeric_error)
+        return
+
+    state_handler = STATE_HANDLERS.get(current_state)
+    if state_handler is not None:
+        state_handler(client, user_id, state, message_text)
         return
 
     u = get_user(user_id)
@@ -5254,8 +5703,7 @@ def process_edit_queue(client, user_id, data):
         show_main_menu(client, user_id, u)
         return
         
-    item = queue[idx]
-    rid, wdate, act, loc, h, _ = item
+    rid, wdate, act, loc, h = queue[idx][:5]
     
     text = (
         f"📝 *Редактирование записи {idx+1}/{len(queue)}*\n"
@@ -5273,6 +5721,32 @@ def process_edit_queue(client, user_id, data):
 # Запуск
 # -----------------------------
 
+def _first_message(data: dict) -> dict:
+    """entry[0].changes[0].value.messages[0] или {} (статусы и прочие события без сообщений)."""
+    try:
+        return data["entry"][0]["changes"][0]["value"]["messages"][0] or {}
+    except (KeyError, IndexError, TypeError):
+        return {}
+
+# Обработка вебхуков вне HTTP-потока: ответ 360dialog уходит сразу, без ожидания FSM,
+# SQLite и исходящих запросов. Однопоточный исполнитель на шард сохраняет порядок
+# сообщений одного пользователя (номер всегда попадает в тот же шард).
+WEBHOOK_WORKERS = max(1, int(os.getenv("WEBHOOK_WORKERS", "8")))
+_WEBHOOK_EXECUTORS = [
+    ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"webhook{i}") for i in range(WEBHOOK_WORKERS)
+]
+
+def _process_webhook_job(data: dict):
+    try:
+        wa.process_webhook(data)
+    except Exception as e:
+        logging.exception(f"❌ Ошибка обработки webhook: {e}")
+
+def dispatch_webhook(data: dict, sender: Optional[str]):
+    """Поставить webhook в очередь шарда отправителя."""
+    executor = _WEBHOOK_EXECUTORS[hash(sender or "") % WEBHOOK_WORKERS]
+    executor.submit(_process_webhook_job, data)
+
 @app.route("/webhook", methods=["GET", "POST"])
 def webhook():
     if request.method == "GET":
@@ -5285,22 +5759,13 @@ def webhook():
         return "Empty payload", 400
         
     # Deduplication check for messages
-    try:
-        entry = data.get("entry", [])
-        if entry:
-            changes = entry[0].get("changes", [])
-            if changes:
-                value = changes[0].get("value", {})
-                messages = value.get("messages", [])
-                if messages:
-                    msg_id = messages[0].get("id")
-                    if msg_id and is_message_processed(msg_id):
-                        logging.info(f"♻️ Duplicate message ignored: {msg_id}")
-                        return "Duplicate ignored", 200
-    except Exception as e:
-        logging.error(f"Error checking duplicate: {e}")
+    first = _first_message(data)
+    msg_id = first.get("id")
+    if msg_id and is_message_processed(msg_id):
+        logging.info(f"♻️ Duplicate message ignored: {msg_id}")
+        return "Duplicate ignored", 200
 
-    wa.process_webhook(data)
+    dispatch_webhook(data, first.get("from"))
     return "OK", 200
 
 @app.route("/github-webhook", methods=["POST"])
@@ -5316,14 +5781,8 @@ def github_webhook():
     # Проверка секрета (если настроен в GitHub)
     signature = request.headers.get("X-Hub-Signature-256", "")
     if signature:
-        import hmac
-        import hashlib
         payload = request.get_data()
-        expected_signature = "sha256=" + hmac.new(
-            GITHUB_WEBHOOK_SECRET.encode(),
-            payload,
-            hashlib.sha256
-        ).hexdigest()
+        expected_signature = "sha256=" + hmac.digest(GITHUB_WEBHOOK_SECRET_BYTES, payload, "sha256").hex()
         if not hmac.compare_digest(signature, expected_signature):
             logging.warning("❌ Неверная подпись GitHub webhook")
             return "Invalid signature", 403
@@ -5346,29 +5805,21 @@ def github_webhook():
     
     logging.info("🔄 Получен GitHub webhook для обновления бота")
     
-    # Запуск скрипта обновления в фоне
-    import subprocess
-    import threading
-    
-    def run_update():
-        try:
-            script_path = "/root/bot/update_bot.sh"
-            result = subprocess.run(
-                ["bash", script_path],
-                capture_output=True,
-                text=True,
-                timeout=300
+    # Запуск скрипта обновления отдельным процессом: вывод пишется сразу в лог,
+    # бот не держит поток и буферы, пока скрипт его перезапускает
+    try:
+        with open(UPDATE_LOG_PATH, "ab") as log_file:
+            subprocess.Popen(
+                ["bash", UPDATE_SCRIPT_PATH],
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+                stdin=subprocess.DEVNULL,
+                start_new_session=True,
+                close_fds=True,
             )
-            if result.returncode == 0:
-                logging.info("✅ Бот успешно обновлен и перезапущен")
-            else:
-                logging.error(f"❌ Ошибка обновления: {result.stderr}")
-        except Exception as e:
-            logging.error(f"❌ Ошибка выполнения скрипта обновления: {e}")
-    
-    # Запускаем обновление в отдельном потоке, чтобы не блокировать ответ
-    thread = threading.Thread(target=run_update, daemon=True)
-    thread.start()
+    except Exception as e:
+        logging.error(f"❌ Ошибка запуска скрипта обновления: {e}")
+        return jsonify({"status": "update_failed"}), 500
     
     return jsonify({"status": "update_started"}), 200
 
@@ -5386,10 +5837,13 @@ if __name__ == "__main__":
     # Scheduler setup
     scheduler = BackgroundScheduler(timezone=TZ)
     
-    # Reminder job (every minute)
-    scheduler.add_job(check_reminders, 'interval', minutes=1)
+    # Reminder job: каждую минуту, но только в окне 14:00–19:59 (TZ планировщика)
+    scheduler.add_job(check_reminders, CronTrigger(hour="14-19", minute="*"))
     logging.info("⏰ Reminder scheduler started")
 
+    # Очистка неактивных состояний диалога
+    scheduler.add_job(purge_expired_states, 'interval', minutes=30)
+
     if AUTO_EXPORT_ENABLED:
         cron_parts = AUTO_EXPORT_CRON.split()
         if len(cron_parts) == 5:
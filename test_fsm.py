@@ -6,8 +6,10 @@
 Использование:
     python test_fsm.py
 """
+import os
 import sys
 import io
+import tempfile
 
 # Настройка кодировки для Windows
 if sys.platform == 'win32':
@@ -310,6 +312,99 @@ def test_multiple_users():
         return False
 
 
+def _load_bot():
+    """Импорт bot.py: обязательные переменные окружения подставляются тестовыми."""
+    for key in ("WHATSAPP_TOKEN", "WHATSAPP_PHONE_ID", "VERIFY_TOKEN"):
+        os.environ.setdefault(key, "test")
+    import bot
+    return bot
+
+
+def test_parse_uint():
+    """Тест 6: Разбор числового ответа (_parse_uint)"""
+    print_header("ТЕСТ 6: Разбор числового ответа")
+    
+    try:
+        bot = _load_bot()
+        
+        assert bot._parse_uint("12") == 12, "'12' должно разбираться в 12"
+        assert bot._parse_uint("0") == 0, "'0' должно разбираться в 0"
+        print_success("Обычные числа разбираются")
+        
+        # '²'.isdigit() == True, но int('²') падает с ValueError
+        for text in ("²", "١٢", "-1", "1.5", "", "abc"):
+            result = bot._parse_uint(text)
+            print_info(f"_parse_uint({text!r}) = {result}")
+            assert result is None, f"{text!r} должно давать None"
+        print_success("Нечисловой ввод и не-ASCII цифры дают None")
+        
+        return True
+    except Exception as e:
+        print_error(f"Ошибка: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_brigadier_recent_reports():
+    """Тест 7: Списки изменения/удаления отчетов бригадира"""
+    print_header("ТЕСТ 7: Списки изменения/удаления отчетов бригадира")
+    
+    bot = _load_bot()
+    old_db_path = bot.DB_PATH
+    tmp_dir = tempfile.TemporaryDirectory()
+    # Временная БД: соединение потока открывается заново по новому DB_PATH
+    bot.DB_PATH = os.path.join(tmp_dir.name, "test_reports.db")
+    bot._db_local.con = None
+    phone = "test_brig_79990000000"
+    
+    class FakeClient:
+        def __init__(self):
+            self.sent = []
+        
+        def send_message(self, to, text, buttons=None):
+            self.sent.append(text)
+    
+    try:
+        bot.init_db()
+        bot.add_brigadier(phone, "brig", "Бригадир Тест", "test")
+        bot.save_brigadier_report(phone, "brig", "Кабачок", 12, "Поле 1", 0, 5, "2026-01-15")
+        print_info("Бригадир и отчет добавлены во временную БД")
+        
+        # Раньше запрос падал: no such column: created_at
+        rows = bot.connect().execute(bot.SQL_BRIG_RECENT_REPORTS, (phone,)).fetchall()
+        print_info(f"SQL_BRIG_RECENT_REPORTS -> {rows}")
+        assert len(rows) == 1, "Ожидалась одна запись бригадира"
+        assert rows[0][1:] == ("2026-01-15", "Кабачок", 12, "Поле 1"), "Неверные поля записи"
+        
+        for name, handler, expected_state in (
+            ("menu:edit_list", bot._cb_menu_edit_list, "wait_edit_brig_select"),
+            ("menu:delete_list", bot._cb_menu_delete_list, "wait_del_brig_select"),
+        ):
+            client = FakeClient()
+            handler(client, None, phone, lambda: bot.get_state(phone))
+            print_state(f"{name}: {client.sent[-1].splitlines()[1]}")
+            assert "1. 2026-01-15 | Кабачок (12р) Поле 1" in client.sent[-1], f"{name}: нет записи в списке"
+            assert bot.get_state(phone)["state"] == expected_state, f"{name}: неверное состояние"
+            bot.clear_state(phone)
+        
+        print_success("Списки изменения и удаления строятся без ошибок")
+        return True
+    except Exception as e:
+        print_error(f"Ошибка: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        con = bot._db_local.con
+        if con is not None:
+            con.close()
+        bot._db_local.con = None
+        bot.DB_PATH = old_db_path
+        bot._is_brigadier_cached.cache_clear()
+        tmp_dir.cleanup()
+
+
 # ============================================================================
 # ГЛАВНАЯ ФУНКЦИЯ
 # ============================================================================
@@ -327,6 +422,8 @@ def main():
         ("Работа с данными", test_state_data),
         ("Полный FSM поток", test_fsm_flow),
         ("Несколько пользователей", test_multiple_users),
+        ("Разбор числового ответа", test_parse_uint),
+        ("Списки отчетов бригадира", test_brigadier_recent_reports),
     ]
     
     results = []
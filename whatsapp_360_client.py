@@ -2,6 +2,8 @@
 # Wrapper для 360dialog WhatsApp API
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
 from typing import List, Dict, Optional, Callable
 from dataclasses import dataclass
@@ -25,6 +27,16 @@ class WhatsApp360Client:
             "D360-API-KEY": api_key,
             "Content-Type": "application/json"
         })
+        # Keep-alive пул соединений: повторные отправки не делают новый TLS handshake.
+        # Retry повторяет только ошибки соединения (POST не ретраится после отправки запроса).
+        # TCP_NODELAY urllib3 выставляет сам (default_socket_options).
+        adapter = HTTPAdapter(
+            pool_connections=8,
+            pool_maxsize=32,
+            max_retries=Retry(total=2, connect=2, read=0, backoff_factor=0.1)
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         
         # Хранилище обработчиков
         self.message_handlers = []